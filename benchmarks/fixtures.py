@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+"""
+Generate synthetic media libraries to benchmark against.
+
+Files are small but valid Matroska: an EBML header, segment info, a track list
+built from a layout, and one empty cluster. A layout is either a preset name or
+a comma-separated list of tracks, each a type and an optional language, like
+"v,a:jpn,s:und,p:eng" (v = video, a = audio, s = text subtitles, p = PGS
+subtitles).
+"""
+
+# Imports {{{
+# builtins
+import argparse
+import pathlib
+import random
+import struct
+import sys
+import zlib
+from typing import List, Optional, Tuple
+
+# }}}
+
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from submerge import ebml  # noqa: E402
+
+# type -> (TrackType, CodecID, default language)
+TRACK_KINDS = {
+    "v": (1, "V_MPEG4/ISO/AVC", "und"),
+    "a": (2, "A_AAC", "eng"),
+    "s": (17, "S_TEXT/UTF8", "und"),
+    "x": (17, "S_TEXT/ASS", "und"),
+    "p": (17, "S_HDMV/PGS", "eng"),
+}
+
+LAYOUTS = {
+    "movie": "v,a:eng,s:eng",
+    "anime": "v,a:jpn,a:eng,s:und,x:und",
+    "remux": "v,a:eng,a:fre,a:spa,s:eng,s:und,p:eng,p:fre,p:spa,s:und,x:und,p:ger",
+}
+
+# other files found in a typical library, to give discovery some chaff
+NOISE = [".srt", ".nfo", ".jpg", ".txt"]
+
+
+Track = Tuple[str, str]
+
+
+def parse_layout(layout: str) -> List[Track]:
+    layout = LAYOUTS.get(layout, layout)
+    tracks = []
+    for token in layout.split(","):
+        kind, _, language = token.strip().partition(":")
+        if kind not in TRACK_KINDS:
+            raise ValueError(f"Unknown track type {kind!r} in layout {layout!r}")
+        tracks.append((kind, language or TRACK_KINDS[kind][2]))
+    return tracks
+
+
+# EBML writer {{{
+def vint(value: int) -> bytes:
+    """
+    Encode an element size, avoiding the all-ones "unknown size" values.
+    """
+    for length in range(1, 9):
+        if value < (1 << (7 * length)) - 1:
+            return ((1 << (7 * length)) | value).to_bytes(length, "big")
+    raise ValueError(f"{value} is too large for an EBML size")
+
+
+def element(id: int, payload: bytes) -> bytes:
+    return id.to_bytes((id.bit_length() + 7) // 8, "big") + vint(len(payload)) + payload
+
+
+def uint(id: int, value: int) -> bytes:
+    return element(id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big"))
+
+
+def string(id: int, value: str) -> bytes:
+    return element(id, value.encode())
+
+
+def double(id: int, value: float) -> bytes:
+    return element(id, struct.pack(">d", value))
+
+
+def master(id: int, payload: bytes, crc: bool = False) -> bytes:
+    """
+    A master element, optionally led by a CRC-32 of its children.
+    """
+    if crc:
+        payload = element(ebml.CRC32, zlib.crc32(payload).to_bytes(4, "little")) + payload
+    return element(id, payload)
+
+
+# }}}
+
+
+def track_entry(
+    number: int,
+    kind: str,
+    language: Optional[str],
+    name: Optional[str] = None,
+    bcp47: bool = False,
+    crc: bool = False,
+) -> bytes:
+    """
+    A TrackEntry. Without a language, the Language element is left out (which
+    means English).
+    """
+    type, codec, _ = TRACK_KINDS[kind]
+    payload = (
+        uint(ebml.TRACK_NUMBER, number)
+        + uint(ebml.TRACK_UID, number * 1000 + 7)
+        + uint(ebml.TRACK_TYPE, type)
+        + string(ebml.CODEC_ID, codec)
+    )
+    if language:
+        payload += string(ebml.LANGUAGE, language)
+        if bcp47:
+            payload += string(ebml.LANGUAGE_BCP47, ebml.bcp47(language))
+    if name:
+        payload += string(ebml.NAME, name)
+    if type == 1:
+        payload += element(
+            ebml.VIDEO, uint(ebml.PIXEL_WIDTH, 1920) + uint(ebml.PIXEL_HEIGHT, 1080)
+        )
+    elif type == 2:
+        payload += element(
+            ebml.AUDIO, double(ebml.SAMPLING_FREQUENCY, 48000.0) + uint(ebml.CHANNELS, 2)
+        )
+    return master(ebml.TRACK_ENTRY, payload, crc)
+
+
+def mkv(
+    tracks: List[Track],
+    title: str = "",
+    padding: int = 66,
+    bcp47: bool = False,
+    crc: bool = False,
+    names: bool = False,
+) -> bytes:
+    """
+    A whole file. `padding` is the length of the Void element after the
+    Tracks element (if any), `crc` adds CRC-32 elements to the Tracks
+    element and its entries, and `names` gives each track a name.
+    """
+    header = element(
+        ebml.EBML,
+        uint(0x4286, 1)  # EBMLVersion
+        + uint(0x42F7, 1)  # EBMLReadVersion
+        + string(ebml.DOC_TYPE, "matroska")
+        + uint(0x4287, 4)  # DocTypeVersion
+        + uint(0x4285, 2),  # DocTypeReadVersion
+    )
+    info = element(
+        ebml.INFO,
+        uint(ebml.TIMESTAMP_SCALE, 1000000)
+        + double(ebml.DURATION, 1500000.0)
+        + string(ebml.TITLE, title),
+    )
+    entries = b"".join(
+        track_entry(
+            number, kind, language, name=f"Track {number}" if names else None, bcp47=bcp47, crc=crc
+        )
+        for number, (kind, language) in enumerate(tracks, 1)
+    )
+    # leave room for in-place edits, as mkvmerge does
+    void = element(ebml.VOID, bytes(padding - 2)) if padding else b""
+    cluster = element(ebml.CLUSTER, uint(0xE7, 0))  # Timestamp
+    segment = element(
+        ebml.SEGMENT, info + master(ebml.TRACKS, entries, crc) + void + cluster
+    )
+    return header + segment
+
+
+def generate(
+    root: pathlib.Path,
+    files: int,
+    layout: str = "anime",
+    depth: int = 2,
+    fanout: int = 4,
+    noise: float = 0.5,
+    seed: int = 0,
+) -> List[pathlib.Path]:
+    """
+    Build a tree of `files` MKVs under root, spread over `fanout` directories
+    per level, `depth` levels deep. The "mixed" layout picks a preset per file.
+    """
+    rng = random.Random(seed)
+    layouts = {name: parse_layout(name) for name in LAYOUTS}
+    fixed = None if layout == "mixed" else parse_layout(layout)
+
+    leaves = [root]
+    for level in range(depth):
+        leaves = [
+            parent / f"{'show' if level == 0 else 'season'}-{i:02}"
+            for parent in leaves
+            for i in range(fanout)
+        ]
+
+    created = []
+    for i in range(files):
+        directory = leaves[i % len(leaves)]
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = f"Show.S{i // 100 + 1:02}E{i % 100 + 1:02}.1080p"
+        tracks = fixed or layouts[rng.choice(sorted(layouts))]
+
+        file = directory / f"{stem}.mkv"
+        file.write_bytes(mkv(tracks, title=stem))
+        created.append(file)
+
+        if rng.random() < noise:
+            (directory / f"{stem}{rng.choice(NOISE)}").write_bytes(b"")
+    return created
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("root", type=pathlib.Path)
+    parser.add_argument("-n", "--files", type=int, default=1000)
+    parser.add_argument("-l", "--layout", default="anime", help="A preset, 'mixed' or a track list")
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    created = generate(
+        args.root, args.files, args.layout, args.depth, args.fanout, args.noise, args.seed
+    )
+    print(f"Generated {len(created)} files under {args.root}")
+
+
+if __name__ == "__main__":
+    main()
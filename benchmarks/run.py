@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark submerge against a synthetic library and stub mkvtoolnix binaries.
+
+A tree of small MKVs is generated (see fixtures.py), stub executables are put
+first on PATH (see stubs.py), and each scenario is run several times in a
+fresh interpreter. Results are printed as JSON: the best and median wall time
+of the work itself (excluding interpreter start), throughput in files/s, and
+the peak RSS of submerge and of its child processes. Save a run with --output
+and pass it to a later run with --compare to see what changed.
+"""
+
+# Imports {{{
+# builtins
+import argparse
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# }}}
+
+
+HERE = pathlib.Path(__file__).resolve().parent
+ROOT = HERE.parent
+sys.path.insert(0, str(HERE))
+
+import fixtures  # noqa: E402
+import stubs  # noqa: E402
+
+# scenario -> arguments for CHILD. "{tree}" is replaced by the library's path.
+SCENARIOS = {
+    "discovery": ["discover", "{tree}"],
+    "probe": ["probe", "{tree}", "mkvmerge"],
+    "probe-native": ["probe", "{tree}", "native"],
+    "probe-cached": ["probe", "{tree}", "mkvmerge", "cached"],
+    "audit": ["cli", "audit", "-r", "{tree}"],
+    "tracks": ["cli", "tracks", "-r", "{tree}", "-n", "1:2:3", "-p", "1v:2a"],
+    "tag": ["cli", "tag", "-r", "{tree}", "-l", "2", "eng"],
+    "autotag": ["cli", "autotag", "-r", "{tree}", "-J", "2"],
+}
+
+CHILD = """
+import json, pathlib, resource, sys, time
+from submerge import cache, engine, utils
+from submerge.cli import main
+
+jobs, kind, *args = json.loads(sys.argv[1])
+engine.configure(jobs)
+cache.configure(use_cache=False)
+
+start = time.perf_counter()
+if kind == "discover":
+    sum(1 for _ in utils.get_files([pathlib.Path(args[0])], recurse=True))
+elif kind == "probe":
+    utils.probe_method = args[1]
+    files = list(utils.get_files([pathlib.Path(args[0])], recurse=True))
+    if args[2:] == ["cached"]:
+        cache.configure(use_cache=True)
+        list(engine.map(utils.get_metadata, files))
+        start = time.perf_counter()
+    list(engine.map(utils.get_metadata, files))
+else:
+    main(["-j", str(jobs), "--no-cache", *args], prog_name="submerge", standalone_mode=False)
+elapsed = time.perf_counter() - start
+
+result = {
+    "seconds": elapsed,
+    "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "children_peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+}
+print(json.dumps(result), file=sys.stderr)
+"""
+
+
+def run(args, env) -> dict:
+    proc = subprocess.run(
+        [sys.executable, "-c", CHILD, json.dumps(args)],
+        cwd=ROOT,
+        env=env,
+        input="y\n",
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip())
+    return json.loads(proc.stderr.strip().splitlines()[-1])
+
+
+def measure(name, tree, files, options, env) -> dict:
+    args = [options.jobs] + [arg.format(tree=tree) for arg in SCENARIOS[name]]
+    results = [run(args, env) for _ in range(options.runs)]
+    times = [result["seconds"] for result in results]
+    return {
+        "best_s": round(min(times), 4),
+        "median_s": round(statistics.median(times), 4),
+        "files_per_s": round(files / min(times), 1),
+        "peak_rss_kb": max(result["peak_rss_kb"] for result in results),
+        "children_peak_rss_kb": max(result["children_peak_rss_kb"] for result in results),
+    }
+
+
+def compare(baseline: dict, current: dict):
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before:
+            change = result["files_per_s"] / before["files_per_s"]
+            print(
+                f"{name:>14}: {before['files_per_s']:>9} -> {result['files_per_s']:>9} files/s"
+                f" ({change:.2f}x)",
+                file=sys.stderr,
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        metavar="SCENARIO",
+        help=f"Scenarios to run (default: all): {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("-n", "--files", type=int, default=500)
+    parser.add_argument("-l", "--layout", default="anime", help="A fixtures.py layout")
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0, help="Stub latency in ms")
+    parser.add_argument("-j", "--jobs", type=int, default=min(32, (os.cpu_count() or 1) + 4))
+    parser.add_argument("-r", "--runs", type=int, default=3)
+    parser.add_argument("-o", "--output", type=pathlib.Path, help="Also write results here")
+    parser.add_argument("--compare", type=pathlib.Path, help="Results of an earlier run")
+    options = parser.parse_args()
+    unknown = set(options.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix="submerge-bench-") as tmp:
+        tmp = pathlib.Path(tmp)
+        tree = tmp / "library"
+        files = len(fixtures.generate(tree, options.files, options.layout, options.depth))
+
+        env = dict(os.environ)
+        env["PATH"] = os.pathsep.join([str(stubs.install(tmp / "bin")), env["PATH"]])
+        env["XDG_CACHE_HOME"] = str(tmp / "cache")
+        env[stubs.LATENCY] = str(options.latency / 1000)
+
+        results = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "files": files,
+            "layout": options.layout,
+            "latency_ms": options.latency,
+            "jobs": options.jobs,
+            "scenarios": {},
+        }
+        for name in options.scenarios or SCENARIOS:
+            print(f"Running {name}...", file=sys.stderr)
+            results["scenarios"][name] = measure(name, tree, files, options, env)
+
+    print(json.dumps(results, indent=2))
+    if options.output:
+        options.output.write_text(json.dumps(results, indent=2) + "\n")
+    if options.compare:
+        compare(json.loads(options.compare.read_text()), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""
+Measure how long `python -m submerge` takes to start.
+
+Each command line is run several times in a fresh interpreter, and the best
+and median wall times are reported. With --max-ms, the script exits non-zero
+if any median exceeds the budget, so it can guard against regressions. It
+also fails if a command pulls in a heavy dependency it has no use for. With
+--serve, the commands are sent to a `submerge serve` started for the run
+instead, to measure the client.
+"""
+
+# Imports {{{
+# builtins
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# }}}
+
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+COMMANDS = [
+    ["-h"],
+    ["tag", "-h"],
+    ["audit", "-h"],
+    ["autotag", "-h"],
+]
+
+# modules that must not be imported by a command line
+FORBIDDEN = {
+    "tag -h": ["langdetect", "pycountry"],
+    "audit -h": ["langdetect", "pycountry"],
+}
+
+IMPORTED = """
+import json, sys
+from submerge.cli import main
+try:
+    main(sys.argv[1:], prog_name="submerge", standalone_mode=False)
+finally:
+    sys.stdout = sys.__stderr__
+    print(json.dumps(sorted(sys.modules)), file=sys.stderr)
+"""
+
+
+def measure(args, runs, env=None):
+    cmd = [sys.executable, "-m", "submerge", *args]
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return {"min_ms": min(times), "median_ms": statistics.median(times)}
+
+
+def imported(args):
+    proc = subprocess.run(
+        [sys.executable, "-c", IMPORTED, *args],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    return set(json.loads(proc.stderr.strip().splitlines()[-1]))
+
+
+def measure_served(runs):
+    with tempfile.TemporaryDirectory(prefix="submerge-startup-") as tmp:
+        socket = os.path.join(tmp, "submerge.sock")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "submerge", "serve", "-s", socket],
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            while not os.path.exists(socket):
+                if server.poll() is not None:
+                    sys.exit("The server failed to start")
+                time.sleep(0.05)
+            env = dict(os.environ, SUBMERGE_SOCKET=socket)
+            return {" ".join(cmd): measure(cmd, runs, env) for cmd in COMMANDS}
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-n", "--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, help="Fail if a median exceeds this")
+    parser.add_argument("--serve", action="store_true", help="Measure the client of a server")
+    args = parser.parse_args()
+
+    if args.serve:
+        results = measure_served(args.runs)
+    else:
+        results = {" ".join(cmd): measure(cmd, args.runs) for cmd in COMMANDS}
+    print(json.dumps(results, indent=2))
+
+    failed = False
+    for cmd, forbidden in FORBIDDEN.items():
+        loaded = imported(cmd.split()) & set(forbidden)
+        if loaded:
+            print(f"'{cmd}' imported {', '.join(sorted(loaded))}", file=sys.stderr)
+            failed = True
+
+    if args.max_ms is not None:
+        slow = [cmd for cmd, result in results.items() if result["median_ms"] > args.max_ms]
+        if slow:
+            print(f"Over budget ({args.max_ms}ms): {', '.join(slow)}", file=sys.stderr)
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""
+Stand-ins for the mkvtoolnix executables, to benchmark without them.
+
+`install()` writes mkvmerge, mkvpropedit and mkvextract launchers into a
+directory to put first on PATH. Each one waits SUBMERGE_BENCH_LATENCY seconds
+(to imitate a slow disk or a large file), then does the least it can to give
+submerge a realistic answer:
+
+    mkvmerge -J         reads the file with submerge's native EBML reader
+    mkvmerge -o         reports progress and copies the input to the output
+    mkvpropedit         checks the file exists and succeeds without editing
+    mkvextract tracks   writes generated dialogue to each output file
+"""
+
+# Imports {{{
+# builtins
+import itertools
+import json
+import os
+import pathlib
+import shutil
+import sys
+import time
+
+# }}}
+
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+EXECUTABLES = ["mkvmerge", "mkvpropedit", "mkvextract"]
+
+LATENCY = "SUBMERGE_BENCH_LATENCY"
+
+LAUNCHER = """#!{python}
+import sys
+sys.path[:0] = [{benchmarks!r}, {root!r}]
+import stubs
+sys.exit(stubs.main())
+"""
+
+# characters of dialogue written per extracted track
+TEXT_SIZE = 30000
+
+DIALOGUE = [
+    "Where are you going tonight? I think we should stay at home and wait for them.",
+    "Où vas-tu ce soir ? Je pense que nous devrions rester à la maison et les attendre.",
+    "¿Adónde vas esta noche? Creo que deberíamos quedarnos en casa y esperarlos.",
+    "Wohin gehst du heute Abend? Ich denke, wir sollten zu Hause bleiben und warten.",
+]
+
+
+def install(directory: pathlib.Path) -> pathlib.Path:
+    directory.mkdir(parents=True, exist_ok=True)
+    launcher = LAUNCHER.format(
+        python=sys.executable,
+        benchmarks=str(pathlib.Path(__file__).resolve().parent),
+        root=str(ROOT),
+    )
+    for name in EXECUTABLES:
+        path = directory / name
+        path.write_text(launcher)
+        path.chmod(0o755)
+    return directory
+
+
+def mkvmerge(args):
+    if args[0] == "-J":
+        from submerge import ebml
+
+        try:
+            print(json.dumps(ebml.probe(pathlib.Path(args[1]))))
+        except (ebml.ParseError, OSError) as e:
+            print(json.dumps({"container": {"recognized": False}, "errors": [str(e)]}))
+            return 2
+        return 0
+
+    if "--gui-mode" in args:
+        args.remove("--gui-mode")
+    output = args[args.index("-o") + 1]
+    source = args[args.index("-o") + 2]
+    for percent in range(0, 101, 20):
+        print(f"#GUI#progress {percent}%", flush=True)
+    shutil.copyfile(source, output)
+    return 0
+
+
+def mkvpropedit(args):
+    if not os.path.isfile(args[0]):
+        print(f"Error: The file '{args[0]}' could not be opened.")
+        return 2
+    print("Done.")
+    return 0
+
+
+def mkvextract(args):
+    for spec in args[2:]:
+        track, _, path = spec.partition(":")
+        line = DIALOGUE[int(track) % len(DIALOGUE)]
+        with open(path, "w") as f:
+            written = 0
+            for i in itertools.count(1):
+                if written >= TEXT_SIZE:
+                    break
+                if path.endswith((".ass", ".ssa")):
+                    entry = f"Dialogue: 0,0:00:{i % 60:02}.00,0:00:{i % 60:02}.50,Default,,0,0,0,,{line}\n"
+                else:
+                    entry = f"{i}\n00:00:{i % 60:02},000 --> 00:00:{i % 60:02},500\n{line}\n\n"
+                f.write(entry)
+                written += len(line)
+    return 0
+
+
+def main():
+    time.sleep(float(os.environ.get(LATENCY) or 0))
+    name = pathlib.Path(sys.argv[0]).name
+    return globals()[name](sys.argv[1:])
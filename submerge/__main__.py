@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
 
-from submerge.cli import main
+import sys
+
+from submerge import client
 
 if __name__ == "__main__":
+    # hand the command to a running server, if there is one, before loading anything else
+    code = client.main(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+
+    from submerge.cli import main
+
     main(prog_name="submerge")
@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+
+"""
+Library interface to submerge.
+
+Everything the command line modules do is available here without click,
+returning structured results instead of logging them, so that submerge can be
+embedded in a long-lived process:
+
+    from submerge import api
+
+    api.configure(jobs=8, probe="native")
+    for result in api.audit("/media/library", recursive=True):
+        print(result.file, result.tests)
+
+    for outcome in api.tag("/media/library/new", track=2, language="eng"):
+        ...
+
+Functions that edit files come in two steps: `plan_*` works out the edits
+(probing files as needed) and returns them as a Plan, which can be inspected,
+saved, or applied with `apply`. The shortcuts `tag`, `reorder` and `autotag`
+do both. Results are streamed as they complete, with at most `jobs` files in
+flight, and every function has an async variant (`audit_async`, ...) which
+runs the work on a background thread and streams the same results as an
+async iterator.
+
+Paths can be given as a single path or an iterable of them, as strings or
+path-like objects.
+"""
+
+# Imports {{{
+# builtins
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import os
+import pathlib
+import threading
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    TYPE_CHECKING,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+# local modules
+from submerge import cache, engine, plan as plans, utils
+from submerge.journal import Journal
+from submerge.languages import Language
+from submerge.plan import Outcome, Plan
+from submerge.records import FileInfo, TrackInfo, Unreadable
+
+if TYPE_CHECKING:
+    from submerge.modules.audit import FileResult, TestPlan
+    from submerge.modules.tracks import Rule
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+PathLike = Union[str, os.PathLike]
+Paths = Union[PathLike, Iterable[PathLike]]
+LanguageLike = Union[str, Language]
+Result = TypeVar("Result")
+
+
+class Reordering(NamedTuple):
+    plan: Plan
+    # files by track layout (None for files that couldn't be read)
+    layouts: Dict[Optional[frozenset], List[pathlib.Path]]
+    # the rule chosen for each layout, if any
+    rules: Dict[Optional[frozenset], Optional["Rule"]]
+    # readable files that no rule applies to
+    unchanged: List[pathlib.Path]
+
+
+class Autotagging(NamedTuple):
+    plan: Plan
+    # the language detected for each undefined text subtitle track, by number
+    detected: Dict[pathlib.Path, Dict[int, Language]]
+    # (file, track number) of tracks whose language couldn't be detected
+    undetected: List[Tuple[pathlib.Path, int]]
+
+
+class Merged(NamedTuple):
+    file: pathlib.Path
+    output: pathlib.Path
+    # "merged", "skipped" (the output already has the subtitles) or "failed"
+    status: str
+    error: Optional[str] = None
+
+
+class Raised(NamedTuple):
+    error: BaseException
+
+
+def configure(
+    jobs: Optional[int] = None,
+    use_cache: bool = True,
+    refresh_cache: bool = False,
+    probe: str = "mkvmerge",
+    edit: str = "mkvpropedit",
+    shard: Optional[Tuple[int, int]] = None,
+    max_per_device: Optional[int] = None,
+):
+    """
+    Set the options given to the top-level `submerge` command. They apply to
+    every call made afterwards, from any thread.
+    """
+    if probe not in utils.PROBES:
+        raise ValueError(f"Unknown probe method {probe!r}")
+    if edit not in plans.EDITORS:
+        raise ValueError(f"Unknown edit method {edit!r}")
+    engine.configure(jobs, max_per_device)
+    cache.configure(use_cache, refresh_cache)
+    utils.probe_method = probe
+    plans.edit_method = edit
+    utils.shard = shard
+
+
+def as_paths(paths: Paths) -> List[pathlib.Path]:
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    return [pathlib.Path(path) for path in paths]
+
+
+def as_language(lang: LanguageLike) -> Language:
+    return lang if isinstance(lang, Language) else utils.language(lang)
+
+
+def files(
+    paths: Paths, recursive: bool = False, journal: Optional[Journal] = None
+) -> Iterator[pathlib.Path]:
+    """
+    The MKV files at or under the given paths, skipping any the journal
+    records as done.
+    """
+    found = utils.get_files(as_paths(paths), recurse=recursive, shard=utils.shard)
+    return journal.pending(found) if journal is not None else found
+
+
+def metadata(file: PathLike) -> FileInfo:
+    """
+    A file's tracks. Raises Unreadable if mkvmerge can't make sense of it.
+    """
+    return utils.get_metadata(pathlib.Path(file))
+
+
+def apply(plan: Plan, journal: Optional[Journal] = None) -> Iterator[Outcome]:
+    """
+    Make the planned edits, yielding the outcome for each file as it completes.
+    """
+    return plan.apply(journal)
+
+
+# Audit {{{
+def audit(
+    paths: Paths,
+    recursive: bool = False,
+    only: Iterable[str] = (),
+    skip: Iterable[str] = (),
+    pattern: bool = False,
+    tests: Optional["TestPlan"] = None,
+) -> Iterator["FileResult"]:
+    """
+    Check files for problems, yielding each file's test results as soon as it
+    has been checked. Raises LookupError for unknown test names. Tests already
+    selected with `compile_tests` can be given instead of only/skip/pattern.
+    """
+    from submerge.modules.audit import check_file, compile_tests
+
+    if tests is None:
+        tests = compile_tests(only, skip, pattern=pattern)
+    found = files(paths, recursive)
+
+    def check(file):
+        return check_file(file, plan=tests)
+
+    def results():
+        for future in engine.submit_all(check, found):
+            try:
+                yield future.result()
+            except TypeError as e:
+                log.error(e)
+
+    return results()
+
+
+# }}}
+
+
+# Editing {{{
+def plan_tag(
+    paths: Paths,
+    track: int,
+    language: LanguageLike,
+    recursive: bool = False,
+    journal: Optional[Journal] = None,
+) -> Plan:
+    """
+    Plan to set the language of a track (by number) in every file.
+    """
+    from submerge.modules.tag import edit_track
+
+    lang = as_language(language)
+    plan = Plan()
+    for file in files(paths, recursive, journal):
+        edit_track(plan, file, track, language=lang)
+    return plan
+
+
+def tag(
+    paths: Paths,
+    track: int,
+    language: LanguageLike,
+    recursive: bool = False,
+    journal: Optional[Journal] = None,
+) -> Iterator[Outcome]:
+    """
+    Set the language of a track in every file.
+    """
+    return apply(plan_tag(paths, track, language, recursive, journal), journal)
+
+
+def plan_reorder(
+    paths: Paths,
+    new_order: Optional[str] = None,
+    pattern: Optional[str] = None,
+    strict: bool = False,
+    rules: Optional[Iterable["Rule"]] = None,
+    recursive: bool = False,
+    journal: Optional[Journal] = None,
+) -> Reordering:
+    """
+    Plan to reorder the tracks of the files matching a pattern (or of every
+    file), or to apply a list of rules: each file is reordered by the first
+    rule whose pattern matches its track layout. Raises ValueError for
+    invalid patterns or orders.
+    """
+    from submerge.modules import tracks
+
+    if rules is None:
+        if not new_order:
+            raise ValueError("Either new_order or rules is needed")
+        rules = [tracks.Rule(pattern, new_order, strict)]
+    rules = [tracks.Rule(*rule) for rule in rules]
+    for rule in rules:
+        if rule.pattern is not None:
+            tracks.track_pattern(rule.pattern)
+        tracks.new_order(rule.new_order)
+
+    # probe in parallel (only if there is anything to match), grouping by layout
+    probe = any(rule.pattern for rule in rules)
+    read = tracks.read_layout if probe else lambda file: (file, None)
+    layouts = collections.defaultdict(list)
+    for file, layout in engine.map(read, files(paths, recursive, journal)):
+        layouts[layout].append(file)
+
+    # each rule is only checked once per layout, however many files share it
+    assigned = {layout: tracks.find_rule(rules, layout) for layout in layouts}
+    plan = Plan()
+    unchanged = []
+    for layout, group in layouts.items():
+        for file in sorted(group):
+            if assigned[layout]:
+                tracks.modify_track(plan, file, assigned[layout].new_order)
+            elif layout is not None:
+                unchanged.append(file)
+    return Reordering(plan, dict(layouts), assigned, unchanged)
+
+
+def reorder(
+    paths: Paths,
+    new_order: Optional[str] = None,
+    pattern: Optional[str] = None,
+    strict: bool = False,
+    rules: Optional[Iterable["Rule"]] = None,
+    recursive: bool = False,
+    journal: Optional[Journal] = None,
+) -> Iterator[Outcome]:
+    """
+    Reorder the tracks of files, as planned by `plan_reorder`.
+    """
+    reordering = plan_reorder(paths, new_order, pattern, strict, rules, recursive, journal)
+    if journal is not None:
+        for file in reordering.unchanged:
+            journal.record(file, None)
+    return apply(reordering.plan, journal)
+
+
+def plan_autotag(
+    paths: Paths,
+    recursive: bool = False,
+    sample_size: Optional[int] = None,
+    detect_jobs: Optional[int] = None,
+    journal: Optional[Journal] = None,
+) -> Autotagging:
+    """
+    Detect the language of the undefined text subtitle tracks of each file,
+    and plan to tag them. Detection runs in `detect_jobs` processes (the CPU
+    count by default; 1 detects in a thread).
+    """
+    from submerge.modules.autotag import DEFAULT_SAMPLE_SIZE, detect_languages, set_track_lang
+
+    detected, undetected = detect_languages(
+        files(paths, recursive, journal),
+        sample_size or DEFAULT_SAMPLE_SIZE,
+        detect_jobs or os.cpu_count() or 1,
+    )
+    plan = Plan()
+    for file, languages in detected.items():
+        for track, lang in languages.items():
+            set_track_lang(plan, file, track, lang)
+    return Autotagging(plan, detected, undetected)
+
+
+def autotag(
+    paths: Paths,
+    recursive: bool = False,
+    sample_size: Optional[int] = None,
+    detect_jobs: Optional[int] = None,
+    journal: Optional[Journal] = None,
+) -> Iterator[Outcome]:
+    """
+    Tag the undefined text subtitle tracks of files with their detected language.
+    """
+    return apply(plan_autotag(paths, recursive, sample_size, detect_jobs, journal).plan, journal)
+
+
+# }}}
+
+
+# Merging {{{
+def merge(
+    paths: Paths,
+    subtitles: Iterable[Tuple[PathLike, LanguageLike]],
+    recursive: bool = False,
+    force: bool = False,
+    journal: Optional[Journal] = None,
+) -> Iterator[Merged]:
+    """
+    Merge the same subtitle files (with their languages) into every video
+    file, writing `<name>-merged.mkv` next to each. Outputs that already have
+    the subtitles are skipped unless `force` is set.
+    """
+    from submerge.modules.merge import FILETYPES, videos
+
+    subtitles = [(pathlib.Path(file), as_language(lang)) for file, lang in subtitles]
+    if not all(file.suffix in FILETYPES for file, _ in subtitles):
+        raise ValueError("A passed subtitle file has an unsupported extension")
+    if not any(file.suffix != ".sub" for file, _ in subtitles):
+        raise ValueError("No subtitle files to merge")
+
+    found = videos(utils.get_files(as_paths(paths), recurse=recursive, shard=utils.shard))
+    if journal is not None:
+        found = journal.pending(found)
+    return merge_each(((file, subtitles) for file in found), force, journal)
+
+
+def merge_each(
+    jobs: Iterable[Tuple[pathlib.Path, List[Tuple[pathlib.Path, Language]]]],
+    force: bool = False,
+    journal: Optional[Journal] = None,
+) -> Iterator[Merged]:
+    """
+    Merge each video file with its own subtitles, yielding the results as
+    they complete.
+    """
+    from submerge.modules.merge import MergeError, output_path, run_merge
+
+    def attempt(job):
+        file, subtitles = job
+        try:
+            return file, run_merge(file, subtitles, force=force), None
+        except (OSError, MergeError) as e:
+            return file, False, str(e)
+
+    for future in engine.submit_all(attempt, jobs, path=lambda job: job[0]):
+        file, result, error = future.result()
+        output = output_path(file)
+        if result is False:
+            yield Merged(file, output, "failed", error)
+            continue
+        if journal is not None:
+            journal.record(file, None, output=output)
+        yield Merged(file, output, "skipped" if result is None else "merged")
+
+
+# }}}
+
+
+# Async variants {{{
+async def stream(func: Callable[..., Iterable[Result]], *args, **kwargs) -> AsyncIterator[Result]:
+    """
+    Run a function returning an iterator on a background thread, and yield
+    its results without blocking the event loop. Stopping early (or being
+    cancelled) stops the work once the results in flight are done.
+    """
+    loop = asyncio.get_running_loop()
+    # a little room, so the producer isn't held up by every await
+    queue: asyncio.Queue = asyncio.Queue(maxsize=engine.engine.jobs)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=0.1)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+
+    def produce():
+        results = None
+        try:
+            results = iter(func(*args, **kwargs))
+            for result in results:
+                if stop.is_set() or not put(result):
+                    return
+            put(done)
+        except BaseException as e:
+            if not stop.is_set():
+                put(Raised(e))
+        finally:
+            if hasattr(results, "close"):
+                results.close()
+
+    thread = threading.Thread(target=produce, name="submerge-api", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Raised):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+async def call(func: Callable[..., Result], *args, **kwargs) -> Result:
+    """
+    Run a blocking function (like the `plan_*` functions) on a thread.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        None, lambda: func(*args, **kwargs)
+    )
+
+
+def audit_async(*args, **kwargs) -> AsyncIterator["FileResult"]:
+    return stream(audit, *args, **kwargs)
+
+
+def apply_async(plan: Plan, journal: Optional[Journal] = None) -> AsyncIterator[Outcome]:
+    return stream(apply, plan, journal)
+
+
+def tag_async(*args, **kwargs) -> AsyncIterator[Outcome]:
+    return stream(tag, *args, **kwargs)
+
+
+def reorder_async(*args, **kwargs) -> AsyncIterator[Outcome]:
+    return stream(reorder, *args, **kwargs)
+
+
+def autotag_async(*args, **kwargs) -> AsyncIterator[Outcome]:
+    return stream(autotag, *args, **kwargs)
+
+
+def merge_async(*args, **kwargs) -> AsyncIterator[Merged]:
+    return stream(merge, *args, **kwargs)
+
+
+# }}}
+
+
+__all__ = [
+    "Autotagging",
+    "FileInfo",
+    "Merged",
+    "Outcome",
+    "Plan",
+    "Reordering",
+    "TrackInfo",
+    "Unreadable",
+    "apply",
+    "apply_async",
+    "audit",
+    "audit_async",
+    "autotag",
+    "autotag_async",
+    "call",
+    "configure",
+    "files",
+    "merge",
+    "merge_async",
+    "merge_each",
+    "metadata",
+    "plan_autotag",
+    "plan_reorder",
+    "plan_tag",
+    "reorder",
+    "reorder_async",
+    "tag",
+    "tag_async",
+]
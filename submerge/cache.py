@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+# Imports {{{
+# builtins
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+from typing import NamedTuple, Optional, Union
+
+# local modules
+from submerge.records import FileInfo
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+# module state, set from the top-level command group
+enabled = True
+refresh = False
+_cache = None
+_detection_cache = None
+# set when a cache couldn't be opened, to carry on without that one
+_cache_failed = False
+_detection_cache_failed = False
+_cache_lock = threading.Lock()
+
+
+class Fingerprint(NamedTuple):
+    """
+    Identity of a file's contents, as far as the filesystem can tell us.
+    """
+
+    device: int
+    inode: int
+    size: int
+    mtime_ns: int
+
+    @classmethod
+    def of(cls, file: Union[str, os.PathLike]):
+        stat = os.stat(file)
+        return cls(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def cache_dir() -> pathlib.Path:
+    base = os.environ.get("XDG_CACHE_HOME") or "~/.cache"
+    return pathlib.Path(base).expanduser() / "submerge"
+
+
+class MetadataCache:
+    """
+    Persistent store of file metadata, keyed by path and fingerprint.
+    """
+
+    # stored as the database's user_version, to migrate older caches once
+    SCHEMA = 2
+
+    def __init__(self, path: pathlib.Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            (version,) = self.db.execute("PRAGMA user_version").fetchone()
+            if version < self.SCHEMA:
+                self.migrate()
+
+    def migrate(self):
+        # whole `mkvmerge -J` documents were once stored instead of records
+        self.db.execute("DROP TABLE IF EXISTS metadata")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                tracks TEXT NOT NULL
+            )
+            """
+        )
+        # and records without track names after that
+        self.db.execute("DELETE FROM files")
+        self.db.execute(f"PRAGMA user_version = {self.SCHEMA}")
+
+    @staticmethod
+    def key(file) -> str:
+        return str(pathlib.Path(file).absolute())
+
+    def get(self, file, fingerprint: Fingerprint) -> Optional[FileInfo]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT device, inode, size, mtime_ns, tracks FROM files WHERE path = ?",
+                (self.key(file),),
+            ).fetchone()
+
+        if row is None or Fingerprint(*row[:4]) != fingerprint:
+            return None
+        return FileInfo.from_json(json.loads(row[4]))
+
+    def put(self, file, fingerprint: Fingerprint, info: FileInfo):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(file), *fingerprint, json.dumps(info.to_json())),
+            )
+
+    def invalidate(self, file):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM files WHERE path = ?", (self.key(file),))
+
+    def prune(self) -> int:
+        """
+        Remove entries for files that no longer exist or have since changed.
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT path, device, inode, size, mtime_ns FROM files"
+            ).fetchall()
+
+        stale = []
+        for path, *fingerprint in rows:
+            try:
+                if Fingerprint.of(path) != Fingerprint(*fingerprint):
+                    stale.append((path,))
+            except OSError:
+                stale.append((path,))
+
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM files WHERE path = ?", stale)
+
+        return len(stale)
+
+
+class DetectionCache:
+    """
+    Persistent store of detected subtitle languages, keyed by a hash of the
+    text sample they were detected from.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS detections (
+                    digest TEXT PRIMARY KEY,
+                    language TEXT NOT NULL
+                )
+                """
+            )
+
+    @staticmethod
+    def key(text: str, version: str) -> str:
+        normalized = " ".join(text.lower().split())
+        return hashlib.sha256(f"{version}\0{normalized}".encode()).hexdigest()
+
+    def get(self, digest: str) -> Optional[str]:
+        """
+        Get the language detected for a sample; "" means none could be.
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT language FROM detections WHERE digest = ?", (digest,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, digest: str, language: Optional[str]):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO detections VALUES (?, ?)",
+                (digest, language or ""),
+            )
+
+
+def configure(use_cache: bool = True, refresh_cache: bool = False):
+    global enabled, refresh
+    enabled = use_cache
+    refresh = refresh_cache
+
+
+def get_cache() -> Optional[MetadataCache]:
+    """
+    Get the shared metadata cache, or None if it is disabled or unavailable.
+    """
+    global _cache, _cache_failed
+    if not enabled or _cache_failed:
+        return None
+
+    with _cache_lock:
+        if _cache is None and not _cache_failed:
+            try:
+                _cache = MetadataCache(cache_dir() / "metadata.sqlite3")
+            except (OSError, sqlite3.Error) as e:
+                log.warning(f"Metadata cache unavailable, continuing without it: {e}")
+                _cache_failed = True
+        return _cache
+
+
+def get_detection_cache() -> Optional[DetectionCache]:
+    """
+    Get the shared detection cache, or None if caching is disabled or unavailable.
+    """
+    global _detection_cache, _detection_cache_failed
+    if not enabled or _detection_cache_failed:
+        return None
+
+    with _cache_lock:
+        if _detection_cache is None and not _detection_cache_failed:
+            try:
+                _detection_cache = DetectionCache(cache_dir() / "detections.sqlite3")
+            except (OSError, sqlite3.Error) as e:
+                log.warning(f"Detection cache unavailable, continuing without it: {e}")
+                _detection_cache_failed = True
+        return _detection_cache
+
+
+def invalidate(file):
+    """
+    Drop any cached metadata for a file that has just been modified.
+    """
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(file)
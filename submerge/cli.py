@@ -2,16 +2,16 @@
 
 # Imports {{{
 # builtins
+import contextlib
 import logging
-import pathlib
 import sys
-import shutil
 
 # 3rd party
 import click
 
 # local modules
-from submerge.modules import handlers
+from submerge import cache, engine, plan, trace, utils
+from submerge.modules import LazyGroup
 
 # }}}
 
@@ -23,22 +23,128 @@ sh.setLevel(logging.DEBUG)
 log.addHandler(sh)
 
 
+@contextlib.contextmanager
+def log_to_stderr():
+    """
+    Send messages to stderr while the block runs, for commands writing their
+    results to stdout.
+    """
+    stream = sh.setStream(sys.stderr)
+    try:
+        yield
+    finally:
+        # None if they were the same stream all along
+        if stream is not None:
+            sh.setStream(stream)
+
+
 @click.group(
+    cls=LazyGroup,
     context_settings={
         "help_option_names": ["-h", "--help"],
-    }
+    },
+    invoke_without_command=True,
 )
 @click.option("-v", "--verbose", is_flag=True)
-def main(verbose):
+@click.option(
+    "-j",
+    "--jobs",
+    help="Maximum number of files and mkvtoolnix processes handled at once",
+    type=click.IntRange(min=1),
+    metavar="N",
+)
+@click.option(
+    "--max-per-device",
+    help="Maximum number of files on the same device handled at once"
+    " (the limit of each device adapts to how fast it is, up to this)",
+    type=click.IntRange(min=1),
+    metavar="N",
+)
+@click.option(
+    "--cache/--no-cache",
+    "use_cache",
+    help="Read file metadata through the on-disk cache",
+    default=True,
+    show_default=True,
+)
+@click.option(
+    "--refresh-cache",
+    help="Re-probe every file and overwrite its cached metadata",
+    is_flag=True,
+)
+@click.option(
+    "--prune-cache",
+    help="Remove cached metadata for files that have been moved or changed",
+    is_flag=True,
+)
+@click.option(
+    "--probe",
+    help="How file metadata is read (native falls back to mkvmerge on failure)",
+    type=click.Choice(utils.PROBES),
+    default="mkvmerge",
+    show_default=True,
+)
+@click.option(
+    "--edit",
+    help="How edits are made (native is experimental, and falls back to mkvpropedit when it can't)",
+    type=click.Choice(plan.EDITORS),
+    default="mkvpropedit",
+    show_default=True,
+)
+@click.option(
+    "--shard",
+    help="Only handle the I-th of N disjoint shards of the files, like 2/3",
+    type=utils.parse_shard,
+    metavar="I/N",
+)
+@click.option(
+    "--trace",
+    "trace_file",
+    help="Record where time is spent, as a Chrome trace, and summarize it",
+    type=click.File("w"),
+    metavar="FILE",
+)
+@click.pass_context
+def main(
+    ctx,
+    verbose,
+    jobs,
+    max_per_device,
+    use_cache,
+    refresh_cache,
+    prune_cache,
+    probe,
+    edit,
+    shard,
+    trace_file,
+):
     if verbose:
         log.setLevel(logging.DEBUG)
 
-    # check for mkvtoolnix
-    mkvtoolnix = ["mkvmerge", "mkvpropedit", "mkvextract", "mkvinfo"]
-    missing_mkvtoolnix = [exec for exec in mkvtoolnix if not shutil.which(exec)]
-    if missing_mkvtoolnix:
-        print(f"{', '.join(missing_mkvtoolnix)} not found.")
+    if trace_file is not None:
+        trace.start()
+        started = trace.now()
+
+        def finish():
+            trace.record(ctx.invoked_subcommand or "submerge", "command", started, trace.now())
+            trace.stop()
+            trace.write(trace_file)
+            trace.report()
+            log.info(f"Trace written to {trace_file.name}.")
+
+        ctx.call_on_close(finish)
+
+    engine.configure(jobs, max_per_device)
 
+    utils.probe_method = probe
+    plan.edit_method = edit
+    utils.shard = shard
 
-for handler in handlers.values():
-    main.add_command(handler)
+    cache.configure(use_cache, refresh_cache)
+    if prune_cache:
+        metadata_cache = cache.get_cache()
+        if metadata_cache is not None:
+            pruned = metadata_cache.prune()
+            log.info(f"Pruned {pruned} stale entries from the metadata cache.")
+    elif ctx.invoked_subcommand is None:
+        click.echo(ctx.get_help())
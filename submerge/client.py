@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+Send a command line to a running `submerge serve`.
+
+When SUBMERGE_SOCKET is set, `python -m submerge` sends its arguments and
+working directory to the server listening there, and streams back the output
+(and any prompts) of the command, which runs in the server. This is imported
+before anything else, so it only uses the few standard modules it needs.
+
+Messages are JSON objects, one per line. The client sends
+{"argv": [...], "cwd": ...}, and the server replies with any number of
+{"stdout": text}, {"stderr": text} and {"prompt": true} messages (the latter
+answered with {"stdin": line}, or null at the end of input), then
+{"exit": code}. On Ctrl-C, the client sends {"cancel": true}, and the server
+interrupts the command as Ctrl-C would have, then replies with its exit code.
+"""
+
+# Imports {{{
+# builtins
+import json
+import os
+import socket
+import sys
+
+# }}}
+
+
+ENV = "SUBMERGE_SOCKET"
+
+# global options of the submerge group taking a value, which may come before
+# the command
+VALUED = {"-j", "--jobs", "--max-per-device", "--probe", "--edit", "--shard", "--trace"}
+
+
+def command(argv):
+    """
+    The name of the command in a command line, if any.
+    """
+    args = iter(argv)
+    for arg in args:
+        if arg == "--":
+            return next(args, None)
+        if not arg.startswith("-") or arg == "-":
+            return arg
+        if arg in VALUED:
+            next(args, None)
+    return None
+
+
+def send(wfile, **message):
+    wfile.write(json.dumps(message).encode() + b"\n")
+    wfile.flush()
+
+
+def relay(rfile, wfile):
+    """
+    Relay the server's messages until the command exits, returning its exit
+    code, or None if the connection was closed before that.
+    """
+    for line in rfile:
+        message = json.loads(line)
+        if "stdout" in message:
+            sys.stdout.write(message["stdout"])
+            sys.stdout.flush()
+        elif "stderr" in message:
+            sys.stderr.write(message["stderr"])
+            sys.stderr.flush()
+        elif "prompt" in message:
+            answer = sys.stdin.readline()
+            send(wfile, stdin=answer or None)
+        elif "exit" in message:
+            return message["exit"]
+    return None
+
+
+def forward(argv, path):
+    """
+    Run a command line in the server, returning its exit code, or None if no
+    server is listening.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock, sock.makefile("rb") as rfile, sock.makefile("wb") as wfile:
+        send(wfile, argv=argv, cwd=os.getcwd())
+        try:
+            code = relay(rfile, wfile)
+        except KeyboardInterrupt:
+            # stop the command in the server, and wait for it to wind down;
+            # pressing Ctrl-C again leaves it to it
+            try:
+                send(wfile, cancel=True)
+            except OSError:
+                return 130
+            code = relay(rfile, wfile)
+        if code is not None:
+            return code
+
+    print("submerge: the server closed the connection", file=sys.stderr)
+    return 1
+
+
+def main(argv):
+    """
+    Forward the command line to the server named by SUBMERGE_SOCKET, if any.
+    Returns None if the command should run in this process instead.
+    """
+    path = os.environ.get(ENV)
+    # the server itself runs here, of course
+    if not path or command(argv) == "serve":
+        return None
+    try:
+        return forward(argv, os.path.expanduser(path))
+    except KeyboardInterrupt:
+        return 130
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+
+"""
+Run commands in a long-lived server instead of a fresh interpreter.
+
+`submerge serve` listens on a Unix domain socket, with every module imported
+and the language tables, detector profiles and caches loaded once. Commands
+sent by `submerge.client` run here, one at a time, with their output (and any
+prompts) sent back to the client. They run on the main thread, so that a
+client interrupted with Ctrl-C (or going away) interrupts its command just as
+Ctrl-C would in a process of its own.
+"""
+
+# Imports {{{
+# builtins
+import contextlib
+import io
+import json
+import logging
+import os
+import pathlib
+import queue
+import signal
+import socket
+import sys
+import threading
+import traceback
+from typing import Optional, Tuple
+
+# local modules
+from submerge.client import ENV, send
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+
+def default_socket() -> pathlib.Path:
+    """
+    Where `serve` listens, unless told otherwise.
+    """
+    if os.environ.get(ENV):
+        return pathlib.Path(os.environ[ENV]).expanduser()
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return pathlib.Path(runtime) / "submerge.sock"
+    from submerge.cache import cache_dir
+
+    return cache_dir() / "submerge.sock"
+
+
+class Output(io.TextIOBase):
+    """
+    A text stream that sends what is written to it to the client.
+    """
+
+    def __init__(self, connection: "Connection", key: str):
+        self.connection = connection
+        # the message it sends, as in {"stdout": text}
+        self.key = key
+        # named like the standard streams it stands in for
+        self.name = f"<{key}>"
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        # click tells binary streams apart by whether they accept bytes
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        if text:
+            self.connection.send(**{self.key: text})
+        return len(text)
+
+
+class Input(io.TextIOBase):
+    """
+    A text stream that asks the client for a line of input when read.
+    """
+
+    def __init__(self, connection: "Connection"):
+        self.connection = connection
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def readable(self):
+        return True
+
+    def readline(self, size=-1):
+        return self.connection.prompt()
+
+    def read(self, size=-1):
+        return self.readline()
+
+
+class Connection:
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+        self.wfile = sock.makefile("wb")
+        self.lock = threading.Lock()
+        self.closed = False
+        # lines typed in the client, as answers to prompts (None at the end)
+        self.answers: "queue.Queue[Optional[str]]" = queue.Queue()
+
+    def receive(self) -> Optional[dict]:
+        line = self.rfile.readline()
+        return json.loads(line) if line else None
+
+    def listen(self, cancel):
+        """
+        Read what the client sends while its command runs, calling `cancel`
+        if it asks to, or goes away.
+        """
+        try:
+            while True:
+                message = self.receive()
+                if message is None or message.get("cancel"):
+                    cancel()
+                    if message is None:
+                        break
+                elif "stdin" in message:
+                    self.answers.put(message["stdin"])
+        except (OSError, ValueError):
+            cancel()
+        finally:
+            self.answers.put(None)
+
+    def send(self, **message):
+        if self.closed:
+            return
+        try:
+            with self.lock:
+                send(self.wfile, **message)
+        except OSError:
+            # the client went away; let the command finish regardless
+            self.closed = True
+
+    def prompt(self) -> str:
+        self.send(prompt=True)
+        return self.answers.get() or ""
+
+    def close(self):
+        for closing in (self.rfile, self.wfile, self.sock):
+            with contextlib.suppress(OSError):
+                closing.close()
+
+
+def warm_up():
+    """
+    Load everything a command might need up front, so it's ready for the first
+    request.
+    """
+    from submerge import cache, languages
+    from submerge.modules import get_handlers
+
+    get_handlers()
+    languages.get_index(languages.CODES)
+    languages.get_index(languages.NAMES)
+    try:
+        from submerge import detection
+    except ImportError:
+        pass
+    else:
+        detection.persistent = True
+        detection.init_worker()
+    cache.get_cache()
+    cache.get_detection_cache()
+
+
+def run(request: dict, connection: Connection) -> int:
+    """
+    Run a command line in this process, with its output sent to the client.
+    """
+    from submerge import cli
+
+    stdout = Output(connection, "stdout")
+    stderr = Output(connection, "stderr")
+    stdin = Input(connection)
+    level = cli.log.level
+    stream = cli.sh.setStream(stdout)
+    cwd = os.getcwd()
+    try:
+        os.chdir(request.get("cwd") or cwd)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            real_stdin, sys.stdin = sys.stdin, stdin
+            try:
+                cli.main.main(args=request["argv"], prog_name="submerge")
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    return e.code or 0
+                print(e.code, file=stderr)
+                return 1
+            except KeyboardInterrupt:
+                return 130
+            except Exception:
+                traceback.print_exc(file=stderr)
+                return 1
+            finally:
+                sys.stdin = real_stdin
+        return 0
+    except OSError as e:
+        stderr.write(f"Error: {e}\n")
+        return 1
+    finally:
+        os.chdir(cwd)
+        cli.sh.setStream(stream)
+        cli.log.setLevel(level)
+
+
+class Server:
+    """
+    Accept clients on a background thread, and run their commands on the main
+    thread, one at a time, in the order they arrive, since each one changes
+    the working directory and global options of the process.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.requests: "queue.Queue[Tuple[dict, Connection]]" = queue.Queue()
+        # the connection whose command is running, while it runs
+        self.current: Optional[Connection] = None
+        # the connection whose command was interrupted, and whether the signal
+        # doing so is on its way
+        self.cancelled: Optional[Connection] = None
+        self.signalled = False
+        self.lock = threading.Lock()
+        # how the server was asked to stop, raised once the command is done
+        self.stopping: Optional[BaseException] = None
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.sock.accept()
+            except OSError:
+                # closed on the way out
+                return
+            threading.Thread(
+                target=self.receive, args=(Connection(sock),), name="submerge-client", daemon=True
+            ).start()
+
+    def receive(self, connection: Connection):
+        try:
+            request = connection.receive()
+        except (OSError, ValueError) as e:
+            log.debug(f"Dropped a client: {e}")
+            request = None
+        if not request or not isinstance(request.get("argv"), list):
+            connection.close()
+            return
+        self.requests.put((request, connection))
+
+    def cancel(self, connection: Connection):
+        """
+        Interrupt a client's command, if it is running.
+        """
+        with self.lock:
+            if self.current is connection and self.cancelled is None:
+                self.cancelled = connection
+                self.signalled = True
+                signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+
+    def interrupted(self, signum, frame):
+        if self.signalled:
+            self.signalled = False
+            # the command may have finished in the meantime
+            if self.current is not None:
+                raise KeyboardInterrupt
+            return
+        self.stopping = KeyboardInterrupt()
+        raise self.stopping
+
+    def terminated(self, signum, frame):
+        # stop (and remove the socket) when asked to by a service manager, too
+        self.stopping = SystemExit(0)
+        raise self.stopping
+
+    def handle(self, request: dict, connection: Connection) -> int:
+        threading.Thread(
+            target=connection.listen,
+            args=(lambda: self.cancel(connection),),
+            name="submerge-listen",
+            daemon=True,
+        ).start()
+        log.debug(f"Running: submerge {' '.join(request['argv'])}")
+        try:
+            self.current = connection
+            return run(request, connection)
+        finally:
+            self.current = None
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.interrupted)
+        signal.signal(signal.SIGTERM, self.terminated)
+        threading.Thread(target=self.accept, name="submerge-accept", daemon=True).start()
+
+        while self.stopping is None:
+            request, connection = self.requests.get()
+            try:
+                code = self.handle(request, connection)
+            except KeyboardInterrupt:
+                if self.stopping is not None:
+                    raise
+                # cancelled just as the command started or finished
+                code = 130
+            with self.lock:
+                if self.cancelled is connection:
+                    code = 130
+                self.cancelled = None
+            connection.send(exit=code)
+            connection.close()
+        raise self.stopping
+
+
+def serve(path: pathlib.Path):
+    """
+    Handle clients on a Unix domain socket until interrupted.
+    """
+    if path.is_socket():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(path))
+        except OSError:
+            # left behind by a server that didn't shut down cleanly
+            path.unlink()
+        else:
+            raise FileExistsError(f"A server is already listening on {path}")
+        finally:
+            probe.close()
+
+    warm_up()
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # only the user running the server may connect
+    umask = os.umask(0o177)
+    try:
+        server.bind(str(path))
+    finally:
+        os.umask(umask)
+    server.listen(64)
+
+    log.info(f"Listening on {path}; set {ENV}={path} to send commands here.")
+    try:
+        Server(server).run()
+    finally:
+        server.close()
+        with contextlib.suppress(OSError):
+            path.unlink()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Subtitle language detection.
+
+langdetect is pure Python and CPU-bound, so detection is meant to run in a
+process pool. Each worker loads the language profiles once, in `init_worker`,
+and every detection is seeded the same way, so results don't depend on which
+worker (or whether any worker at all) handles a given sample. A long-lived
+server sets `persistent`, so that its pool (and the profiles loaded by its
+workers) is reused from one command to the next.
+"""
+
+# Imports {{{
+# builtins
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from importlib import metadata
+import threading
+from typing import Dict, Iterable, Optional
+
+# 3rd party
+from langdetect import DetectorFactory, detector_factory
+from langdetect.lang_detect_exception import LangDetectException
+
+# }}}
+
+
+SEED = 0
+
+# keep pools running once they are no longer needed, for the next command
+persistent = False
+_pools: Dict[int, Executor] = {}
+_pools_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def detector_version() -> str:
+    """
+    Identify the detector, so cached results are dropped when it changes.
+    """
+    try:
+        version = metadata.version("langdetect")
+    except metadata.PackageNotFoundError:
+        version = "unknown"
+    return f"langdetect-{version}-seed{SEED}"
+
+
+def init_worker():
+    """
+    Load the detector profiles up front, with a fixed seed.
+    """
+    DetectorFactory.seed = SEED
+    detector_factory.init_factory()
+
+
+def detect_language(text: str) -> Optional[str]:
+    """
+    Guess the ISO 639-1 code of the language of some text, if possible.
+    """
+    init_worker()
+    try:
+        code = detector_factory.detect(text)
+    except LangDetectException:
+        return None
+    # some languages are reported with a region, like zh-cn
+    return code.split("-")[0]
+
+
+def get_pool(jobs: int) -> Executor:
+    """
+    Get a pool of `jobs` workers to detect languages with; a thread, if only one.
+    """
+    with _pools_lock:
+        pool = _pools.pop(jobs, None) if persistent else None
+    if pool is not None:
+        return pool
+    if jobs == 1:
+        return ThreadPoolExecutor(1, initializer=init_worker)
+    return ProcessPoolExecutor(jobs, initializer=init_worker)
+
+
+def release_pool(pool: Executor, jobs: int, futures: Iterable[Future] = ()):
+    """
+    Shut down a pool once it is no longer needed (cancelling any of its
+    `futures` that haven't run), or keep it for later if pools are persistent.
+    """
+    if not persistent:
+        pool.shutdown(cancel_futures=True)
+        return
+    for future in futures:
+        future.cancel()
+    with _pools_lock:
+        previous = _pools.setdefault(jobs, pool)
+    if previous is not pool:
+        pool.shutdown(cancel_futures=True)
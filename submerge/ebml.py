@@ -0,0 +1,649 @@
+#!/usr/bin/env python3
+
+"""
+Minimal Matroska reader (and track editor).
+
+Only the parts of the file needed to describe its tracks are parsed: the EBML
+header, the SeekHead, the Segment Info and the Tracks element. Everything is
+read through an mmap, so for a typical file only the first few pages are ever
+touched, no matter how large the file is.
+
+The language and number of tracks can also be edited in place, as long as the
+Tracks element still fits in the space it had, including any Void padding
+right after it. Anything else is left to mkvpropedit.
+"""
+
+# Imports {{{
+# builtins
+import contextlib
+import json
+import mmap
+import pathlib
+import re
+import struct
+import sys
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# local modules
+from submerge import languages
+from submerge.records import FileInfo, TrackInfo
+
+# }}}
+
+
+class ParseError(Exception):
+    pass
+
+
+class Unsupported(Exception):
+    """
+    An edit that can't be made in place.
+    """
+
+
+# element ids {{{
+EBML = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TITLE = 0x7BA9
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_UID = 0x73C5
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+NAME = 0x536E
+LANGUAGE = 0x22B59C
+LANGUAGE_BCP47 = 0x22B59D
+FLAG_DEFAULT = 0x88
+FLAG_FORCED = 0x55AA
+FLAG_ENABLED = 0xB9
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+AUDIO = 0xE1
+SAMPLING_FREQUENCY = 0xB5
+CHANNELS = 0x9F
+CLUSTER = 0x1F43B675
+VOID = 0xEC
+CRC32 = 0xBF
+# }}}
+
+TRACK_TYPES = {1: "video", 2: "audio", 17: "subtitles", 18: "buttons"}
+
+# the names mkvmerge reports for the most common codecs
+CODEC_NAMES = {
+    "V_MPEG4/ISO/AVC": "AVC/H.264/MPEG-4p10",
+    "V_MPEGH/ISO/HEVC": "HEVC/H.265/MPEG-H",
+    "V_MPEG4/ISO/ASP": "MPEG-4p2",
+    "V_MPEG1": "MPEG-1/2",
+    "V_MPEG2": "MPEG-1/2",
+    "V_AV1": "AV1",
+    "V_VP8": "VP8",
+    "V_VP9": "VP9",
+    "A_AAC": "AAC",
+    "A_AC3": "AC-3",
+    "A_EAC3": "E-AC-3",
+    "A_DTS": "DTS",
+    "A_TRUEHD": "TrueHD",
+    "A_FLAC": "FLAC",
+    "A_OPUS": "Opus",
+    "A_VORBIS": "Vorbis",
+    "A_MPEG/L2": "MP2",
+    "A_MPEG/L3": "MP3",
+    "A_PCM/INT/LIT": "PCM",
+    "S_TEXT/UTF8": "SubRip/SRT",
+    "S_TEXT/ASS": "SubStationAlpha",
+    "S_TEXT/SSA": "SubStationAlpha",
+    "S_TEXT/WEBVTT": "WebVTT",
+    "S_HDMV/PGS": "HDMV PGS",
+    "S_HDMV/TEXTST": "HDMV TextST",
+    "S_VOBSUB": "VobSub",
+    "S_DVBSUB": "DVBSUB",
+}
+
+UNKNOWN_SIZE = -1
+
+
+def read_id(data, pos: int) -> Tuple[int, int]:
+    """
+    Read an element id (marker bits included), returning it and the new offset.
+    """
+    try:
+        first = data[pos]
+    except IndexError:
+        raise ParseError(f"Unexpected end of data at offset {pos}") from None
+    length = 1
+    while length <= 4 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 4:
+        raise ParseError(f"Invalid element id at offset {pos}")
+    if pos + length > len(data):
+        raise ParseError(f"Unexpected end of data at offset {pos}")
+    return int.from_bytes(data[pos : pos + length], "big"), pos + length
+
+
+def read_size(data, pos: int) -> Tuple[int, int]:
+    """
+    Read an element data size, returning it and the new offset.
+    """
+    try:
+        first = data[pos]
+    except IndexError:
+        raise ParseError(f"Unexpected end of data at offset {pos}") from None
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise ParseError(f"Invalid element size at offset {pos}")
+    if pos + length > len(data):
+        raise ParseError(f"Unexpected end of data at offset {pos}")
+
+    value = first & (0xFF >> length)
+    for byte in data[pos + 1 : pos + length]:
+        value = (value << 8) | byte
+    if value == (1 << (7 * length)) - 1:
+        value = UNKNOWN_SIZE
+    return value, pos + length
+
+
+def read_header(data, pos: int) -> Tuple[int, int, int]:
+    """
+    Read an element header, returning its id, data offset and data size.
+    """
+    element_id, pos = read_id(data, pos)
+    size, pos = read_size(data, pos)
+    return element_id, pos, size
+
+
+def spans(data, start: int, end: int) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Iterate over the (id, header offset, data offset, data size) of every
+    child of a master element whose data spans `start` to `end`.
+    """
+    pos = start
+    while pos < end:
+        element_id, offset, size = read_header(data, pos)
+        if size == UNKNOWN_SIZE:
+            raise ParseError(f"Unknown-sized element {element_id:#x} at offset {pos}")
+        if offset + size > len(data):
+            raise ParseError(f"Element {element_id:#x} at offset {pos} is truncated")
+        yield element_id, pos, offset, size
+        pos = offset + size
+
+
+def children(data, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+    """
+    Iterate over the (id, data offset, data size) of every child of a master
+    element whose data spans `start` to `end`.
+    """
+    for element_id, _, offset, size in spans(data, start, end):
+        yield element_id, offset, size
+
+
+def uint(data, offset: int, size: int) -> int:
+    return int.from_bytes(data[offset : offset + size], "big")
+
+
+def string(data, offset: int, size: int) -> str:
+    raw = bytes(data[offset : offset + size])
+    return raw.split(b"\0", 1)[0].decode("utf-8", errors="replace")
+
+
+def double(data, offset: int, size: int) -> float:
+    if size == 4:
+        return struct.unpack(">f", data[offset : offset + 4])[0]
+    elif size == 8:
+        return struct.unpack(">d", data[offset : offset + 8])[0]
+    return 0.0
+
+
+def parse_seek_head(data, start: int, end: int, segment: int) -> Dict[int, int]:
+    positions = {}
+    for element_id, offset, size in children(data, start, end):
+        if element_id != SEEK:
+            continue
+        seek_id = position = None
+        for child_id, child_offset, child_size in children(data, offset, offset + size):
+            if child_id == SEEK_ID:
+                seek_id = uint(data, child_offset, child_size)
+            elif child_id == SEEK_POSITION:
+                position = uint(data, child_offset, child_size)
+        if seek_id is not None and position is not None:
+            positions.setdefault(seek_id, segment + position)
+    return positions
+
+
+def parse_info(data, start: int, end: int) -> dict:
+    scale = 1000000
+    duration = title = None
+    for element_id, offset, size in children(data, start, end):
+        if element_id == TIMESTAMP_SCALE:
+            scale = uint(data, offset, size)
+        elif element_id == DURATION:
+            duration = double(data, offset, size)
+        elif element_id == TITLE:
+            title = string(data, offset, size)
+
+    properties = {}
+    if title is not None:
+        properties["title"] = title
+    if duration is not None:
+        properties["duration"] = int(duration * scale)
+    return properties
+
+
+def parse_track_entry(data, start: int, end: int) -> Optional[dict]:
+    entry = {}
+    for element_id, offset, size in children(data, start, end):
+        if element_id == TRACK_NUMBER:
+            entry["number"] = uint(data, offset, size)
+        elif element_id == TRACK_UID:
+            entry["uid"] = uint(data, offset, size)
+        elif element_id == TRACK_TYPE:
+            entry["type"] = uint(data, offset, size)
+        elif element_id == CODEC_ID:
+            entry["codec_id"] = string(data, offset, size)
+        elif element_id == NAME:
+            entry["track_name"] = string(data, offset, size)
+        elif element_id == LANGUAGE:
+            entry["language"] = string(data, offset, size)
+        elif element_id == LANGUAGE_BCP47:
+            entry["language_ietf"] = string(data, offset, size)
+        elif element_id == FLAG_DEFAULT:
+            entry["default_track"] = bool(uint(data, offset, size))
+        elif element_id == FLAG_FORCED:
+            entry["forced_track"] = bool(uint(data, offset, size))
+        elif element_id == FLAG_ENABLED:
+            entry["enabled_track"] = bool(uint(data, offset, size))
+        elif element_id == VIDEO:
+            dimensions = {}
+            for child_id, child_offset, child_size in children(data, offset, offset + size):
+                if child_id in (PIXEL_WIDTH, PIXEL_HEIGHT):
+                    dimensions[child_id] = uint(data, child_offset, child_size)
+            if len(dimensions) == 2:
+                entry["pixel_dimensions"] = (
+                    f"{dimensions[PIXEL_WIDTH]}x{dimensions[PIXEL_HEIGHT]}"
+                )
+        elif element_id == AUDIO:
+            for child_id, child_offset, child_size in children(data, offset, offset + size):
+                if child_id == CHANNELS:
+                    entry["audio_channels"] = uint(data, child_offset, child_size)
+                elif child_id == SAMPLING_FREQUENCY:
+                    frequency = double(data, child_offset, child_size)
+                    entry["audio_sampling_frequency"] = int(frequency)
+
+    if TRACK_TYPES.get(entry.get("type")) is None or "number" not in entry:
+        return None
+
+    if "language" not in entry:
+        # a missing Language element means English, unless BCP 47 says otherwise
+        entry["language"] = "eng"
+        if "language_ietf" in entry:
+            entry["language"] = bcp47_to_legacy(entry["language_ietf"])
+
+    entry.setdefault("default_track", True)
+    entry.setdefault("forced_track", False)
+    entry.setdefault("enabled_track", True)
+    return entry
+
+
+def bcp47_to_legacy(tag: str) -> str:
+    primary = tag.split("-")[0].lower()
+    if primary == "und":
+        return "und"
+    try:
+        lang = languages.lookup(primary)
+        return lang.bibliographic or lang.alpha_3
+    except LookupError:
+        return "und"
+
+
+def parse_tracks(data, start: int, end: int) -> list:
+    tracks = []
+    for element_id, offset, size in children(data, start, end):
+        if element_id != TRACK_ENTRY:
+            continue
+        entry = parse_track_entry(data, offset, offset + size)
+        if entry is None:
+            continue
+
+        track_type = TRACK_TYPES[entry.pop("type")]
+        codec_id = entry.get("codec_id", "")
+        tracks.append(
+            {
+                "id": len(tracks),
+                "type": track_type,
+                "codec": CODEC_NAMES.get(codec_id, codec_id),
+                "properties": entry,
+            }
+        )
+    return tracks
+
+
+def locate(data) -> Tuple[str, int, Dict[int, Tuple[int, int, int]]]:
+    """
+    Find the Segment Info and Tracks elements of a Matroska file, returning
+    its document type, the data offset of its Segment, and the (header offset,
+    data offset, data size) of each element found.
+    """
+    element_id, offset, size = read_header(data, 0)
+    if element_id != EBML:
+        raise ParseError("Not an EBML file")
+
+    doc_type = None
+    for child_id, child_offset, child_size in children(data, offset, offset + size):
+        if child_id == DOC_TYPE:
+            doc_type = string(data, child_offset, child_size)
+    if doc_type not in ("matroska", "webm"):
+        raise ParseError(f"Unsupported document type {doc_type!r}")
+
+    element_id, segment, size = read_header(data, offset + size)
+    if element_id != SEGMENT:
+        raise ParseError("No Segment found")
+    segment_end = len(data) if size == UNKNOWN_SIZE else min(segment + size, len(data))
+
+    # walk the top-level elements until the first Cluster, then fall back to
+    # whatever the SeekHead says for anything we haven't seen yet
+    found = {}
+    seek = {}
+    pos = segment
+    while pos < segment_end:
+        element_id, offset, size = read_header(data, pos)
+        if element_id == CLUSTER or size == UNKNOWN_SIZE:
+            break
+        if element_id in (INFO, TRACKS):
+            found.setdefault(element_id, (pos, offset, size))
+        elif element_id == SEEK_HEAD:
+            for seek_id, position in parse_seek_head(
+                data, offset, offset + size, segment
+            ).items():
+                seek.setdefault(seek_id, position)
+        if INFO in found and TRACKS in found:
+            break
+        pos = offset + size
+
+    for element_id in (INFO, TRACKS):
+        if element_id not in found and element_id in seek:
+            seek_id, offset, size = read_header(data, seek[element_id])
+            if seek_id != element_id or size == UNKNOWN_SIZE:
+                raise ParseError(f"SeekHead entry for {element_id:#x} is invalid")
+            found[element_id] = (seek[element_id], offset, size)
+
+    if TRACKS not in found:
+        raise ParseError("No Tracks element found")
+    return doc_type, segment, found
+
+
+def parse(data) -> dict:
+    """
+    Parse a Matroska file's header, returning metadata shaped like the output
+    of `mkvmerge -J`.
+    """
+    doc_type, _, found = locate(data)
+    _, offset, size = found[TRACKS]
+    tracks = parse_tracks(data, offset, offset + size)
+    properties = {}
+    if INFO in found:
+        _, offset, size = found[INFO]
+        properties = parse_info(data, offset, offset + size)
+
+    return {
+        "container": {
+            "recognized": True,
+            "supported": True,
+            "type": "WebM" if doc_type == "webm" else "Matroska",
+            "properties": properties,
+        },
+        "errors": [],
+        "warnings": [],
+        "tracks": tracks,
+    }
+
+
+def file_info(data) -> FileInfo:
+    """
+    Parse just enough of a Matroska file's header to describe its tracks.
+    """
+    _, _, found = locate(data)
+    _, offset, size = found[TRACKS]
+    return FileInfo(
+        tuple(
+            TrackInfo.make(
+                track["id"],
+                track["properties"]["number"],
+                track["type"],
+                track["codec"],
+                track["properties"].get("codec_id", ""),
+                track["properties"]["language"],
+                track["properties"].get("track_name"),
+            )
+            for track in parse_tracks(data, offset, offset + size)
+        )
+    )
+
+
+@contextlib.contextmanager
+def mapped(file: pathlib.Path) -> Iterator[mmap.mmap]:
+    with open(file, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            raise ParseError("File is empty") from None
+
+    with data:
+        yield data
+
+
+def probe(file: pathlib.Path) -> dict:
+    """
+    Read the metadata of a Matroska file without spawning mkvmerge, shaped
+    like the output of `mkvmerge -J`.
+    """
+    with mapped(file) as data:
+        metadata = parse(data)
+    metadata["file_name"] = str(file)
+    return metadata
+
+
+def read(file: pathlib.Path) -> FileInfo:
+    """
+    Read the tracks of a Matroska file without spawning mkvmerge.
+    """
+    with mapped(file) as data:
+        return file_info(data)
+
+
+# Editing {{{
+SELECTOR = re.compile(r"track:@(\d+)")
+
+
+def encode_size(size: int, length: int = 1) -> bytes:
+    """
+    Encode an element data size, in at least `length` bytes.
+    """
+    while size >= (1 << (7 * length)) - 1:
+        length += 1
+    if length > 8:
+        raise Unsupported(f"{size} is too large for an EBML size")
+    return ((1 << (7 * length)) | size).to_bytes(length, "big")
+
+
+def encode_element(element_id: int, payload: bytes, size_length: int = 1) -> bytes:
+    encoded_id = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return encoded_id + encode_size(len(payload), size_length) + payload
+
+
+def void(length: int) -> bytes:
+    """
+    A Void element exactly `length` (at least 2) bytes long.
+    """
+    size_length = 1 if length - 2 < 127 else 8
+    return encode_element(VOID, bytes(length - 1 - size_length), size_length)
+
+
+def checksummed(parts: List[bytes], crc: bool) -> bytes:
+    """
+    Join the children of a master element, led by a fresh CRC-32 if it had one.
+    """
+    payload = b"".join(parts)
+    if crc:
+        payload = encode_element(CRC32, zlib.crc32(payload).to_bytes(4, "little")) + payload
+    return payload
+
+
+def bcp47(code: str) -> str:
+    lang = languages.lookup(code)
+    return lang.alpha_2 or lang.alpha_3
+
+
+def entry_changes(properties: Dict[str, str]) -> Dict[int, bytes]:
+    """
+    The new contents of the elements of a TrackEntry, by element id, to set
+    some properties the way mkvpropedit would: the Language element gets the
+    ISO 639-2/B code, and LanguageBCP47 is set (or added) to match.
+    """
+    changes = {}
+    for name, value in properties.items():
+        if name == "track-number":
+            number = int(value)
+            if number < 1:
+                raise Unsupported(f"Invalid track number {value!r}")
+            changes[TRACK_NUMBER] = number.to_bytes((number.bit_length() + 7) // 8, "big")
+        elif name == "language":
+            try:
+                tag = bcp47(value)
+            except LookupError:
+                raise Unsupported(f"Unknown language {value!r}") from None
+            changes[LANGUAGE] = bcp47_to_legacy(tag).encode()
+            if "language-ietf" not in properties:
+                changes[LANGUAGE_BCP47] = tag.encode()
+        elif name == "language-ietf":
+            changes[LANGUAGE_BCP47] = value.encode()
+            if "language" not in properties:
+                changes[LANGUAGE] = bcp47_to_legacy(value).encode()
+        else:
+            raise Unsupported(f"Can't set {name} in place")
+    return changes
+
+
+def rebuild_entry(data, start: int, end: int, changes: Dict[int, bytes]) -> bytes:
+    """
+    The data of a TrackEntry with some elements replaced, or added if missing.
+    Its Void padding is dropped, to be given back after the Tracks element.
+    """
+    parts = []
+    crc = False
+    changes = dict(changes)
+    for element_id, pos, offset, size in spans(data, start, end):
+        if element_id == CRC32:
+            crc = True
+        elif element_id == VOID:
+            continue
+        elif element_id in changes:
+            parts.append(encode_element(element_id, changes.pop(element_id)))
+        else:
+            parts.append(bytes(data[pos : offset + size]))
+    parts.extend(encode_element(element_id, value) for element_id, value in changes.items())
+    return checksummed(parts, crc)
+
+
+def edit_tracks(data, edits: Dict[str, Dict[str, str]]) -> Optional[Tuple[int, bytes]]:
+    """
+    Work out how to make edits (by mkvpropedit selector, like "track:@2") to
+    the mapped file. Returns the offset and bytes to overwrite, or None if
+    nothing would change.
+    """
+    numbers = {}
+    for selector, properties in edits.items():
+        match = SELECTOR.fullmatch(selector)
+        if not match:
+            raise Unsupported(f"Can't select {selector!r} in place")
+        numbers[int(match[1])] = properties
+
+    _, segment, found = locate(data)
+    if read_id(data, segment)[0] == CRC32:
+        raise Unsupported("The Segment is checksummed")
+    pos, offset, size = found[TRACKS]
+
+    # the space available is the Tracks element and any Void following it
+    end = offset + size
+    if end < len(data):
+        element_id, void_offset, void_size = read_header(data, end)
+        if element_id == VOID and void_size != UNKNOWN_SIZE:
+            end = min(void_offset + void_size, len(data))
+
+    parts = []
+    crc = False
+    for element_id, child_pos, child_offset, child_size in spans(data, offset, offset + size):
+        if element_id == CRC32:
+            crc = True
+            continue
+        if element_id == VOID:
+            continue
+        if element_id == TRACK_ENTRY:
+            entry = parse_track_entry(data, child_offset, child_offset + child_size)
+            if entry is not None and entry["number"] in numbers:
+                changes = entry_changes(numbers.pop(entry["number"]))
+                rebuilt = rebuild_entry(data, child_offset, child_offset + child_size, changes)
+                parts.append(encode_element(TRACK_ENTRY, rebuilt))
+                continue
+        parts.append(bytes(data[child_pos : child_offset + child_size]))
+
+    if numbers:
+        raise Unsupported(f"No track numbered {', '.join(map(str, numbers))}")
+
+    payload = checksummed(parts, crc)
+    tracks = encode_element(TRACKS, payload)
+    slack = end - pos - len(tracks)
+    if slack == 1:
+        # too little for a Void, so take it up with a longer size instead
+        size_length = len(tracks) - len(payload) - 4 + 1
+        tracks = encode_element(TRACKS, payload, size_length)
+        slack = 0
+    if slack < 0:
+        raise Unsupported(f"The Tracks element needs {-slack} more byte(s)")
+
+    replacement = tracks + (void(slack) if slack else b"")
+    if replacement == data[pos:end]:
+        return None
+    return pos, replacement
+
+
+def edit(file: pathlib.Path, edits: Dict[str, Dict[str, str]]) -> bool:
+    """
+    Edit the tracks of a Matroska file in place, without spawning mkvpropedit.
+    Raises Unsupported (or ParseError) without touching the file if the edits
+    can't be made this way. Returns whether the file was changed.
+    """
+    with open(file, "r+b") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0)
+        except ValueError:  # empty file
+            raise ParseError("File is empty") from None
+
+    with data:
+        change = edit_tracks(data, edits)
+        if change is None:
+            return False
+        pos, replacement = change
+        data[pos : pos + len(replacement)] = replacement
+        data.flush()
+    return True
+
+
+# }}}
+
+
+if __name__ == "__main__":
+    # print the metadata of the given files, for comparison with `mkvmerge -J`
+    for arg in sys.argv[1:]:
+        print(json.dumps(probe(pathlib.Path(arg)), indent=2))
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+
+"""
+Shared execution engine for mkvtoolnix calls.
+
+Every subprocess is started with asyncio on a single background event loop and
+has to acquire a slot from one global semaphore, so `--jobs` bounds the number
+of mkvtoolnix processes alive at once across all modules. Per-file work is
+fanned out with `map`/`submit_all`, which only read a little ahead of the work
+that has finished.
+
+Storage differs wildly in how much parallel work it can take: a spinning disk
+slows down as soon as two files are read at once, while NVMe or a network
+share only reaches its best throughput with many requests in flight. So files
+are queued by the device they are on, and each device gets its own limit on
+how many of its files are worked on at once, which adapts to how long each
+file takes (see DeviceLimit). Devices don't wait on each other, so each one
+in a mixed library runs at its own pace, within the overall `--jobs`.
+"""
+
+# Imports {{{
+# builtins
+import asyncio
+import collections
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import logging
+import os
+import pathlib
+import subprocess
+import threading
+import time
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+# local modules
+from submerge import trace
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+Item = TypeVar("Item")
+Result = TypeVar("Result")
+
+# how far input is read ahead of the oldest unfinished item, in multiples of
+# `jobs`, to find work for devices that have room for more
+LOOKAHEAD = 4
+# how often a run with work waiting on busy devices checks for room
+POLL = 0.1
+
+
+def default_jobs() -> int:
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def mount_point(path: pathlib.Path) -> pathlib.Path:
+    path = path.absolute()
+    device = path.stat().st_dev
+    while path.parent != path and path.parent.stat().st_dev == device:
+        path = path.parent
+    return path
+
+
+def file_path(item) -> Optional[os.PathLike]:
+    """
+    The file an item of work is about: the item itself, if it is a path.
+    """
+    return item if isinstance(item, os.PathLike) else None
+
+
+class DeviceLimit:
+    """
+    How many files on one device are worked on at once, adjusted by AIMD.
+
+    Work is counted in rounds of as many files as the limit. At the end of
+    each round, the device's throughput (files per second, from the average
+    time a file took and how many were worked on at once) is compared to the
+    best round seen: if it is much lower, with more files at once than then,
+    the device is taking more than it can handle, and the limit is cut;
+    otherwise it grows, doubling each round at first (until the first cut),
+    then by one. Files only taking longer as more are worked on at once is
+    fine, as long as more get done overall. Files started before a cut don't
+    count towards the next round, as they were slowed down by the old limit.
+    The best throughput slowly drifts down, and is replaced by any round with
+    no more files at once, so that a change in the kind of work isn't
+    mistaken for an overloaded device forever.
+    """
+
+    # how much lower than its best a device's throughput may get before its
+    # limit is cut
+    SLOWDOWN = 1.3
+    DECREASE = 0.7
+    # how much the best throughput drifts down each round
+    DRIFT = 1.01
+
+    def __init__(self, name: str, maximum: int):
+        self.name = name
+        self.maximum = maximum
+        self.limit = min(2, maximum)
+        # the limit grows exponentially up to here
+        self.threshold = maximum
+        self.active = 0
+        self.best: Optional[float] = None
+        # how many files were worked on at once in the best round
+        self.best_limit = 0
+        # files finished in the current round, and the time they took
+        self.completed = 0
+        self.elapsed = 0.0
+        # counts cuts, to tell files started before the last one apart
+        self.generation = 0
+
+    def available(self) -> bool:
+        return self.active < self.limit
+
+    def start(self) -> int:
+        self.active += 1
+        return self.generation
+
+    def set_maximum(self, maximum: int):
+        self.maximum = maximum
+        self.threshold = min(self.threshold, maximum)
+        self.limit = min(self.limit, maximum)
+
+    def done(self, seconds: float, generation: int):
+        self.active -= 1
+        if generation != self.generation:
+            return
+        self.completed += 1
+        self.elapsed += seconds
+        if self.completed < self.limit:
+            return
+        latency = self.elapsed / self.completed
+        throughput = self.limit / max(latency, 1e-6)
+        self.completed = 0
+        self.elapsed = 0.0
+
+        previous = self.limit
+        if (
+            self.best is not None
+            and throughput * self.SLOWDOWN < self.best
+            and self.limit > self.best_limit
+        ):
+            self.limit = self.threshold = max(1, int(self.limit * self.DECREASE))
+            self.generation += 1
+        elif self.limit < self.threshold:
+            self.limit = min(self.limit * 2, self.threshold)
+        else:
+            self.limit = min(self.limit + 1, self.maximum)
+        if (
+            self.best is None
+            or throughput > self.best / self.DRIFT
+            # as many files at once or fewer can't overload the device more
+            or previous <= self.best_limit
+        ):
+            self.best = throughput
+            self.best_limit = previous
+        else:
+            self.best /= self.DRIFT
+
+        if self.limit != previous:
+            log.debug(
+                f"{self.name}: {previous} -> {self.limit} file(s) at once"
+                f" ({throughput:.1f} files/s, best {self.best:.1f})"
+            )
+
+
+class Cancelled(Exception):
+    """
+    Raised when a process is requested after the engine has been interrupted.
+    """
+
+
+class Engine:
+    def __init__(self, jobs: Optional[int] = None, max_per_device: Optional[int] = None):
+        self.jobs = jobs or default_jobs()
+        self.max_per_device = min(max_per_device or self.jobs, self.jobs)
+        self.loop = None
+        self.semaphore = None
+        self.processes = set()
+        self.missing = set()
+        self.cancelled = False
+        self.lock = threading.Lock()
+        # st_dev -> its limit, kept for as long as the process runs
+        self.limits: Dict[int, DeviceLimit] = {}
+        # directory -> the limit of its device, or None if it can't be told
+        self.directories: Dict[str, Optional[DeviceLimit]] = {}
+        # guards the limits, and is notified when one of them frees up
+        self.freed = threading.Condition()
+
+    def configure(self, jobs: Optional[int] = None, max_per_device: Optional[int] = None):
+        self.jobs = jobs or default_jobs()
+        self.max_per_device = min(max_per_device or self.jobs, self.jobs)
+        self.semaphore = None
+        self.cancelled = False
+        with self.freed:
+            for limit in self.limits.values():
+                limit.set_maximum(self.max_per_device)
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=self.loop.run_forever, name="submerge-engine", daemon=True
+                )
+                thread.start()
+            return self.loop
+
+    async def run_async(
+        self,
+        cmd: List,
+        input: Optional[bytes] = None,
+        text: bool = True,
+        stderr: Optional[int] = None,
+        until: Optional[Callable[[], bool]] = None,
+        poll: float = 0.25,
+        on_line: Optional[Callable[[str], None]] = None,
+        span=trace.NULL_SPAN,
+    ) -> subprocess.CompletedProcess:
+        """
+        Run a command once a job slot is free, capturing its stdout.
+
+        If `until` is given, it is called every `poll` seconds while the
+        process runs, and the process is terminated once it returns True.
+        If `on_line` is given, it is called with each line of output as soon
+        as the process prints it.
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.jobs)
+
+        queued = trace.now()
+        async with self.semaphore:
+            span.set(queued_ms=(trace.now() - queued) / 1e6)
+            if self.cancelled:
+                raise Cancelled(cmd[0])
+            args = [str(arg) for arg in cmd]
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr,
+                )
+            except FileNotFoundError:
+                if args[0] not in self.missing:
+                    self.missing.add(args[0])
+                    log.error(f"{args[0]} not found.")
+                raise
+            self.processes.add(proc)
+            span.set(pid=proc.pid)
+
+            async def read_lines():
+                chunks = []
+                async for line in proc.stdout:
+                    chunks.append(line)
+                    on_line(line.decode(errors="replace").rstrip("\r\n"))
+                await proc.wait()
+                return b"".join(chunks), None
+
+            try:
+                if on_line is None:
+                    communicate = asyncio.ensure_future(proc.communicate(input))
+                else:
+                    communicate = asyncio.ensure_future(read_lines())
+                while until is not None and not communicate.done():
+                    await asyncio.wait({communicate}, timeout=poll)
+                    if not communicate.done() and until():
+                        try:
+                            proc.terminate()
+                        except ProcessLookupError:
+                            # it exited on its own in the meantime
+                            pass
+                        break
+                stdout, errors = await communicate
+            except asyncio.CancelledError:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+                raise
+            finally:
+                self.processes.discard(proc)
+
+        if text:
+            stdout = stdout.decode(errors="replace")
+            errors = errors.decode(errors="replace") if errors is not None else None
+        return subprocess.CompletedProcess(args, proc.returncode, stdout, errors)
+
+    def run(self, cmd: List, check: bool = False, **kwargs) -> subprocess.CompletedProcess:
+        """
+        Run a command on the engine, blocking the calling thread until it exits.
+        """
+        with trace.span(os.path.basename(cmd[0]), "subprocess", cmd=cmd) as span:
+            future = asyncio.run_coroutine_threadsafe(
+                self.run_async(cmd, span=span, **kwargs), self.get_loop()
+            )
+            try:
+                proc = future.result()
+            except KeyboardInterrupt:
+                future.cancel()
+                self.cancel()
+                raise
+            span.set(returncode=proc.returncode)
+
+        if check:
+            proc.check_returncode()
+        return proc
+
+    def cancel(self):
+        """
+        Kill every running process and refuse to start any new ones.
+        """
+        self.cancelled = True
+        if self.loop is None:
+            return
+
+        def kill_all():
+            for proc in list(self.processes):
+                if proc.returncode is None:
+                    proc.kill()
+
+        self.loop.call_soon_threadsafe(kill_all)
+
+    def device_limit(self, file: Optional[os.PathLike]) -> Optional[DeviceLimit]:
+        """
+        The limit of the device a file is on.
+        """
+        if file is None:
+            return None
+        directory = os.path.dirname(os.path.abspath(file))
+        with self.freed:
+            if directory in self.directories:
+                return self.directories[directory]
+        try:
+            device = os.stat(directory).st_dev
+        except OSError:
+            limit = None
+        else:
+            with self.freed:
+                limit = self.limits.get(device)
+            if limit is None:
+                # only named for logging, so only walked up for new devices
+                try:
+                    name = str(mount_point(pathlib.Path(directory)))
+                except OSError:
+                    name = directory
+                with self.freed:
+                    limit = self.limits.setdefault(
+                        device, DeviceLimit(name, self.max_per_device)
+                    )
+        with self.freed:
+            if len(self.directories) > 100000:
+                self.directories.clear()
+            self.directories[directory] = limit
+        return limit
+
+    def schedule(
+        self,
+        func: Callable[[Item], Result],
+        items: Iterable[Item],
+        path: Callable[[Item], Optional[os.PathLike]] = file_path,
+    ) -> Iterator[Tuple[int, Future]]:
+        """
+        Run `func` over `items` in parallel, yielding the index and future of
+        each item as it completes. Items are queued by the device their `path`
+        is on, and started as their device's limit allows.
+        """
+
+        def timed(item, elapsed: List[float]):
+            start = time.perf_counter()
+            try:
+                return func(item)
+            finally:
+                elapsed.append(time.perf_counter() - start)
+
+        executor = ThreadPoolExecutor(self.jobs, thread_name_prefix="submerge")
+        inputs = enumerate(items)
+        queued: Dict[Optional[DeviceLimit], Deque[Tuple[int, Item]]] = {}
+        # the limit of each device when this run first queued work on it
+        initial: Dict[DeviceLimit, int] = {}
+        waiting = 0
+        # future -> (index, limit, generation of the limit, elapsed)
+        running: Dict[Future, Tuple[int, Optional[DeviceLimit], int, List[float]]] = {}
+        unfinished: Set[int] = set()
+        read = 0
+        exhausted = False
+        try:
+            while True:
+                # start whatever the devices have room for
+                with self.freed:
+                    for limit, queue in queued.items():
+                        while queue and len(running) < self.jobs:
+                            generation = 0
+                            if limit is not None:
+                                if not limit.available():
+                                    break
+                                generation = limit.start()
+                            index, item = queue.popleft()
+                            waiting -= 1
+                            elapsed = []
+                            future = executor.submit(timed, item, elapsed)
+                            running[future] = (index, limit, generation, elapsed)
+
+                # read ahead while there is room to start something
+                if (
+                    not exhausted
+                    and len(running) < self.jobs
+                    and (not unfinished or read - min(unfinished) < LOOKAHEAD * self.jobs)
+                ):
+                    try:
+                        index, item = next(inputs)
+                    except StopIteration:
+                        exhausted = True
+                        continue
+                    read = index + 1
+                    unfinished.add(index)
+                    limit = self.device_limit(path(item))
+                    if limit is not None:
+                        initial.setdefault(limit, limit.limit)
+                    queued.setdefault(limit, collections.deque()).append((index, item))
+                    waiting += 1
+                    continue
+
+                if not running:
+                    if not waiting:
+                        break
+                    # every waiting device is busy with the work of other runs
+                    with self.freed:
+                        self.freed.wait(POLL)
+                    continue
+
+                done, _ = wait(
+                    running, timeout=POLL if waiting else None, return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    index, limit, generation, elapsed = running.pop(future)
+                    if limit is not None:
+                        with self.freed:
+                            limit.done(elapsed[0] if elapsed else 0.0, generation)
+                            self.freed.notify_all()
+                    unfinished.discard(index)
+                    yield index, future
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        finally:
+            # also reached when the consumer stops early: drop queued work
+            executor.shutdown(wait=True, cancel_futures=True)
+            with self.freed:
+                for _, limit, _, _ in running.values():
+                    if limit is not None:
+                        limit.active -= 1
+                self.freed.notify_all()
+                # the limits this run found are worth knowing, the others less so
+                for limit, start in initial.items():
+                    report = log.info if limit.limit != start else log.debug
+                    report(f"{limit.name}: {start} -> {limit.limit} file(s) at once")
+
+    def submit_all(
+        self,
+        func: Callable[[Item], Result],
+        items: Iterable[Item],
+        path: Callable[[Item], Optional[os.PathLike]] = file_path,
+    ) -> Iterator[Future]:
+        """
+        Run `func` over `items` in parallel, yielding each finished future as it
+        completes. At most `jobs` items are in flight at once (and fewer per
+        device, see `schedule`), and `items` is only read a little ahead of the
+        work that has finished.
+        """
+        for _, future in self.schedule(func, items, path):
+            yield future
+
+    def map(
+        self,
+        func: Callable[[Item], Result],
+        items: Iterable[Item],
+        path: Callable[[Item], Optional[os.PathLike]] = file_path,
+    ) -> Iterator[Result]:
+        """
+        Like `submit_all`, but yield results in the same order as `items`.
+        """
+        finished: Dict[int, Future] = {}
+        next_index = 0
+        for index, future in self.schedule(func, items, path):
+            finished[index] = future
+            while next_index in finished:
+                yield finished.pop(next_index).result()
+                next_index += 1
+
+engine = Engine()
+configure = engine.configure
+run = engine.run
+submit_all = engine.submit_all
+map = engine.map
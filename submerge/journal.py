@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""
+Checkpoints for long batch runs.
+
+`tag`, `tracks` and `merge` append a line to a journal for each file they
+finish, with the file's fingerprint before and after the change. Lines are
+written as files finish and fsync'd every few records, so a crash, reboot or
+Ctrl-C loses at most the last few, and `--resume` skips every file recorded
+as done that hasn't changed since.
+"""
+
+# Imports {{{
+# builtins
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from typing import Dict, IO, Iterable, Iterator, NamedTuple, Optional, Set
+
+# local modules
+from submerge import cache
+from submerge.cache import Fingerprint
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+# fsync after this many records, or this many seconds since the last fsync
+SYNC_EVERY = 64
+SYNC_INTERVAL = 2.0
+
+
+class Entry(NamedTuple):
+    file: str
+    before: Optional[Fingerprint]
+    after: Fingerprint
+    # set when the result was written to another file, like a merge
+    output: Optional[str] = None
+
+    def is_current(self) -> bool:
+        """
+        Whether the file is still exactly as it was left.
+        """
+        try:
+            if self.output is None:
+                return Fingerprint.of(self.file) == self.after
+            return (
+                Fingerprint.of(self.file) == self.before
+                and Fingerprint.of(self.output) == self.after
+            )
+        except OSError:
+            return False
+
+
+def job_key(command: str, params: dict) -> str:
+    """
+    Identify a run by its command and options, with paths made absolute.
+    """
+
+    def describe(value):
+        if isinstance(value, pathlib.Path):
+            return str(value.absolute())
+        if isinstance(value, (list, tuple)):
+            return [describe(item) for item in value]
+        if hasattr(value, "read"):
+            return os.path.abspath(value.name)
+        return value if value is None or isinstance(value, (bool, int, float)) else str(value)
+
+    return json.dumps(
+        [command, {key: describe(value) for key, value in sorted(params.items())}]
+    )
+
+
+def default_path(job: str) -> pathlib.Path:
+    digest = hashlib.sha1(job.encode()).hexdigest()[:16]
+    return cache.cache_dir() / "journals" / f"{digest}.ndjson"
+
+
+def fingerprint(data: Optional[dict]) -> Optional[Fingerprint]:
+    return Fingerprint(**data) if data else None
+
+
+def read(path: pathlib.Path, job: str) -> Dict[str, Entry]:
+    """
+    Load the files recorded as done. A line cut short by a crash is ignored.
+    """
+    done = {}
+    with open(path, encoding="utf-8") as fp:
+        for number, line in enumerate(fp):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if number == 0:
+                if record.get("version") != VERSION:
+                    raise ValueError(f"Unsupported journal version {record.get('version')!r}")
+                if record.get("job") != job:
+                    raise ValueError(f"{path} is the journal of a different command")
+                continue
+            try:
+                entry = Entry(
+                    record["file"],
+                    fingerprint(record["before"]),
+                    fingerprint(record["after"]),
+                    record.get("output"),
+                )
+            except (KeyError, TypeError):
+                continue
+            done[entry.file] = entry
+    return done
+
+
+def ends_with_newline(path: pathlib.Path) -> bool:
+    with open(path, "rb") as fp:
+        fp.seek(-1, os.SEEK_END)
+        return fp.read(1) == b"\n"
+
+
+class Journal:
+    """
+    The record of the files a run has finished.
+
+    A read-only journal (for simulated runs) can still skip finished files,
+    but records nothing.
+    """
+
+    def __init__(self, path: pathlib.Path, job: str, resume: bool = False, readonly: bool = False):
+        self.path = path
+        self.job = job
+        self.readonly = readonly
+        self.done: Dict[str, Entry] = {}
+        self.lock = threading.Lock()
+        self.fp: Optional[IO[str]] = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        # files seen by pending() that this run has yet to finish
+        self.unfinished: Set[str] = set()
+        self.skipped = 0
+
+        if resume and path.is_file():
+            self.done = read(path, job)
+            log.info(f"Resuming from {path}: {len(self.done)} file(s) already done.")
+        elif resume:
+            log.info(f"No journal found at {path}, starting from the beginning.")
+
+        if readonly:
+            return
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.fp = open(path, "a" if resume else "w", encoding="utf-8")
+        if self.fp.tell() == 0:
+            self.write({"version": VERSION, "job": job, "started": time.time()})
+            self.sync()
+        elif not ends_with_newline(path):
+            # finish a line that was cut short, so the next one starts cleanly
+            self.fp.write("\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        self.report()
+
+    def pending(self, files: Iterable[pathlib.Path]) -> Iterator[pathlib.Path]:
+        """
+        Filter out the files recorded as done that haven't changed since.
+        """
+        for file in files:
+            key = str(file.absolute())
+            entry = self.done.get(key)
+            if entry is not None and entry.is_current():
+                self.skipped += 1
+                continue
+            self.unfinished.add(key)
+            yield file
+
+    def record(
+        self,
+        file: pathlib.Path,
+        before: Optional[Fingerprint],
+        after: Optional[Fingerprint] = None,
+        output: Optional[pathlib.Path] = None,
+    ):
+        """
+        Record a file as done. Without `after`, it was left unchanged.
+        """
+        key = str(file.absolute())
+        with self.lock:
+            self.unfinished.discard(key)
+            if self.fp is None:
+                return
+            try:
+                after = after or Fingerprint.of(output or file)
+                before = before or (after if output is None else Fingerprint.of(file))
+            except OSError:
+                return
+            record = {
+                "file": key,
+                "before": before._asdict(),
+                "after": after._asdict(),
+            }
+            if output is not None:
+                record["output"] = str(output.absolute())
+            self.write(record)
+
+            self.unsynced += 1
+            if self.unsynced >= SYNC_EVERY or time.monotonic() - self.last_sync >= SYNC_INTERVAL:
+                self.sync()
+
+    def write(self, record: dict):
+        self.fp.write(json.dumps(record) + "\n")
+
+    def sync(self):
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.fp is not None:
+                self.sync()
+                self.fp.close()
+                self.fp = None
+
+    def report(self):
+        if self.skipped:
+            log.info(f"Skipped {self.skipped} file(s) finished by an earlier run.")
+        if self.unfinished and not self.readonly:
+            log.info(
+                f"{len(self.unfinished)} file(s) remain unfinished;"
+                " run the same command with --resume to pick up where this left off."
+            )
+            for file in sorted(self.unfinished):
+                log.debug(f"    {file}")
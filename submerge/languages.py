@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+"""
+Precomputed ISO 639 language index.
+
+The table in `languages.tsv` is generated from pycountry, so resolving a
+language never has to load and search pycountry's database. Regenerate it
+after upgrading pycountry with `python3 -m submerge.languages`.
+"""
+
+# Imports {{{
+# builtins
+from functools import lru_cache
+import pathlib
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# }}}
+
+
+TABLE = pathlib.Path(__file__).with_name("languages.tsv")
+FIELDS = [
+    "alpha_3",
+    "alpha_2",
+    "bibliographic",
+    "name",
+    "scope",
+    "type",
+    "common_name",
+    "inverted_name",
+]
+# the fields a language can be looked up by, in order of precedence
+CODES = ("alpha_2", "alpha_3", "bibliographic")
+NAMES = ("name", "common_name", "inverted_name")
+
+
+class Language(NamedTuple):
+    alpha_2: Optional[str]
+    alpha_3: str
+    name: str
+    scope: str
+    type: str
+    bibliographic: Optional[str] = None
+
+
+_table: Optional[List[List[str]]] = None
+_indexes: Dict[str, Dict[str, int]] = {}
+_lock = threading.Lock()
+
+
+def load() -> List[List[str]]:
+    """
+    Read the bundled table, once.
+    """
+    global _table
+    if _table is None:
+        with open(TABLE, encoding="utf-8") as table:
+            lines = table.read().splitlines()
+            _table = [line.split("\t") for line in lines if not line.startswith("#")]
+    return _table
+
+
+def get_index(keys: Tuple[str, ...]) -> Dict[str, int]:
+    """
+    Build (once) a case-insensitive index from the given fields to table rows.
+    Earlier fields take precedence over later ones.
+    """
+    with _lock:
+        if keys not in _indexes:
+            table = load()
+            index = {}
+            for key in keys:
+                column = FIELDS.index(key)
+                for row, values in enumerate(table):
+                    if values[column]:
+                        index.setdefault(values[column].lower(), row)
+            _indexes[keys] = index
+        return _indexes[keys]
+
+
+@lru_cache(maxsize=None)
+def lookup(string: str) -> Language:
+    """
+    Find a language by its ISO 639 code or English name, ignoring case.
+    """
+    key = string.strip().lower()
+    # codes are all most callers need, so names are only indexed on demand
+    for keys in (CODES, NAMES):
+        row = get_index(keys).get(key)
+        if row is not None:
+            values = dict(zip(FIELDS, load()[row]))
+            return Language(*(values[field] or None for field in Language._fields))
+
+    raise LookupError(string)
+
+
+def generate(path: pathlib.Path = TABLE):
+    """
+    Write the table from pycountry's ISO 639-3 database.
+    """
+    import pycountry
+
+    with open(path, "w", encoding="utf-8") as table:
+        table.write("# generated from pycountry's ISO 639-3 database\n")
+        table.write("# " + "\t".join(FIELDS) + "\n")
+        for lang in sorted(pycountry.languages, key=lambda lang: lang.alpha_3):
+            values = [getattr(lang, field, None) or "" for field in FIELDS]
+            table.write("\t".join(values) + "\n")
+
+
+if __name__ == "__main__":
+    generate()
@@ -2,10 +2,8 @@
 
 # Imports {{{
 # builtins
-import pathlib
 from importlib import import_module
-import inspect
-from typing import Mapping, Type
+from typing import Mapping, Optional
 
 # 3rd party
 import click
@@ -13,59 +11,61 @@ import click
 # }}}
 
 
-# get all the python modules in this directory
-directory = (
-    pathlib.Path(inspect.getframeinfo(inspect.currentframe()).filename).resolve().parent
-)
-files = directory.glob("**/*.py")
+# command name -> module defining it. Modules are only imported once their
+# command is actually needed, so add new modules here.
+registry = {
+    "apply": "apply",
+    "audit": "audit",
+    "automerge": "automerge",
+    "autotag": "autotag",
+    "enqueue": "enqueue",
+    "merge": "merge",
+    "serve": "serve",
+    "tag": "tag",
+    "tracks": "tracks",
+    "watch": "watch",
+    "worker": "worker",
+}
 
-blacklist = ["<stdin>", "base.py", "__init__.py", "__main__.py", "_template.py"]
 
-modules = [
-    module for module in files if module.is_file() and module.name not in blacklist
-]
+def get_command(name: str) -> Optional[click.Command]:
+    """
+    Import the module registered for a command, and return its click command.
+    """
+    try:
+        module = import_module(".".join([__package__, registry[name]]))
+    except KeyError:
+        return None
+
+    command = getattr(module, name, None)
+    if isinstance(command, click.Command):
+        return command
+
+    # fall back to the first command found in the module
+    return next(
+        (obj for obj in module.__dict__.values() if isinstance(obj, click.Command)),
+        None,
+    )
 
 
 def get_handlers() -> Mapping[str, click.Command]:
-    def relative_to_path(module: pathlib.Path, path: pathlib.Path):
-        relative = module.relative_to(path).with_suffix("")
-        as_import = str(relative).replace("/", ".")
-        return as_import
-
-    # dictionary version of __all__
-    all = {
-        module.stem: import_module(
-            ".".join([__package__, relative_to_path(module, directory)])
-        )
-        for module in modules
-    }
-
-    def get_command_from_module(module):
-        """
-        Get an Handler subclass instance from a module.
-        Get all objects from a module, and filter out all but the first Handler
-        subclass found. Then return an instance of that class, or none if no
-        subclass was found.
-        """
-        objects = module.__dict__.values()
-        try:
-            handler_cls = next(
-                (obj for obj in objects if isinstance(obj, click.Command))
-            )
-            return handler_cls
-        except StopIteration:  # no subclass found
-            # print(f'No handler found in "{module.__name__}".')
-            return None
-
-    # a dict of Handler subclasses, indexed by the module they're from
-    enabled = {
-        name: get_command_from_module(module) for name, module in all.items()
-    }
-    # strip out modules that didn't have a handler
-    handlers = {name: handler for name, handler in enabled.items() if handler}
-
-    return handlers
-
-
-handlers = get_handlers()
-__all__ = ["handlers"]
+    """
+    Import every registered module, returning all of their commands.
+    """
+    handlers = {name: get_command(name) for name in registry}
+    return {name: handler for name, handler in handlers.items() if handler}
+
+
+class LazyGroup(click.Group):
+    """
+    A click group that imports a module only when its command is used.
+    """
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(registry))
+
+    def get_command(self, ctx, cmd_name):
+        return super().get_command(ctx, cmd_name) or get_command(cmd_name)
+
+
+__all__ = ["registry", "get_command", "get_handlers", "LazyGroup"]
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+# Imports {{{
+# builtins
+import logging
+
+# 3rd party
+import click
+
+# local modules
+from submerge.modules.base import report_edits
+from submerge.plan import Plan, execute
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.argument("plans", type=click.File("r"), nargs=-1, required=True)
+@click.option(
+    "-s",
+    "--simulate",
+    help="Print out the command to be executed instead of actually executing it",
+    is_flag=True,
+)
+def apply(plans, simulate):
+    """
+    Apply edits saved with --save-plan.
+
+    When several plans are given, they are combined, so all of the edits to
+    a file are made by a single mkvpropedit call.
+    """
+    plan = Plan()
+    for fp in plans:
+        try:
+            plan.update(Plan.load(fp))
+        except ValueError as e:
+            raise click.BadParameter(f"{fp.name} is not a valid plan ({e})")
+
+    if not plan:
+        log.info("Nothing to do.")
+        return
+
+    executed = execute(plan, simulate=simulate)
+    if not simulate:
+        report_edits(executed, len(plan))
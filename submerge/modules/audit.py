@@ -3,23 +3,34 @@
 # Imports {{{
 # builtins
 import collections
-import concurrent.futures
-from concurrent.futures import ThreadPoolExecutor
-from functools import partial
+import contextlib
+import csv
+import json
 import logging
 import pathlib
 import time
-from typing import Iterable, NamedTuple, Any, Optional
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
 # 3rd party
 import click
 
 # local modules
+from submerge import api, trace
 from submerge.modules.base import path_args
+from submerge.records import FileInfo, Unreadable
 from submerge.utils import (
     pretty_time_delta,
     get_metadata,
-    get_files,
     get_track_pattern,
     get_docstring,
 )
@@ -43,6 +54,74 @@ class FileResult(NamedTuple):
     tests: Optional[dict]
 
 
+class TrackPattern(list):
+    """
+    (track number, track type) pairs, shown in the 'tracks' pattern syntax.
+    """
+
+    def __str__(self):
+        return ":".join(f"{track}{type}" for track, type in self)
+
+
+class NdjsonWriter:
+    """
+    Write one JSON object per file.
+    """
+
+    def __init__(self, output: IO[str], tests: List[str]):
+        self.output = output
+        self.tests = tests
+
+    def write(self, result: FileResult):
+        record = {"file": str(result.file), "error": None, "tests": None}
+        if result.tests is None:
+            record["error"] = "could not be read"
+        else:
+            # in the same order as the plan, like the csv columns
+            record["tests"] = {}
+            for name in self.tests:
+                test = result.tests.get(name)
+                if test is not None:
+                    record["tests"][name] = {"passed": test.passed, "info": test.info}
+        self.output.write(json.dumps(record) + "\n")
+        self.output.flush()
+
+
+class CsvWriter:
+    """
+    Write one row per file, with a result and info column for each test.
+    """
+
+    def __init__(self, output: IO[str], tests: List[str]):
+        self.output = output
+        self.tests = tests
+        self.writer = csv.writer(output)
+        header = ["file", "error"]
+        for name in tests:
+            header.extend([name, f"{name} info"])
+        self.writer.writerow(header)
+
+    def write(self, result: FileResult):
+        row = [str(result.file)]
+        if result.tests is None:
+            row.append("could not be read")
+        else:
+            row.append("")
+            for name in self.tests:
+                test = result.tests.get(name)
+                if test is None:
+                    row.extend(["", ""])
+                else:
+                    info = "" if test.info is None else str(test.info)
+                    row.extend(["pass" if test.passed else "fail", info])
+        self.writer.writerow(row)
+        self.output.flush()
+
+
+# formats that write each file's results as soon as it has been checked
+STREAMING_FORMATS = {"ndjson": NdjsonWriter, "csv": CsvWriter}
+
+
 @click.command()
 @path_args
 @click.option(
@@ -57,42 +136,93 @@ class FileResult(NamedTuple):
     help="Produce a pattern that can be used with the 'tracks' module",
     is_flag=True,
 )
+@click.option(
+    "--only",
+    help="Only run this test (may be repeated)",
+    metavar="TEST",
+    multiple=True,
+)
+@click.option(
+    "--skip",
+    help="Don't run this test (may be repeated)",
+    metavar="TEST",
+    multiple=True,
+)
 @click.option(
     "-f",
     "--format",
     help="Method that should be used to organize results",
-    type=click.Choice(["category", "individual"]),
+    type=click.Choice(["category", "individual", *STREAMING_FORMATS]),
     default="category",
     show_default=True,
 )
-def audit(paths, recursive, timed, pattern, format):
+@click.option(
+    "-o",
+    "--output",
+    help="Where to write ndjson or csv results",
+    type=click.File("w"),
+    default="-",
+    show_default=True,
+)
+def audit(paths, recursive, timed, pattern, only, skip, format, output):
     """
     Find issues in the given files and report them.
+
+    The ndjson and csv formats write a record for every file as soon as it has
+    been checked, instead of a summary at the end.
+
+    Tests can be chosen with --only and --skip, by name (like "undefined-tracks").
     """
 
     # parse args
     if timed:
         start_time = time.perf_counter()
 
-    files = get_files(paths, recursive)
+    try:
+        plan = compile_tests(only, skip, pattern=pattern)
+    except LookupError as e:
+        raise click.BadParameter(str(e), param_hint="'--only' / '--skip'")
 
     # process files
-    results = []
-    with ThreadPoolExecutor() as executor:
-        futures = [executor.submit(partial(check_file, pattern=pattern), file) for file in files]
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                results.append(future.result())
-            except TypeError as e:
-                log.error(e)
+    checked_files = api.audit(paths, recursive, tests=plan)
+
+    if format in STREAMING_FORMATS:
+        if output.name == "<stdout>":
+            from submerge import cli
+
+            # keep errors and the summary out of the records
+            quiet = cli.log_to_stderr()
+        else:
+            quiet = contextlib.nullcontext()
+
+        with quiet:
+            writer = STREAMING_FORMATS[format](output, plan.names)
+            checked = 0
+            for result in checked_files:
+                writer.write(result)
+                checked += 1
+
+            if not checked:
+                log.info("No files found.")
+            if timed:
+                time_elapsed = pretty_time_delta(time.perf_counter() - start_time)
+                log.info(f"Time elapsed: {time_elapsed}")
+        return
+
+    results = list(checked_files)
 
     def report(results: Iterable[FileResult], pattern, format="category"):
         if not results:
             log.info("No files found.")
             return
 
-        # filter out any files where there aren't any positive tests
-        results = [result for result in results if not all(result.tests.values())]
+        # filter out any files where there aren't any positive tests, and
+        # unreadable ones, which have already been reported
+        results = [
+            result
+            for result in results
+            if result.tests is not None and not all(result.tests.values())
+        ]
         if pattern:
             results = [
                 FileResult(file, {"Pattern": tests.get("Pattern")})
@@ -133,77 +263,215 @@ def audit(paths, recursive, timed, pattern, format):
     report(results, pattern, format=format)
 
 
-def tests():
-    def get_test_func_name(func):
+# Test registry {{{
+class Fact(NamedTuple):
+    func: Callable[[dict], Any]
+    needs: Tuple[str, ...]
+
+
+class Test(NamedTuple):
+    key: str
+    name: str
+    func: Callable[[dict], TestResult]
+    needs: Tuple[str, ...]
+    default: bool
+
+
+# derived data about a file, computed at most once per file, and only when a
+# selected test needs it. Every fact can use "file" and "metadata" (a FileInfo).
+FACTS: Dict[str, Fact] = {}
+TESTS: Dict[str, Test] = {}
+
+PLUGIN_GROUP = "submerge.audit"
+_plugins_loaded = False
+
+
+def fact(name: str, needs: Iterable[str] = ()):
+    """
+    Register a function computing a fact from the facts it needs.
+    """
+
+    def decorator(func):
+        FACTS[name] = Fact(func, tuple(needs))
+        return func
+
+    return decorator
+
+
+def audit_test(needs: Iterable[str] = (), name: str = None, default: bool = True):
+    """
+    Register an audit test. It is passed a dict holding the facts it needs,
+    and returns a TestResult.
+
+    Tests are named after their docstring or function name, and only run by
+    default if `default` is set. Third-party packages can add tests by
+    registering a module using this decorator under the "submerge.audit"
+    entry point group.
+    """
+
+    def decorator(func):
         func_name = func.__name__.replace("_test_", "")
         words = [word.strip().lower() for word in func_name.split("_") if word.strip()]
-        name = [word[0].upper() + word[1:] for word in words]
-        return " ".join(name)
+        label = name or get_docstring(func) or " ".join(
+            word[0].upper() + word[1:] for word in words
+        )
+        key = "-".join(label.lower().split())
+        TESTS[key] = Test(key, label, func, tuple(needs), default)
+        return func
 
-    return {
-        get_docstring(func) or get_test_func_name(func): func
-        for name, func in globals().items()
-        if name.startswith("_test_")
-    }
+    return decorator
+
+
+def load_plugins():
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+
+    from importlib.metadata import entry_points
+
+    found = entry_points()
+    if hasattr(found, "select"):
+        found = found.select(group=PLUGIN_GROUP)
+    else:
+        found = found.get(PLUGIN_GROUP, [])
+
+    for entry_point in found:
+        try:
+            entry_point.load()
+        except Exception as e:
+            log.warning(f"Could not load audit plugin {entry_point.name}: {e}")
+
+
+def find_test(name: str) -> Test:
+    key = "-".join(name.lower().split())
+    if key not in TESTS:
+        raise LookupError(f"No test named {name!r} (available: {', '.join(TESTS)})")
+    return TESTS[key]
+
+
+class TestPlan:
+    """
+    The selected tests, and the facts to derive from each file for them in
+    the order they depend on each other.
+    """
 
+    def __init__(self, tests: Iterable[Test]):
+        self.tests = list(tests)
+        self.facts: List[Tuple[str, Fact]] = []
 
-def check_file(file, pattern):
+        def add(name):
+            if name in ("file", "metadata") or any(name == added for added, _ in self.facts):
+                return
+            if name not in FACTS:
+                raise LookupError(f"Unknown fact {name!r}")
+            for need in FACTS[name].needs:
+                add(need)
+            self.facts.append((name, FACTS[name]))
+
+        for test in self.tests:
+            for need in test.needs:
+                add(need)
+
+    @property
+    def names(self) -> List[str]:
+        return [test.name for test in self.tests]
+
+    def run(self, file: pathlib.Path, metadata: FileInfo) -> Dict[str, TestResult]:
+        facts = {"file": file, "metadata": metadata}
+        for name, derive in self.facts:
+            facts[name] = derive.func(facts)
+
+        results = {}
+        for test in self.tests:
+            with trace.span(f"test: {test.name}", "test"):
+                results[test.name] = test.func(facts)
+        return results
+
+
+def compile_tests(only: Iterable[str] = (), skip: Iterable[str] = (), pattern=False) -> TestPlan:
+    """
+    Select the tests to run, raising LookupError for unknown test names.
+    """
+    load_plugins()
+    if pattern:
+        selected = [TESTS["pattern"]]
+    elif only:
+        selected = [find_test(name) for name in only]
+    else:
+        selected = [test for test in TESTS.values() if test.default]
+
+    skipped = {find_test(name).key for name in skip}
+    return TestPlan(test for test in selected if test.key not in skipped)
+
+
+# }}}
+
+
+@trace.traced("check file")
+def check_file(file, plan: TestPlan):
     log.debug(f"Checking {file.name}....")
     try:
         metadata = get_metadata(file)
-    except KeyError:
+        return FileResult(file, plan.run(file, metadata))
+    except Unreadable:
         log.error(f"ERROR: {file} could not be read.")
         return FileResult(file, None)
 
-    # perform tests
-    results = {name: test(file, metadata, pattern) for name, test in tests().items()}
 
-    return FileResult(file, results)
+# Facts {{{
+TRACK_ORDERING = {"v": 1, "a": 2, "s": 3}
 
 
-def _test_pattern(file, metadata, pattern):
-    if not pattern:
-        return TestResult(True, None)
+@fact("track_pattern")
+def _track_pattern(facts):
+    return TrackPattern(get_track_pattern(facts["metadata"]))
 
-    track_pattern = get_track_pattern(metadata)
 
-    # sort by track number, then by track type
-    track_pattern.sort(key=lambda entry: entry[0])
-    track_ordering = {"v": 1, "a": 2, "s": 3}
-    track_pattern.sort(key=lambda entry: track_ordering[entry[1]])
+@fact("ordered_pattern", needs=["track_pattern"])
+def _ordered_pattern(facts):
+    # sort by track type, then by track number
+    return TrackPattern(
+        sorted(
+            facts["track_pattern"],
+            key=lambda entry: (TRACK_ORDERING.get(entry[1], len(TRACK_ORDERING) + 1), entry[0]),
+        )
+    )
 
-    return TestResult(False, ":".join([f"{track}{type}" for (track, type) in track_pattern]))
 
+@fact("tracks_by_type")
+def _tracks_by_type(facts):
+    tracks = collections.defaultdict(list)
+    for track in facts["metadata"].tracks:
+        tracks[track.type].append(track)
+    return tracks
 
-def _test_improperly_ordered_tracks(file, metadata, pattern):
-    track_pattern = get_track_pattern(metadata)
 
-    # sort by track number, then by track type
-    track_pattern.sort(key=lambda entry: entry[0])
-    track_ordering = {"v": 1, "a": 2, "s": 3}
-    track_pattern.sort(key=lambda entry: track_ordering[entry[1]])
+# }}}
 
-    properly_ordered = [int(track) for track, _ in track_pattern] == sorted(
-        [int(track) for track, _ in track_pattern]
-    )
 
-    # convert pattern to pretty string
-    tracks = [f"{track}{type}" for track, type in track_pattern]
-    pattern_string = ":".join(tracks)
+# Tests {{{
+@audit_test(needs=["ordered_pattern"], default=False)
+def _test_pattern(facts):
+    return TestResult(False, facts["ordered_pattern"])
 
-    return TestResult(properly_ordered, pattern_string)
 
+@audit_test(needs=["ordered_pattern"])
+def _test_improperly_ordered_tracks(facts):
+    numbers = [int(track) for track, _ in facts["ordered_pattern"]]
+    return TestResult(numbers == sorted(numbers), facts["ordered_pattern"])
 
-def _test_undefined_tracks(file, metadata, pattern):
-    undefined_tracks = []
-    try:
-        for track in metadata["tracks"]:
-            if (
-                track["type"] in ["subtitles", "audio"]
-                and track["properties"]["language"] == "und"
-            ):
-                undefined_tracks.append(track["properties"]["number"])
-    except KeyError:
-        log.info(f"ERROR: {file} could not be read, data may be incorrect")
 
+@audit_test(needs=["tracks_by_type"])
+def _test_undefined_tracks(facts):
+    undefined_tracks = [
+        track.number
+        for type in ["subtitles", "audio"]
+        for track in facts["tracks_by_type"].get(type, [])
+        if track.language == "und"
+    ]
+    undefined_tracks.sort()
     return TestResult(not bool(undefined_tracks), undefined_tracks)
+
+
+# }}}
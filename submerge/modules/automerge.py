@@ -2,25 +2,204 @@
 
 # Imports {{{
 # builtins
+import collections
+import difflib
 import logging
 import pathlib
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 # 3rd party
 import click
 
 # local modules
+from submerge import api, trace, utils
+from submerge.languages import Language
 from submerge.modules.base import path_args
+from submerge.modules.merge import FILETYPES, merge_command, report_merges
+from submerge.utils import get_files, language, quote_cmd
 
 # }}}
 
 
 log = logging.getLogger(__name__)
 
+EPISODE = re.compile(
+    r"s(\d{1,2})[ ._-]?e(\d{1,3})|(?<![0-9a-z])(\d{1,2})x(\d{2,3})(?![0-9])", re.I
+)
+NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+# tags commonly found between the stem and extension of a subtitle file
+SUBTITLE_TAGS = {"forced", "sdh", "cc", "hi", "default"}
+SIMILARITY = 0.75
+# how many candidates get an exact similarity score
+SHORTLIST = 10
+NGRAM = 3
 
-@click.command(hidden=True)
+
+def normalize(stem: str) -> str:
+    return NON_ALPHANUMERIC.sub(" ", stem.lower()).strip()
+
+
+def episode(stem: str) -> Optional[Tuple[int, int]]:
+    match = EPISODE.search(stem)
+    if not match:
+        return None
+    season, number = (match[1], match[2]) if match[1] else (match[3], match[4])
+    return int(season), int(number)
+
+
+def is_language(tag: str) -> bool:
+    """
+    Whether a tag in a filename is a language code. Only the languages with an
+    ISO 639-1 code count (by any of their codes), since ISO 639-3 has a code
+    for most three-letter words, like "aac", "dts" or "the".
+    """
+    try:
+        return language(tag).alpha_2 is not None
+    except ValueError:
+        return False
+
+
+def ngrams(text: str) -> Set[str]:
+    padded = f" {text} "
+    return {padded[i : i + NGRAM] for i in range(len(padded) - NGRAM + 1)}
+
+
+class Subtitle:
+    __slots__ = ("path", "stem", "language", "key")
+
+    def __init__(self, path: pathlib.Path, default: Language):
+        self.path = path
+        self.language = default
+
+        # peel a language and any other tags off the end, like "name.en.forced"
+        parts = path.stem.split(".")
+        while len(parts) > 1:
+            tag = parts[-1].lower()
+            if tag in SUBTITLE_TAGS:
+                parts.pop()
+            elif self.language is default and len(tag) in (2, 3) and is_language(tag):
+                self.language = language(tag)
+                parts.pop()
+            else:
+                break
+        self.stem = ".".join(parts)
+        self.key = normalize(self.stem)
+
+
+class SubtitleIndex:
+    """
+    One-pass index of subtitle files for matching them to video files.
+
+    Subtitles are indexed by normalized stem, by season/episode, and by
+    character n-grams, so each lookup only scores a short list of candidates
+    instead of comparing against every subtitle file.
+    """
+
+    def __init__(self, subtitles: Iterable[Subtitle]):
+        self.subtitles: List[Subtitle] = []
+        self.by_stem: Dict[str, List[int]] = collections.defaultdict(list)
+        self.by_episode: Dict[Tuple[int, int], List[int]] = collections.defaultdict(list)
+        self.by_ngram: Dict[str, List[int]] = collections.defaultdict(list)
+
+        for subtitle in subtitles:
+            index = len(self.subtitles)
+            self.subtitles.append(subtitle)
+            self.by_stem[subtitle.key].append(index)
+            key = episode(subtitle.stem)
+            if key is not None:
+                self.by_episode[key].append(index)
+            for gram in ngrams(subtitle.key):
+                self.by_ngram[gram].append(index)
+
+    def __len__(self):
+        return len(self.subtitles)
+
+    def scored(self, key: str, candidates: Iterable[int]) -> List[Tuple[float, int]]:
+        """
+        Score the similarity of each candidate to a stem, best first.
+        """
+        return sorted(
+            (
+                (difflib.SequenceMatcher(None, key, self.subtitles[index].key).ratio(), index)
+                for index in candidates
+            ),
+            reverse=True,
+        )
+
+    def shortlist(self, key: str) -> List[int]:
+        """
+        Find the subtitles sharing the most n-grams with a stem.
+        """
+        counts = collections.Counter()
+        for gram in ngrams(key):
+            counts.update(self.by_ngram.get(gram, ()))
+        return [index for index, _ in counts.most_common(SHORTLIST)]
+
+    def match(self, video: pathlib.Path) -> List[Subtitle]:
+        """
+        Find the subtitles for a video: by exact stem, then by season and
+        episode, then by similarity.
+        """
+        key = normalize(video.stem)
+        if key in self.by_stem:
+            return self.get(key)
+
+        number = episode(video.stem)
+        if number in self.by_episode:
+            # several shows may share an episode number; take the closest that
+            # is either next to the video or named much like it
+            for ratio, index in self.scored(key, self.by_episode[number]):
+                subtitle = self.subtitles[index]
+                if ratio >= SIMILARITY or subtitle.path.parent == video.parent:
+                    return self.get(subtitle.key)
+
+        for ratio, index in self.scored(key, self.shortlist(key)):
+            if ratio < SIMILARITY:
+                break
+            # never pair up different episodes, however similar their names
+            if number is None or episode(self.subtitles[index].stem) in (None, number):
+                return self.get(self.subtitles[index].key)
+        return []
+
+    def get(self, key: str) -> List[Subtitle]:
+        """
+        Every subtitle with the given stem, such as one for each language.
+        """
+        return [self.subtitles[index] for index in self.by_stem[key]]
+
+
+@click.command()
 @path_args
-@click.option('-s', '--subtitles', help='A directory containing subtitles', metavar='DIR', type=pathlib.Path, default='.')
-def automerge(paths, recursive, subtitles):
+@click.option(
+    "-s",
+    "--subtitles",
+    help="A directory containing subtitles",
+    metavar="DIR",
+    type=click.Path(exists=True, file_okay=False, path_type=pathlib.Path),
+    multiple=True,
+)
+@click.option(
+    "-l",
+    "--language",
+    "default_language",
+    help="Language of subtitles whose filename doesn't say",
+    type=language,
+    default="eng",
+    show_default=True,
+)
+@click.option(
+    "--simulate",
+    help="Print out the commands to be executed instead of actually executing them",
+    is_flag=True,
+)
+@click.option(
+    "-f",
+    "--force",
+    help="Merge even when the output already has the subtitles",
+    is_flag=True,
+)
+def automerge(paths, recursive, subtitles, default_language, simulate, force):
     """
     Automerge subtitles into their matching video files.
 
@@ -32,11 +211,46 @@ def automerge(paths, recursive, subtitles):
     There are 3 methods used to locate a subtitle file, and a failure to
     locate a file results in deferment to the next viable method:
         1. Searching for an exact filename match (with subtitle extension)
-        2. Searching for a subtitle file with the same 'S__E__' qualifier
+        2. Searching for a subtitle file with the same 'S__E__' qualifier, in
+           the same directory or with a similar filename
         3. Searching for a filename match with at least 75% similarity
 
     If a match is found, a subprocess call to 'mkvmerge' is initiated, and the
     files are merged. If an error occurs or there is no match, the error is
     logged and the operation continues on the next file.
     """
-    log.info(subtitles)
+    videos = sorted(
+        file
+        for file in get_files(paths, recurse=recursive, shard=utils.shard)
+        if not file.stem.endswith("-merged")
+    )
+    if not videos:
+        log.info("No files found.")
+        return
+
+    # the videos' directories (and their children), plus any given directories
+    roots = {video.parent for video in videos} | set(subtitles)
+    with trace.span("index subtitles"):
+        index = SubtitleIndex(
+            Subtitle(file, default_language)
+            for file in get_files(list(roots), recurse=True, glob="*")
+            if file.suffix.lower() in FILETYPES and file.suffix.lower() != ".sub"
+        )
+    log.debug(f"Indexed {len(index)} subtitle files.")
+
+    jobs = []
+    for video in videos:
+        with trace.span("match subtitles", file=video):
+            found = index.match(video)
+        if not found:
+            log.info(f"No subtitles found for {video.name}.")
+            continue
+        log.debug(f"{video.name}: {', '.join(sub.path.name for sub in found)}")
+        jobs.append((video, [(sub.path, sub.language) for sub in found]))
+
+    if simulate:
+        for video, subs in jobs:
+            log.info(quote_cmd(merge_command(video, *subs)))
+        return
+
+    report_merges(api.merge_each(jobs, force=force))
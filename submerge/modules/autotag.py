@@ -2,90 +2,187 @@
 
 # Imports {{{
 # builtins
-import json
+from concurrent.futures import Future
+from functools import partial
 import logging
+import os
 import pathlib
-import subprocess
-from tempfile import NamedTemporaryFile
-from typing import Iterable
+from typing import Dict, Iterable, List, Tuple
 
 # 3rd party
-from langdetect import detect
 import click
 
 # local modules
-from submerge.modules.base import path_args
-from submerge.utils import get_files, language
+from submerge import api, cache, engine, trace
+from submerge.detection import detect_language, detector_version, get_pool, release_pool
+from submerge.languages import Language
+from submerge.modules.base import path_args, plan_args, report_edits
+from submerge.plan import execute
+from submerge.records import Unreadable
+from submerge.subtitles import TEXT_CODECS, extract_text
+from submerge.utils import get_metadata, language
 
 # }}}
 
 
 log = logging.getLogger(__name__)
 
+DEFAULT_SAMPLE_SIZE = 20000
+
 
 @click.command()
 @path_args
 @click.option(
     "-c", "--confirm", help="Ask for confirmation before processing", is_flag=True
 )
-def autotag(paths: Iterable[pathlib.Path], recursive: bool, confirm: bool):
+@click.option(
+    "-n",
+    "--sample-size",
+    help="Characters of dialogue to collect from each track before detecting",
+    type=click.IntRange(min=1),
+    default=DEFAULT_SAMPLE_SIZE,
+    show_default=True,
+)
+@click.option(
+    "-J",
+    "--detect-jobs",
+    help="Worker processes used for language detection (1 detects serially)",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default="CPU count",
+)
+@plan_args
+def autotag(
+    paths: Iterable[pathlib.Path],
+    recursive: bool,
+    confirm: bool,
+    sample_size: int,
+    detect_jobs: int,
+    simulate: bool,
+    save_plan,
+):
     """
     Auto guess-and-tag the language of undefined subtitle tracks.
     """
 
-    files = get_files(paths, recurse=recursive)
-
-    jobs = []
-    for file in files:
-        proc = subprocess.run(["mkvmerge", "-J", file], stdout=subprocess.PIPE)
-        metadata = json.loads(proc.stdout)
-
-        undefined = (
-            track["id"]
-            for track in metadata["tracks"]
-            if track["type"] == "subtitles" and track["properties"]["language"] == "und"
-        )
-        modifications = []
-        for track in undefined:
-            track_data = NamedTemporaryFile()
-            subprocess.run(
-                [
-                    "mkvextract",
-                    file,
-                    "tracks",
-                    f"track:{track}",
-                    "{track}:{track_data.name}",
-                ]
+    autotagging = api.plan_autotag(paths, recursive, sample_size, detect_jobs)
+    for file, track in autotagging.undetected:
+        log.warning(f"Could not detect the language of track {track} in {file.name}")
+
+    plan = autotagging.plan
+    if confirm and plan and not (simulate or save_plan):
+        log.info("The following changes will be made:")
+        for file, detected in autotagging.detected.items():
+            log.info(f"{file}:")
+            for track, lang in detected.items():
+                log.info(f'    Track {track}: "und" --> "{lang.alpha_3}"')
+        click.confirm("Would you like to make these changes?", abort=True)
+
+    executed = execute(plan, simulate=simulate, save=save_plan)
+    if plan and not (simulate or save_plan):
+        report_edits(executed, len(plan))
+
+
+def detect_languages(
+    files: Iterable[pathlib.Path], sample_size: int, detect_jobs: int
+) -> Tuple[Dict[pathlib.Path, Dict[int, Language]], List[Tuple[pathlib.Path, int]]]:
+    """
+    Detect the language of the undefined text subtitle tracks of each file.
+    Returns the languages detected for each file (in order), by track number,
+    and the (file, track number) of tracks that couldn't be detected.
+    """
+    # extraction (threads, I/O-bound) feeds detection (processes, CPU-bound)
+    pool = get_pool(detect_jobs)
+    futures = []
+
+    detection_cache = cache.get_detection_cache()
+    version = detector_version()
+
+    def remember(digest, done):
+        if not done.cancelled() and done.exception() is None:
+            detection_cache.put(digest, done.result())
+
+    def detect(text):
+        """
+        Look up a sample's language in the cache, or queue it for detection.
+        """
+        digest = cache.DetectionCache.key(text, version)
+        if detection_cache and not cache.refresh:
+            code = detection_cache.get(digest)
+            if code is not None:
+                future = Future()
+                future.set_result(code or None)
+                return future
+
+        future = pool.submit(detect_language, text)
+        futures.append(future)
+        if trace.enabled:
+            # detection happens in another process, so time it from here
+            submitted = trace.now()
+            future.add_done_callback(
+                lambda done: trace.record_async("detect", "detect", submitted, trace.now())
             )
-            lang = language(detect(track_data.read()))
-            modifications.append((track, lang))
-        jobs.append((file, modifications))
-
-        confirmed = False
-        if confirm:
-            log.info("The following changes will be made:")
-            for file, modifications in jobs:
-                log.info(f"{file}:")
-                for track, lang in modifications:
-                    log.info(f'    Track {track}: "und" --> "{lang.alpha3}"')
-            confirmed = input("Would you like to make these changes? [y/n] ")
-
-        if (not confirm) or confirmed:
-            # actually tag the files
-            for file, modifications in jobs:
-                for track, lang in modifications:
-                    set_track_lang(file, track, lang)
-
-
-def set_track_lang(file, track, lang):
-    proc = subprocess.run(
-        [
-            "mkvpropedit",
-            file,
-            "--edit",
-            f"track:{track}",
-            "--set",
-            f"language={lang.alpha3}",
-        ]
+        if detection_cache:
+            future.add_done_callback(partial(remember, digest))
+        return future
+
+    detected = {}
+    undetected = []
+    try:
+        pending = []
+        extract = partial(sample_readable, sample_size=sample_size)
+        for future in engine.submit_all(extract, files):
+            file, samples = future.result()
+            if samples is None:
+                continue
+            detections = {number: detect(text) for number, text in samples.items()}
+            pending.append((file, detections))
+
+        for file, detections in sorted(pending, key=lambda job: job[0]):
+            for number, detection in detections.items():
+                try:
+                    detected.setdefault(file, {})[number] = language(detection.result() or "")
+                except ValueError:
+                    undetected.append((file, number))
+    finally:
+        release_pool(pool, detect_jobs, futures)
+
+    return detected, undetected
+
+
+def sample_readable(file, sample_size=DEFAULT_SAMPLE_SIZE):
+    """
+    Like sample_tracks, but log files that can't be read and return no
+    samples for them, instead of failing the whole run.
+    """
+    try:
+        return sample_tracks(file, sample_size)
+    except (Unreadable, OSError) as e:
+        log.error(f"ERROR: {file} could not be read: {e}")
+        return file, None
+
+
+@trace.traced("sample tracks")
+def sample_tracks(file, sample_size=DEFAULT_SAMPLE_SIZE):
+    """
+    Extract a sample of text from each undefined text subtitle track.
+    """
+    # only text subtitles can be read; image-based ones are left alone
+    undefined = {
+        track.id: track
+        for track in get_metadata(file).of_type("subtitles")
+        if track.language == "und" and track.codec_id in TEXT_CODECS
+    }
+    if not undefined:
+        return file, {}
+
+    samples = extract_text(
+        file,
+        {id: track.codec_id for id, track in undefined.items()},
+        limit=sample_size,
     )
-    return not proc.returncode  # True if returned 0, otherwise False
+    return file, {undefined[id].number: text for id, text in samples.items()}
+
+
+def set_track_lang(plan, file, track, lang):
+    plan.add(file, f"track:@{track}", "language", lang.alpha_3)
@@ -2,7 +2,10 @@
 
 # Imports {{{
 # builtins
+import logging
 import pathlib
+import shlex
+from typing import Dict, List, Optional
 
 # 3rd party
 import click
@@ -10,6 +13,9 @@ import click
 # }}}
 
 
+log = logging.getLogger(__name__)
+
+
 # https://stackoverflow.com/a/44349292
 
 
@@ -56,3 +62,111 @@ path_args = DecoratorList(
         ),
     ]
 )
+
+plan_args = DecoratorList(
+    [
+        click.option(
+            "-s",
+            "--simulate",
+            help="Print out the command to be executed instead of actually executing it",
+            is_flag=True,
+        ),
+        click.option(
+            "--save-plan",
+            help="Save the edits to FILE as JSON, to be run with 'submerge apply'",
+            metavar="FILE",
+            type=click.File("w"),
+        ),
+    ]
+)
+
+
+journal_args = DecoratorList(
+    [
+        click.option(
+            "--resume",
+            help="Skip the files an interrupted run of the same command already finished",
+            is_flag=True,
+        ),
+        click.option(
+            "--journal",
+            "journal_path",
+            help="Record finished files in FILE (default: one per command, in the cache directory)",
+            metavar="FILE",
+            type=click.Path(dir_okay=False, path_type=pathlib.Path),
+        ),
+    ]
+)
+
+class FilesFailed(click.ClickException):
+    """
+    Raised once a module is done, when some of the files it was given failed.
+    """
+
+    def __init__(self, failed: Dict[pathlib.Path, str], total: int):
+        super().__init__(f"{len(failed)} of {total} file(s) failed.")
+        self.failed = failed
+
+
+def report_edits(executed, total: int):
+    """
+    Log how many of the files of an executed plan were modified, and fail the
+    command if any of them couldn't be.
+    """
+    log.info(f"{len(executed.edited)} of {total} file(s) modified.")
+    if executed.failed:
+        raise FilesFailed(executed.failed, total)
+
+
+# options that don't change which files a run does or what it does to them
+UNKEYED = ["resume", "journal_path", "simulate", "save_plan"]
+
+
+def open_journal(resume: bool, path: Optional[pathlib.Path], readonly: bool = False):
+    """
+    Open the journal of the running command, which is told apart from other
+    runs by its name and options.
+    """
+    from submerge.journal import Journal, default_path, job_key
+
+    ctx = click.get_current_context()
+    params = {key: value for key, value in ctx.params.items() if key not in UNKEYED}
+    job = job_key(ctx.command.name, params)
+    try:
+        return Journal(path or default_path(job), job, resume=resume, readonly=readonly)
+    except (OSError, ValueError) as e:
+        raise click.BadParameter(str(e), param_hint="'--journal'")
+
+
+# modules that can run unattended on a batch of files, without confirmation
+UNATTENDED = ["audit", "autotag", "tag"]
+
+
+def module_spec(string):
+    """
+    Parse a module and its options, like "tag -l 2 eng".
+    """
+    args = shlex.split(string)
+    if not args or args[0] not in UNATTENDED:
+        raise ValueError
+    return args
+
+
+def run_module(spec: List[str], files: List[pathlib.Path]) -> Dict[pathlib.Path, str]:
+    """
+    Run a module on some files, returning why each of the files that failed
+    did. If the module fails as a whole, all of them did.
+    """
+    from submerge.modules import get_command
+
+    command = get_command(spec[0])
+    args = spec[1:] + [str(file) for file in files]
+    try:
+        command.main(args, prog_name=f"submerge {spec[0]}", standalone_mode=False)
+    except FilesFailed as e:
+        return e.failed
+    except click.ClickException as e:
+        return dict.fromkeys(files, e.format_message())
+    except Exception as e:
+        return dict.fromkeys(files, str(e) or type(e).__name__)
+    return {}
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Imports {{{
+# builtins
+import logging
+import pathlib
+
+# 3rd party
+import click
+
+# local modules
+from submerge import utils
+from submerge.modules.base import UNATTENDED, module_spec, path_args
+from submerge.utils import get_files
+from submerge.workqueue import WorkQueue
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.argument("queue_file", type=click.Path(dir_okay=False, path_type=pathlib.Path))
+@path_args
+@click.option(
+    "-m",
+    "--run",
+    "spec",
+    help=f"The module (and its options) to run on the files: {', '.join(UNATTENDED)}",
+    metavar='"MODULE [OPTIONS]"',
+    type=module_spec,
+    required=True,
+)
+def enqueue(queue_file, paths, recursive, spec):
+    """
+    Queue files to be processed by 'submerge worker'.
+
+    The queue is an SQLite file, created if needed. Put it on storage shared
+    by every machine that should help, and start workers on each of them.
+    Files are stored by absolute path, so the library must be mounted at the
+    same path everywhere.
+    """
+    queue = WorkQueue(queue_file)
+    try:
+        added = queue.add(spec, get_files(paths, recurse=recursive, shard=utils.shard))
+        pending = queue.counts()["pending"]
+    finally:
+        queue.close()
+    log.info(f"Queued {added} file(s), {pending} now pending in {queue_file}.")
@@ -2,22 +2,35 @@
 
 # Imports {{{
 # builtins
+import collections
 import logging
 import pathlib
-from typing import NamedTuple, Tuple
+import re
+from typing import Iterable, Iterator, Optional, Tuple
 
 # 3rd party
 import click
 
 # local modules
-from submerge.modules.base import path_args
-from submerge.utils import get_files, language, quote_cmd
+from submerge import api, engine, trace, utils
+from submerge.languages import Language
+from submerge.modules.base import FilesFailed, journal_args, open_journal, path_args
+from submerge.utils import get_files, get_metadata, language, quote_cmd
 
 # }}}
 
 
 log = logging.getLogger(__name__)
 
+FILETYPES = [".srt", ".ass", ".ssa", ".usf", ".pgs", ".idx", ".sub"]
+PROGRESS = re.compile(r"^#GUI#progress (\d+)%")
+# how often (in percent) progress is reported for each file
+PROGRESS_STEP = 10
+
+
+class MergeError(Exception):
+    pass
+
 
 @click.command()
 @path_args
@@ -31,27 +44,124 @@ log = logging.getLogger(__name__)
     nargs=2,
     multiple=True,
 )
-def merge(paths, recursive, subtitles):
+@click.option(
+    "--simulate",
+    help="Print out the commands to be executed instead of actually executing them",
+    is_flag=True,
+)
+@click.option(
+    "-f",
+    "--force",
+    help="Merge even when the output already has the subtitles",
+    is_flag=True,
+)
+@journal_args
+def merge(paths, recursive, subtitles, simulate, force, resume, journal_path):
     """
     Merge subtitles into their matching video files.
     """
-    files = get_files(paths, recurse=recursive)
-
-    filetypes = [".srt", ".ass", ".ssa", ".usf", ".pgs", ".idx", ".sub"]
-    if not all(file.suffix in filetypes for file, _ in subtitles):
+    if not all(file.suffix in FILETYPES for file, _ in subtitles):
         raise ValueError("A passed subtitle file has an unsupported extension")
+    # .sub files only come along with their .idx, so they don't count
+    if not any(file.suffix != ".sub" for file, _ in subtitles):
+        raise click.UsageError("Missing option '-s' / '--subtitle'.")
+
+    with open_journal(resume, journal_path, readonly=simulate) as journal:
+        if simulate:
+            found = get_files(paths, recurse=recursive, shard=utils.shard)
+            for file in journal.pending(videos(found)):
+                log.info(quote_cmd(merge_command(file, *subtitles)))
+            return
+
+        report_merges(api.merge(paths, subtitles, recursive, force=force, journal=journal))
 
-    cmds = [merge_command(file, *subtitles) for file in files]
 
-    log.info('\n'.join(quote_cmd(cmd) for cmd in cmds))
+def videos(files: Iterable[pathlib.Path]) -> Iterator[pathlib.Path]:
+    # leave the output of previous merges alone
+    return (file for file in files if not file.stem.endswith("-merged"))
+
+
+def report_merges(results: Iterable["api.Merged"]):
+    """
+    Log how many merges were made, skipped and failed, and fail the command if
+    any of them did.
+    """
+    counts = collections.Counter()
+    failed = {}
+    for result in results:
+        counts[result.status] += 1
+        if result.error is not None:
+            failed[result.file] = result.error
+            log.error(f"Failed to merge {result.file.name}: {result.error}")
+
+    log.info(
+        f"{counts['merged']} merged, {counts['skipped']} already merged,"
+        f" {counts['failed']} failed."
+    )
+    if failed:
+        raise FilesFailed(failed, sum(counts.values()))
+
+
+@trace.traced("merge")
+def run_merge(file, subtitles, force=False) -> Optional[bool]:
+    """
+    Merge subtitles into a file, returning None if it had already been done.
+    Raises MergeError if mkvmerge fails.
+    """
+    cmd = merge_command(file, *subtitles)
+    output = output_path(file)
+    if not force and already_merged(output, subtitles):
+        log.debug(f"{output.name} already has the subtitles, skipping.")
+        return None
+
+    progress = {"reported": 0}
+
+    def report(line):
+        match = PROGRESS.match(line)
+        if match and int(match[1]) >= progress["reported"] + PROGRESS_STEP:
+            progress["reported"] = int(match[1]) // PROGRESS_STEP * PROGRESS_STEP
+            log.info(f"[{progress['reported']:3}%] {file.name}")
+
+    log.debug(quote_cmd(cmd))
+    try:
+        proc = engine.run(cmd[:1] + ["--gui-mode"] + cmd[1:], on_line=report)
+    except BaseException:
+        output.unlink(missing_ok=True)
+        raise
+
+    # mkvmerge exits with 1 for warnings and 2 for errors, and a negative code
+    # means it was killed (leaving a truncated output behind)
+    if proc.returncode < 0 or proc.returncode > 1:
+        errors = [line for line in proc.stdout.splitlines() if "error" in line.lower()]
+        output.unlink(missing_ok=True)
+        raise MergeError(" ".join(errors) or f"mkvmerge exited with {proc.returncode}")
+    return True
+
+
+def already_merged(output: pathlib.Path, subtitles) -> bool:
+    """
+    Check whether an existing output file has a subtitle track with the same
+    language and codec as each of the given subtitles.
+    """
+    if not output.is_file():
+        return False
+
+    try:
+        tracks = get_metadata(output).of_type("subtitles")
+        for file, lang in subtitles:
+            if file.suffix == ".sub":
+                continue
+            codec = get_metadata(file).tracks[0].codec
+            languages = {lang.alpha_3, lang.bibliographic}
+            if not any(track.codec == codec and track.language in languages for track in tracks):
+                return False
+    except (IndexError, ValueError, OSError):
+        return False
+    return True
 
 
-class Language(NamedTuple):
-    alpha_2: str
-    alpha_3: str
-    name: str
-    scope: str
-    type: str
+def output_path(file: pathlib.Path) -> pathlib.Path:
+    return file.with_name(file.stem + "-merged" + file.suffix)
 
 
 def merge_command(file, *subtitles: Tuple[pathlib.Path, Language]):
@@ -73,7 +183,7 @@ def merge_command(file, *subtitles: Tuple[pathlib.Path, Language]):
     cmd = [
         "mkvmerge",
         "-o",
-        file.with_name(file.stem + '-merged' + file.suffix),
+        output_path(file),
         file,
     ]
 
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+# Imports {{{
+# builtins
+import logging
+import pathlib
+
+# 3rd party
+import click
+
+# local modules
+from submerge import daemon
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--socket",
+    "socket_path",
+    help="The Unix domain socket to listen on [default: $SUBMERGE_SOCKET, or"
+    " submerge.sock in $XDG_RUNTIME_DIR or the cache directory]",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+)
+def serve(socket_path):
+    """
+    Keep submerge loaded and run commands sent to it.
+
+    Every module, the language tables, detector profiles and caches are loaded
+    once, and stay loaded between commands. When SUBMERGE_SOCKET is set to the
+    socket's path, 'python -m submerge ...' sends its command line to the
+    server and shows its output, instead of starting submerge from scratch.
+    Commands run one at a time, in the server's environment, with the global
+    options given to each of them.
+    """
+    try:
+        daemon.serve(socket_path or daemon.default_socket())
+    except FileExistsError as e:
+        raise click.ClickException(str(e))
+    except KeyboardInterrupt:
+        log.info("Stopped.")
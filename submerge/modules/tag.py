@@ -2,16 +2,16 @@
 
 # Imports {{{
 # builtins
-from concurrent.futures import ThreadPoolExecutor
 import logging
-import subprocess
 
 # 3rd party
 import click
 
 # this module
-from submerge.modules.base import path_args
-from submerge.utils import get_files, language, quote_cmd
+from submerge import api
+from submerge.modules.base import journal_args, open_journal, path_args, plan_args, report_edits
+from submerge.plan import execute
+from submerge.utils import language
 
 # }}}
 
@@ -34,41 +34,22 @@ log = logging.getLogger(__name__)
     nargs=2,
     required=True,
 )
-@click.option(
-    "-s",
-    "--simulate",
-    help="Print out the command to be executed instead of actually executing it",
-    is_flag=True,
-)
-def tag(paths, recursive, language, simulate):
+@plan_args
+@journal_args
+def tag(paths, recursive, language, simulate, save_plan, resume, journal_path):
     """
     Modify the track attributes of a given file.
     """
 
-    files = get_files(paths, recursive)
     track, lang = language
 
-    with ThreadPoolExecutor() as executor:
-        results = executor.map(
-            lambda file: edit_track(file, track, language=lang, simulate=simulate),
-            files,
-        )
-
-    log.debug("Command outputs:")
-    for output in results:
-        log.debug(output)
+    with open_journal(resume, journal_path, readonly=simulate or save_plan) as journal:
+        plan = api.plan_tag(paths, track, lang, recursive, journal)
+        executed = execute(plan, simulate=simulate, save=save_plan, journal=journal)
+    if not (simulate or save_plan):
+        report_edits(executed, len(plan))
 
-    if not simulate:
-        log.info("All files modified.")
 
-
-def edit_track(file, track, simulate=False, **kwargs):
-    cmd = ["mkvpropedit", str(file.expanduser().resolve()), "--edit", f"track:@{track}"]
+def edit_track(plan, file, track, **kwargs):
     for key, value in kwargs.items():
-        cmd.extend(["--set", f"{key}={value.alpha_3}"])
-
-    if simulate:
-        log.info(quote_cmd(cmd))
-        return cmd
-    else:
-        return subprocess.check_output(cmd, text=True)
+        plan.add(file, f"track:@{track}", key, value.alpha_3)
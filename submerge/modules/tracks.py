@@ -2,18 +2,28 @@
 
 # Imports {{{
 # builtins
-from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from functools import partial
+import functools
 import logging
-import subprocess
+import pathlib
+import re
+from typing import FrozenSet, IO, List, NamedTuple, Optional, Tuple
 
 # 3rd party
 import click
 
 # local modules
-from submerge.modules.base import path_args
-from submerge.utils import get_files, get_metadata, quote_cmd
+from submerge import api, trace
+from submerge.modules.base import (
+    journal_args,
+    open_journal,
+    path_args,
+    plan_args,
+    report_edits,
+)
+from submerge.plan import execute
+from submerge.records import FileInfo, Unreadable
+from submerge.utils import get_metadata
 
 # }}}
 
@@ -21,24 +31,113 @@ from submerge.utils import get_files, get_metadata, quote_cmd
 log = logging.getLogger(__name__)
 
 
+class TrackType(Enum):
+    video = "v"
+    audio = "a"
+    subtitles = "s"
+    buttons = "b"
+
+
+# the set of (track number, track type) pairs of a file, or of a pattern
+Layout = FrozenSet[Tuple[int, TrackType]]
+
+PAIR = re.compile(r"(\d+)([vasb])")
+NEW_ORDER = re.compile(r"\d+(:\d+)*")
+
+
+class Rule(NamedTuple):
+    pattern: Optional[str]
+    new_order: str
+    strict: bool = False
+
+
+@functools.lru_cache(maxsize=None)
+def parse_pattern(pattern: str) -> Layout:
+    """
+    Parse a pattern like 1v:2a:3s.
+    """
+    pairs = set()
+    for pair in pattern.split(":"):
+        match = PAIR.fullmatch(pair.strip())
+        if not match:
+            raise ValueError(f"Invalid track pattern {pattern!r}")
+        pairs.add((int(match[1]), TrackType(match[2])))
+    return frozenset(pairs)
+
+
+def track_pattern(string):
+    parse_pattern(string)
+    return string
+
+
+def new_order(string):
+    if not NEW_ORDER.fullmatch(string):
+        raise ValueError(f"Invalid track order {string!r}")
+    return string
+
+
+def get_layout(info: FileInfo) -> Layout:
+    return frozenset((track.number, TrackType[track.type]) for track in info.tracks)
+
+
+def format_layout(layout: Layout) -> str:
+    return ":".join(f"{number}{type.value}" for number, type in sorted(layout))
+
+
+def matches(pattern: Layout, layout: Layout, strict: bool = True) -> bool:
+    # unless strict, the pattern only has to fit within the file's tracks
+    return pattern == layout if strict else pattern <= layout
+
+
+def load_rules(fp: IO[str]) -> List[Rule]:
+    """
+    Read rules, one per line, as "PATTERN NEW_ORDER [strict]". Blank lines and
+    anything after a # are ignored.
+    """
+    rules = []
+    for number, line in enumerate(fp, 1):
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+            continue
+        if len(fields) not in (2, 3) or fields[2:] not in ([], ["strict"]):
+            raise ValueError(f"line {number}: expected 'PATTERN NEW_ORDER [strict]'")
+        try:
+            rules.append(
+                Rule(track_pattern(fields[0]), new_order(fields[1]), len(fields) == 3)
+            )
+        except ValueError as e:
+            raise ValueError(f"line {number}: {e}") from None
+    return rules
+
+
 @click.command()
 @path_args
-@click.option("-n", "--new-order", help="The new desired track ordering", required=True)
+@click.option(
+    "-n",
+    "--new-order",
+    help="The new desired track ordering",
+    type=new_order,
+)
 @click.option(
     "-p",
     "--pattern",
     help="Only modify a file if it matches the specified track pattern",
+    type=track_pattern,
 )
 @click.option(
     "--strict", help="Only match a file if it matches the pattern exactly", is_flag=True
 )
 @click.option(
-    "-s",
-    "--simulate",
-    help="Print out the command to be executed instead of actually executing it",
-    is_flag=True,
+    "--rules",
+    help="A file of 'PATTERN NEW_ORDER [strict]' lines to apply all at once",
+    type=click.File("r"),
+    metavar="FILE",
 )
-def tracks(paths, recursive, new_order, pattern, strict, simulate):
+@plan_args
+@journal_args
+def tracks(
+    paths, recursive, new_order, pattern, strict, rules, simulate, save_plan, resume, journal_path
+):
     """
     Reorder the tracks of a file.
 
@@ -46,81 +145,81 @@ def tracks(paths, recursive, new_order, pattern, strict, simulate):
     track ordering of a file will match that file. AKA, if a file has an ordering
     of 1v:2a:3s:4s, and you pass a pattern of 1v:2a:3s, that will match by default
     because the entire pattern can fit within the existing track ordering.
-    """
-    files = get_files(paths, recurse=recursive)
 
-    if not files:
-        log.info("No files found.")
-        return
-
-    results = {"pass": [], "fail": []}
-    for file in files:
-        if not pattern or (pattern and test(file, pattern, strict=strict)):
-            results["pass"].append(file)
-        else:
-            results["fail"].append(file)
-
-    results["pass"].sort()
-    results["fail"].sort()
+    With --rules, every file is probed once and grouped by its track layout,
+    and each layout is reordered by the first rule whose pattern it matches.
+    """
+    if rules is not None:
+        if new_order or pattern:
+            raise click.UsageError("--rules can't be combined with --new-order or --pattern")
+        try:
+            rules = load_rules(rules)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="'--rules'")
+    elif new_order:
+        rules = [Rule(pattern, new_order, strict)]
+    else:
+        raise click.UsageError("Missing option '-n' / '--new-order' (or '--rules').")
+
+    with open_journal(resume, journal_path, readonly=simulate or save_plan) as journal:
+        reordering = api.plan_reorder(paths, rules=rules, recursive=recursive, journal=journal)
+        groups, assigned = reordering.layouts, reordering.rules
+        if not groups:
+            log.info("No files found.")
+            return
+
+        if any(rule.pattern for rule in rules):
+            if len(rules) == 1:
+                results = {True: [], False: []}
+                for layout, group in groups.items():
+                    results[bool(assigned[layout])].extend(group)
+
+                log.info("The following files matched the pattern:")
+                for file in sorted(results[True]):
+                    log.info(f"    {file.name}")
+                log.debug('The following files did not match the pattern:')
+                for file in sorted(results[False]):
+                    log.debug(f"    {file.name}")
+            else:
+                report_layouts(groups, assigned)
+
+            click.confirm("\nContinue?", abort=True)
+
+        # nothing to do is just as final
+        for file in reordering.unchanged:
+            journal.record(file, None)
+        executed = execute(reordering.plan, simulate=simulate, save=save_plan, journal=journal)
+    if not (simulate or save_plan):
+        report_edits(executed, len(reordering.plan))
+
+
+@trace.traced("read layout")
+def read_layout(file: pathlib.Path) -> Tuple[pathlib.Path, Optional[Layout]]:
+    try:
+        return file, get_layout(get_metadata(file))
+    except Unreadable:
+        log.info(f"ERROR: {file} failed to be read.")
+        return file, None
 
-    if pattern:
-        log.info("The following files matched the pattern:")
-        for file in results["pass"]:
-            log.info(f"    {file.name}")
-        log.debug('The following files did not match the pattern:')
-        for file in results['fail']:
-            log.debug(f"    {file.name}")
 
-        click.confirm("\nContinue?", abort=True)
+def find_rule(rules: List[Rule], layout: Optional[Layout]) -> Optional[Rule]:
+    for rule in rules:
+        if rule.pattern is None:
+            return rule
+        if layout is not None and matches(parse_pattern(rule.pattern), layout, rule.strict):
+            return rule
+    return None
 
-    # process files
-    with ThreadPoolExecutor() as executor:
-        processed = executor.map(
-            partial(modify_track, new_order=new_order, simulate=simulate),
-            results["pass"],
-        )
 
-    return processed
+def report_layouts(groups, assigned):
+    log.info("Track layouts found:")
+    for layout, group in sorted(groups.items(), key=lambda item: -len(item[1])):
+        name = "unreadable" if layout is None else format_layout(layout)
+        rule = assigned[layout]
+        change = f"-> {rule.new_order} ({rule.pattern})" if rule else "unchanged"
+        log.info(f"    {name:<24} {len(group):>7} file(s) {change}")
 
 
-def modify_track(file, new_order, simulate):
-    cmd = ["mkvpropedit", str(file)]
+def modify_track(plan, file, new_order):
     for old, new in enumerate(new_order.split(":"), 1):
-        cmd += ["--edit", f"track:@{old}", "--set", f"track-number={new}"]
-
-    if simulate:
-        log.info(quote_cmd(cmd))
-        return cmd
-    else:
-        proc = subprocess.run(cmd, stdout=subprocess.PIPE)
-        return proc
-
-
-def test(file, pattern, strict=True):
-    class TrackType(Enum):
-        video = "v"
-        audio = "a"
-        subtitles = "s"
-
-    user_pairings = {int(pair[0]): TrackType(pair[1]) for pair in pattern.split(":")}
-
-    try:
-        metadata = get_metadata(file)
-        real_pairings = {
-            int(track["properties"]["number"]): TrackType[track["type"]]
-            for track in metadata["tracks"]
-        }
-    except KeyError:
-        log.info(f"ERROR: {file} failed to be read.")
-        return False
-
-    # check if user_pairings is a subset of real_pairings
-    if strict:
-        matches = (
-            len(user_pairings) == len(real_pairings)
-            and user_pairings.items() == real_pairings.items()
-        )
-    else:
-        matches = user_pairings.items() <= real_pairings.items()
-
-    return matches
+        plan.add(file, f"track:@{old}", "track-number", new)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Imports {{{
+# builtins
+import fnmatch
+import logging
+import pathlib
+import time
+from typing import Dict, List, Optional, Tuple
+
+# 3rd party
+import click
+
+# local modules
+from submerge.modules.base import UNATTENDED, module_spec, path_args, run_module
+from submerge.watcher import get_watcher
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+# how long the state files were left in is remembered, to tell the changes
+# made by the modules apart from new ones
+PROCESSED_TTL = 3600.0
+# how often forgotten and deleted files are pruned from it
+PRUNE_INTERVAL = 60.0
+
+
+@click.command()
+@path_args
+@click.option(
+    "-m",
+    "--run",
+    "specs",
+    help=f"A module (and its options) to run on new files: {', '.join(UNATTENDED)}",
+    metavar='"MODULE [OPTIONS]"',
+    type=module_spec,
+    multiple=True,
+    default=["audit"],
+    show_default=True,
+)
+@click.option(
+    "--settle",
+    help="Seconds a file must stay unchanged before it is processed",
+    type=click.FloatRange(min=0),
+    default=5.0,
+    show_default=True,
+)
+def watch(paths, recursive, specs, settle):
+    """
+    Run modules on files as they are added to the given directories.
+
+    New or changed MKV files are processed once they have been closed and
+    have stopped changing for --settle seconds. Changes made by the modules
+    themselves do not cause a file to be processed again. Files still open
+    for writing, like a stalled download, wait until they are closed (unless
+    inotify is unavailable, and changes are polled for instead).
+    """
+    files = [path for path in paths if not path.is_dir()]
+    if files:
+        raise click.UsageError(f"Only directories can be watched, not {files[0]}.")
+    if not paths:
+        raise click.UsageError("Missing a directory to watch.")
+    roots = list(paths)
+    watcher = get_watcher(roots, recurse=recursive)
+    log.info(f"Watching {', '.join(str(root) for root in roots)}...")
+
+    # path -> (time of the last change, (size, mtime) when last checked,
+    # whether it has been closed since it was last written to)
+    pending: Dict[pathlib.Path, Tuple[float, Optional[Tuple[int, int]], bool]] = {}
+    # path -> ((size, mtime) after the modules were last run on it, when)
+    processed: Dict[pathlib.Path, Tuple[Tuple[int, int], float]] = {}
+    pruned = time.monotonic()
+
+    try:
+        while True:
+            now = time.monotonic()
+            for file, closed in watcher.changes(timeout=min(settle, 1.0) or 0.1).items():
+                if fnmatch.fnmatchcase(file.name, "*.mkv"):
+                    pending[file] = (now, None, closed)
+
+            if now - pruned >= PRUNE_INTERVAL:
+                prune(processed, now)
+                pruned = now
+
+            ready = settled(pending, processed, settle, now)
+            if not ready:
+                continue
+
+            ready.sort()
+            log.info(f"Processing {len(ready)} new file(s)...")
+            for spec in specs:
+                for file, error in run_module(spec, ready).items():
+                    log.error(f"{spec[0]} failed on {file.name}: {error}")
+
+            for file in ready:
+                try:
+                    stat = file.stat()
+                except OSError:
+                    continue
+                processed[file] = ((stat.st_size, stat.st_mtime_ns), now)
+    except KeyboardInterrupt:
+        log.info("Stopped watching.")
+    finally:
+        watcher.close()
+
+
+def settled(pending, processed, settle, now) -> List[pathlib.Path]:
+    """
+    Pop the pending files that have been closed, then quiet and unchanged for
+    `settle` seconds, skipping any that are exactly as the modules last left
+    them.
+    """
+    ready = []
+    for file, (changed, state, closed) in list(pending.items()):
+        if not closed or now - changed < settle:
+            continue
+        try:
+            stat = file.stat()
+        except OSError:
+            del pending[file]
+            continue
+
+        current = (stat.st_size, stat.st_mtime_ns)
+        if current != state:
+            # check once more after another quiet period
+            pending[file] = (now, current, closed)
+            continue
+
+        del pending[file]
+        last = processed.get(file)
+        if last is None or last[0] != current:
+            ready.append(file)
+    return ready
+
+
+def prune(processed, now):
+    """
+    Forget the files processed too long ago for their own changes to still
+    be coming in, and those that are gone.
+    """
+    for file, (_, when) in list(processed.items()):
+        if now - when >= PROCESSED_TTL or not file.exists():
+            del processed[file]
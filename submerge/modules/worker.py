@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# Imports {{{
+# builtins
+import logging
+import pathlib
+import time
+from typing import Dict, List, Optional
+
+# 3rd party
+import click
+
+# local modules
+from submerge.modules.base import run_module
+from submerge.workqueue import LEASE, Heartbeat, Item, WorkQueue, worker_id
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+
+@click.command()
+@click.argument(
+    "queue_file", type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path)
+)
+@click.option(
+    "-b",
+    "--batch",
+    help="How many files to claim from the queue at a time",
+    type=click.IntRange(min=1),
+    default=16,
+    show_default=True,
+)
+@click.option(
+    "--lease",
+    help="Seconds before the files of an unresponsive worker are handed out again",
+    type=click.FloatRange(min=1),
+    default=LEASE,
+    show_default=True,
+)
+@click.option(
+    "--poll",
+    help="Seconds between checks for files given up by other workers",
+    type=click.FloatRange(min=0.1),
+    default=5.0,
+    show_default=True,
+)
+def worker(queue_file, batch, lease, poll):
+    """
+    Process files queued with 'submerge enqueue'.
+
+    Any number of workers, on this machine or others sharing the queue file,
+    can work through the same queue. Each exits once every file is done.
+    """
+    queue = WorkQueue(queue_file)
+    owner = worker_id()
+    processed = failed = 0
+    items = []
+
+    try:
+        while True:
+            items = queue.claim(owner, batch, lease)
+            if not items:
+                if not queue.counts()["leased"]:
+                    break
+                # the files held by other workers come back if those workers die
+                time.sleep(poll)
+                continue
+
+            heartbeat = Heartbeat(queue, owner, items, lease)
+            heartbeat.start()
+            try:
+                done, errors = process(queue, owner, items)
+                processed += done
+                failed += errors
+            finally:
+                heartbeat.stop()
+            items = []
+    except KeyboardInterrupt:
+        queue.release(owner, items)
+        log.info("Stopped, returning unfinished files to the queue.")
+    finally:
+        queue.close()
+
+    log.info(f"{processed} file(s) processed, {failed} failed.")
+
+
+def process(queue: WorkQueue, owner: str, items):
+    """
+    Run each module on the claimed files queued for it, and record the outcome.
+    """
+
+    def finish(items: List[Item], error: Optional[str] = None):
+        recorded = queue.finish(owner, items, error)
+        if recorded < len(items):
+            log.warning(
+                f"The lease on {len(items) - recorded} file(s) ran out, and another"
+                " worker claimed them; leaving them to it."
+            )
+
+    batches = {}
+    for item in items:
+        batches.setdefault(tuple(item.args), []).append(item)
+
+    done = errors = 0
+    for spec, batch in batches.items():
+        missing = [item for item in batch if not item.path.is_file()]
+        if missing:
+            finish(missing, "File not found")
+            errors += len(missing)
+            batch = [item for item in batch if item.path.is_file()]
+            if not batch:
+                continue
+
+        log.info(f"Running {spec[0]} on {len(batch)} file(s)...")
+        failed = run_module(list(spec), [item.path for item in batch])
+        # grouped by error, to put them back in the queue together
+        outcomes: Dict[Optional[str], List[Item]] = {}
+        for item in batch:
+            outcomes.setdefault(failed.get(item.path), []).append(item)
+        for error, items in outcomes.items():
+            finish(items, error)
+            if error is None:
+                done += len(items)
+            else:
+                log.error(f"{spec[0]} failed on {len(items)} file(s): {error}")
+                errors += len(items)
+    return done, errors
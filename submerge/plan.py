@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+"""
+Edit plans.
+
+Modules describe the changes they want as per-file edits rather than running
+mkvpropedit themselves. A plan coalesces every edit to a file into a single
+mkvpropedit invocation, and can be saved as JSON to be reviewed, combined with
+other plans and applied later with `submerge apply`.
+"""
+
+# Imports {{{
+# builtins
+import json
+import logging
+import pathlib
+import subprocess
+from typing import Dict, IO, Iterator, List, NamedTuple, Optional, Tuple
+
+# local modules
+from submerge import cache, ebml, engine, trace
+from submerge.journal import Journal
+from submerge.utils import quote_cmd
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+
+# how edits are made, set from the top-level command group
+EDITORS = ["mkvpropedit", "native"]
+edit_method = "mkvpropedit"
+
+
+class Edit(NamedTuple):
+    selector: str
+    property: str
+    value: str
+
+
+class Outcome(NamedTuple):
+    file: pathlib.Path
+    edited: bool
+    # why the file wasn't edited
+    error: Optional[str] = None
+
+
+class Executed(NamedTuple):
+    edited: List[pathlib.Path]
+    # why each of the other files couldn't be edited
+    failed: Dict[pathlib.Path, str]
+
+
+class Plan:
+    def __init__(self):
+        self.edits: Dict[pathlib.Path, List[Edit]] = {}
+        self.fingerprints: Dict[pathlib.Path, Optional[cache.Fingerprint]] = {}
+
+    def __len__(self):
+        return len(self.edits)
+
+    def __bool__(self):
+        return bool(self.edits)
+
+    def add(self, file: pathlib.Path, selector: str, property: str, value):
+        """
+        Plan to set a property of an element (like "track:@2") of a file.
+        """
+        self.edits.setdefault(file, []).append(Edit(selector, property, str(value)))
+
+    def update(self, other: "Plan"):
+        """
+        Merge another plan into this one.
+        """
+        for file, edits in other.edits.items():
+            self.edits.setdefault(file, []).extend(edits)
+            if other.fingerprints.get(file):
+                self.fingerprints.setdefault(file, other.fingerprints[file])
+
+    def selectors(self, file: pathlib.Path) -> Dict[str, Dict[str, str]]:
+        """
+        The properties to set on each element of a file.
+        """
+        # later edits of the same property win
+        selectors: Dict[str, Dict[str, str]] = {}
+        for edit in self.edits[file]:
+            selectors.setdefault(edit.selector, {})[edit.property] = edit.value
+        return selectors
+
+    def command(self, file: pathlib.Path) -> List:
+        """
+        Build the single mkvpropedit call making every planned edit to a file.
+        """
+        cmd = ["mkvpropedit", str(file)]
+        for selector, properties in self.selectors(file).items():
+            cmd.extend(["--edit", selector])
+            for property, value in properties.items():
+                cmd.extend(["--set", f"{property}={value}"])
+        return cmd
+
+    def commands(self) -> Iterator[List]:
+        for file in self.edits:
+            yield self.command(file)
+
+    @trace.traced("apply edits")
+    def apply_file(self, file: pathlib.Path) -> Tuple[pathlib.Path, subprocess.CompletedProcess]:
+        expected = self.fingerprints.get(file)
+        current = cache.Fingerprint.of(file)
+        if expected is not None and expected != current:
+            raise RuntimeError(f"{file} has changed since the plan was made")
+        # remembered for the journal, along with the fingerprint after the edit
+        self.fingerprints[file] = current
+
+        if edit_method == "native":
+            try:
+                with trace.span("native edit"):
+                    ebml.edit(file, self.selectors(file))
+            except (ebml.ParseError, ebml.Unsupported) as e:
+                log.debug(f"Editing {file.name} with mkvpropedit instead: {e}")
+            else:
+                cache.invalidate(file)
+                return file, subprocess.CompletedProcess(self.command(file), 0, "", "")
+
+        proc = engine.run(self.command(file))
+        cache.invalidate(file)
+        return file, proc
+
+    def apply(self, journal: Optional[Journal] = None) -> Iterator[Outcome]:
+        """
+        Apply the plan, one mkvpropedit process per file, in parallel.
+        Yields the outcome for each file as it completes, and records the
+        edited files in the journal if one is given.
+        """
+
+        def attempt(file):
+            try:
+                return self.apply_file(file)
+            # ValueError: an edit that makes no sense, as in a hand-edited plan
+            except (OSError, RuntimeError, ValueError) as e:
+                return file, e
+
+        for future in engine.submit_all(attempt, self.edits):
+            file, proc = future.result()
+            if isinstance(proc, Exception):
+                yield Outcome(file, False, str(proc))
+                continue
+
+            log.debug(proc.stdout)
+            # mkvpropedit exits with 1 for warnings and 2 for errors, and a
+            # negative code means it was killed
+            if proc.returncode < 0 or proc.returncode > 1:
+                errors = [line for line in proc.stdout.splitlines() if "error" in line.lower()]
+                yield Outcome(file, False, " ".join(errors) or f"exit status {proc.returncode}")
+                continue
+
+            if journal is not None:
+                journal.record(file, self.fingerprints.get(file))
+            yield Outcome(file, True)
+
+    def dump(self, fp: IO[str]):
+        """
+        Save the plan as JSON, along with the current fingerprint of each file
+        so that files changed in the meantime aren't edited blindly.
+        """
+        files = []
+        for file, edits in self.edits.items():
+            fingerprint = self.fingerprints.get(file) or cache.Fingerprint.of(file)
+            files.append(
+                {
+                    "file": str(file.absolute()),
+                    "fingerprint": fingerprint._asdict(),
+                    "edits": [edit._asdict() for edit in edits],
+                }
+            )
+        json.dump({"version": VERSION, "files": files}, fp, indent=2)
+        fp.write("\n")
+
+    @classmethod
+    def load(cls, fp: IO[str]) -> "Plan":
+        """
+        Read a plan saved with `dump`, raising ValueError if it isn't one.
+        """
+        data = json.load(fp)
+        if not isinstance(data, dict) or data.get("version") != VERSION:
+            version = data.get("version") if isinstance(data, dict) else None
+            raise ValueError(f"Unsupported plan version {version!r}")
+
+        plan = cls()
+        try:
+            for entry in data["files"]:
+                file = pathlib.Path(entry["file"])
+                for edit in entry["edits"]:
+                    edit = Edit(edit["selector"], edit["property"], edit["value"])
+                    if not all(isinstance(field, str) for field in edit):
+                        raise ValueError(f"Edit of {file} isn't made of strings: {edit}")
+                    plan.add(file, *edit)
+                if entry.get("fingerprint"):
+                    plan.fingerprints[file] = cache.Fingerprint(**entry["fingerprint"])
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Malformed plan: {e!r}") from None
+        return plan
+
+
+def execute(
+    plan: Plan,
+    simulate: bool = False,
+    save: Optional[IO[str]] = None,
+    journal: Optional[Journal] = None,
+) -> Executed:
+    """
+    Save, print or apply a plan, as requested by the plan_args options.
+    Returns the files that were successfully edited, which are recorded in
+    the journal if one is given, and those that failed.
+    """
+    executed = Executed([], {})
+    if save is not None:
+        plan.dump(save)
+        log.info(f"Saved edits for {len(plan)} file(s) to {save.name}.")
+        return executed
+
+    if simulate:
+        for cmd in plan.commands():
+            log.info(quote_cmd(cmd))
+        return executed
+
+    for outcome in plan.apply(journal):
+        if outcome.edited:
+            executed.edited.append(outcome.file)
+        else:
+            log.error(f"Failed to edit {outcome.file.name}: {outcome.error}")
+            executed.failed[outcome.file] = outcome.error or "Failed"
+    return executed
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Compact descriptions of files and their tracks.
+
+`mkvmerge -J` describes much more than submerge ever looks at (attachments,
+chapters, container and codec properties...). Only the fields that are used
+are kept, in tuples, with their strings interned, so that a whole library's
+worth can be held at once. The same records are built by the native reader,
+and stored in the metadata cache.
+"""
+
+# Imports {{{
+# builtins
+import sys
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+# }}}
+
+
+class Unreadable(ValueError):
+    """
+    A file could not be made sense of.
+    """
+
+
+class TrackInfo(NamedTuple):
+    # mkvmerge's track ID, as used by mkvextract
+    id: int
+    number: int
+    # "video", "audio", "subtitles" or "buttons"
+    type: str
+    codec: str
+    codec_id: str
+    language: str
+    name: Optional[str] = None
+
+    @classmethod
+    def make(
+        cls,
+        id: int,
+        number: int,
+        type: str,
+        codec: str,
+        codec_id: str,
+        language: str,
+        name: Optional[str] = None,
+    ) -> "TrackInfo":
+        # the same few strings are repeated in every file (names aren't)
+        return cls(
+            id,
+            number,
+            sys.intern(type),
+            sys.intern(codec),
+            sys.intern(codec_id),
+            sys.intern(language),
+            name,
+        )
+
+
+class FileInfo(NamedTuple):
+    tracks: Tuple[TrackInfo, ...]
+
+    def of_type(self, type: str) -> List[TrackInfo]:
+        return [track for track in self.tracks if track.type == type]
+
+    @classmethod
+    def from_mkvmerge(cls, metadata: dict) -> "FileInfo":
+        """
+        Keep what submerge uses of the output of `mkvmerge -J`.
+        """
+        if not metadata.get("container", {}).get("recognized"):
+            errors = "; ".join(metadata.get("errors") or []) or "Unrecognized file"
+            raise Unreadable(errors)
+        try:
+            return cls(
+                tuple(
+                    TrackInfo.make(
+                        track["id"],
+                        int(track["properties"]["number"]),
+                        track["type"],
+                        track.get("codec", ""),
+                        track["properties"].get("codec_id", ""),
+                        track["properties"].get("language", "und"),
+                        track["properties"].get("track_name"),
+                    )
+                    for track in metadata["tracks"]
+                )
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise Unreadable(f"Unexpected mkvmerge output: {e!r}") from None
+
+    def to_json(self) -> list:
+        return [list(track) for track in self.tracks]
+
+    @classmethod
+    def from_json(cls, tracks: Iterable[list]) -> "FileInfo":
+        return cls(tuple(TrackInfo.make(*track) for track in tracks))
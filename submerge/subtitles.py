@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Imports {{{
+# builtins
+import logging
+import os
+import pathlib
+import re
+import tempfile
+from typing import Dict, Optional
+
+# local modules
+from submerge import engine
+from submerge.records import Unreadable
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+# text subtitle codecs and the extension mkvextract output should get
+TEXT_CODECS = {
+    "S_TEXT/UTF8": ".srt",
+    "S_TEXT/ASCII": ".srt",
+    "S_TEXT/ASS": ".ass",
+    "S_TEXT/SSA": ".ssa",
+    "S_TEXT/WEBVTT": ".vtt",
+}
+
+# how often a running extraction is checked for having collected enough text
+POLL_INTERVAL = 0.25
+
+TIMING = re.compile(r"^\s*(\d+\s*)?$|-->")
+HTML_TAG = re.compile(r"</?[a-zA-Z][^>]*>")
+ASS_OVERRIDE = re.compile(r"\{[^}]*\}")
+WHITESPACE = re.compile(r"\s+")
+
+
+def scratch_dir() -> Optional[str]:
+    """
+    Prefer a tmpfs for extracted tracks, so they never touch the disk.
+    """
+    for candidate in ("/dev/shm", os.environ.get("XDG_RUNTIME_DIR")):
+        if candidate and os.path.isdir(candidate) and os.access(candidate, os.W_OK):
+            return candidate
+    return None
+
+
+def strip_markup(text: str, extension: str) -> str:
+    """
+    Reduce a subtitle file to just the words that are spoken.
+    """
+    lines = []
+    if extension in (".ass", ".ssa"):
+        for line in text.splitlines():
+            if not line.startswith("Dialogue:"):
+                continue
+            # the text is the last of the 10 comma-separated fields
+            fields = line.split(",", 9)
+            if len(fields) == 10:
+                dialogue = ASS_OVERRIDE.sub("", fields[9])
+                lines.append(dialogue.replace("\\N", " ").replace("\\n", " "))
+    else:
+        for line in text.splitlines():
+            if TIMING.search(line) or line.strip() == "WEBVTT":
+                continue
+            lines.append(ASS_OVERRIDE.sub("", HTML_TAG.sub("", line)))
+
+    return WHITESPACE.sub(" ", " ".join(lines)).strip()
+
+
+def read_text(path: pathlib.Path, limit: int) -> str:
+    """
+    Read the dialogue from the start of an extracted subtitle file.
+    """
+    try:
+        with open(path, "rb") as f:
+            # markup roughly doubles the size of the text, so read generously
+            raw = f.read(limit * 4)
+    except FileNotFoundError:
+        return ""
+    text = raw.decode("utf-8-sig", errors="replace")
+    return strip_markup(text, path.suffix)[:limit]
+
+
+def extract_text(
+    file: pathlib.Path, tracks: Dict[int, str], limit: int
+) -> Dict[int, str]:
+    """
+    Extract a sample of dialogue from several text subtitle tracks at once.
+
+    `tracks` maps mkvmerge track ids to their codec ids. All of them are
+    extracted by a single mkvextract process, which is stopped as soon as
+    every track has yielded `limit` characters of text, rather than reading
+    the whole file once per track. Raises Unreadable if mkvextract fails.
+    """
+    with tempfile.TemporaryDirectory(prefix="submerge-", dir=scratch_dir()) as tmp:
+        outputs = {
+            track: pathlib.Path(tmp, f"{track}{TEXT_CODECS[codec]}")
+            for track, codec in tracks.items()
+        }
+
+        def collected():
+            return all(len(read_text(path, limit)) >= limit for path in outputs.values())
+
+        cmd = ["mkvextract", file, "tracks"]
+        cmd.extend(f"{track}:{path}" for track, path in outputs.items())
+        proc = engine.run(cmd, until=collected, poll=POLL_INTERVAL)
+        # mkvextract exits with 2 for errors (a negative code means it was
+        # stopped once it had extracted enough)
+        if proc.returncode > 1:
+            errors = [line for line in proc.stdout.splitlines() if "error" in line.lower()]
+            raise Unreadable(" ".join(errors) or f"mkvextract exited with {proc.returncode}")
+
+        return {track: read_text(path, limit) for track, path in outputs.items()}
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+"""
+Tracing of where a run spends its time.
+
+With `--trace FILE`, a span is recorded for each stage of the work (walking
+directories, probing, testing, editing...) and for each subprocess, on the
+thread that ran it. The spans are written as Chrome trace events, which can be
+opened in chrome://tracing or https://ui.perfetto.dev, and a per-stage latency
+summary is logged at the end of the run.
+
+When tracing is off, `span` hands back a shared do-nothing context manager, so
+instrumented code only pays for a function call and a flag check.
+"""
+
+# Imports {{{
+# builtins
+import functools
+import itertools
+import json
+import logging
+import math
+import os
+import shlex
+import threading
+import time
+from typing import IO, Dict, Iterator, List, NamedTuple, Optional
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+enabled = False
+_origin = 0
+_events: List["Event"] = []
+_async_ids = itertools.count(1)
+
+
+class Event(NamedTuple):
+    name: str
+    category: str
+    start: int
+    end: int
+    thread: int
+    thread_name: str
+    args: dict
+    # set for spans that overlap others on the same thread
+    async_id: Optional[int] = None
+
+
+class Span:
+    __slots__ = ("name", "category", "args", "start")
+
+    def __init__(self, name: str, category: str, args: dict):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.category, self.start, time.perf_counter_ns(), **self.args)
+
+    def set(self, **args):
+        """
+        Attach more details to the span, such as results only known at the end.
+        """
+        self.args.update(args)
+
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name: str, category: str = "stage", **args):
+    """
+    Time a block of code, when tracing is enabled.
+    """
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, category, args)
+
+
+def traced(name: str = None, category: str = "stage"):
+    """
+    Decorate a function to record a span for each call.
+    """
+
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Span(label, category, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def now() -> int:
+    return time.perf_counter_ns()
+
+
+def record(name: str, category: str, start: int, end: int, **args):
+    """
+    Record a span measured by hand, with times from `now()`.
+    """
+    thread = threading.current_thread()
+    # list.append is atomic, so no lock is needed to record from any thread
+    _events.append(
+        Event(name, category, start, end, threading.get_native_id(), thread.name, args)
+    )
+
+
+def record_async(name: str, category: str, start: int, end: int, **args):
+    """
+    Record a span that may overlap others recorded on the same thread, like
+    work waited on in another process.
+    """
+    thread = threading.current_thread()
+    _events.append(
+        Event(
+            name,
+            category,
+            start,
+            end,
+            threading.get_native_id(),
+            thread.name,
+            args,
+            next(_async_ids),
+        )
+    )
+
+
+def start():
+    global enabled, _origin
+    _events.clear()
+    _origin = now()
+    enabled = True
+
+
+def stop():
+    global enabled
+    enabled = False
+
+
+def describe(value) -> str:
+    if isinstance(value, (list, tuple)):
+        return shlex.join(str(item) for item in value)
+    return str(value)
+
+
+def trace_events() -> Iterator[dict]:
+    pid = os.getpid()
+    threads = {}
+    for event in _events:
+        threads.setdefault(event.thread, event.thread_name)
+        common = {
+            "name": event.name,
+            "cat": event.category,
+            "pid": pid,
+            "tid": event.thread,
+            "args": {key: describe(value) for key, value in event.args.items()},
+        }
+        if event.async_id is None:
+            yield dict(
+                common,
+                ph="X",
+                ts=(event.start - _origin) / 1000,
+                dur=(event.end - event.start) / 1000,
+            )
+        else:
+            yield dict(common, ph="b", id=event.async_id, ts=(event.start - _origin) / 1000)
+            yield dict(common, ph="e", id=event.async_id, ts=(event.end - _origin) / 1000)
+
+    yield {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "submerge"}}
+    for thread, name in threads.items():
+        yield {"name": "thread_name", "ph": "M", "pid": pid, "tid": thread, "args": {"name": name}}
+
+
+def write(fp: IO[str]):
+    """
+    Save the recorded spans in the Chrome trace event format.
+    """
+    json.dump({"traceEvents": list(trace_events()), "displayTimeUnit": "ms"}, fp)
+    fp.write("\n")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    The nearest-rank percentile of some sorted values.
+    """
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def summary() -> Dict[str, Dict[str, float]]:
+    """
+    Count and latency percentiles (in ms) of the spans of each name.
+    """
+    durations: Dict[str, List[float]] = {}
+    for event in _events:
+        durations.setdefault(event.name, []).append((event.end - event.start) / 1e6)
+
+    stats = {}
+    for name, values in durations.items():
+        values.sort()
+        stats[name] = {
+            "count": len(values),
+            "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95),
+            "max": values[-1],
+            "total": sum(values),
+        }
+    return stats
+
+
+def report():
+    stats = summary()
+    if not stats:
+        return
+
+    width = max(len(name) for name in stats)
+    log.info(f"{'stage':<{width}} {'count':>7} {'p50':>10} {'p95':>10} {'max':>10} {'total':>10}")
+    for name, row in sorted(stats.items(), key=lambda item: -item[1]["total"]):
+        log.info(
+            f"{name:<{width}} {row['count']:>7}"
+            + "".join(f" {row[key]:>8.1f}ms" for key in ("p50", "p95", "max", "total"))
+        )
@@ -4,28 +4,52 @@
 # builtins
 from collections import defaultdict
 import json
-import itertools
+import fnmatch
+import logging
+import os
 import pathlib
+import queue
 import shlex
-import subprocess
+import threading
+import zlib
 from typing import (
     Callable,
     Dict,
     Iterable,
+    Iterator,
     List,
     Literal,
+    Optional,
+    Set,
     Tuple,
     TypeVar,
     Union,
     overload,
 )
 
-# 3rd party
-import pycountry
+# local modules
+from submerge import cache, ebml, engine, languages, records, trace
+from submerge.records import FileInfo
 
 # }}}
 
 
+log = logging.getLogger(__name__)
+
+# how files are probed, set from the top-level command group
+PROBES = ["mkvmerge", "native"]
+probe_method = "mkvmerge"
+
+# directory roots walked at once by get_files
+MAX_WALKERS = 8
+
+# (i, n) to only work on the i-th of n shards of the files, set from the
+# top-level command group. Passed to get_files when listing the files to work
+# on, rather than applied to every walk, so that lookups (like the subtitles
+# next to a video) still see everything.
+shard: Optional[Tuple[int, int]] = None
+
+
 def pretty_time_delta(seconds):
     _seconds = int(seconds)
     days, _seconds = divmod(_seconds, 24 * 60 ** 2)
@@ -56,49 +80,240 @@ def AbsolutePath(path):
     return pathlib.Path(path).expanduser().resolve()
 
 
-def get_metadata(file: pathlib.Path):
+def probe_mkvmerge(file: pathlib.Path) -> FileInfo:
     cmd = ["mkvmerge", "-J", str(file)]
-    proc = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
-    metadata = json.loads(proc.stdout)
-    return metadata
+    proc = engine.run(cmd)
+    with trace.span("parse json"):
+        try:
+            metadata = json.loads(proc.stdout)
+        except ValueError:
+            raise records.Unreadable(proc.stdout.strip() or "mkvmerge failed") from None
+        return FileInfo.from_mkvmerge(metadata)
+
+
+def probe(file: pathlib.Path) -> FileInfo:
+    """
+    Probe a file with the configured method, falling back to mkvmerge.
+    """
+    if probe_method == "native":
+        try:
+            with trace.span("native probe", file=file):
+                return ebml.read(file)
+        except (ebml.ParseError, OSError) as e:
+            log.debug(f"Native probe of {file.name} failed ({e}), using mkvmerge.")
+
+    return probe_mkvmerge(file)
+
+
+def get_metadata(file: pathlib.Path) -> FileInfo:
+    """
+    Get the tracks of a file, reading through the cache. Raises
+    records.Unreadable if mkvmerge can't make sense of it, or it's gone.
+    """
+    metadata_cache = cache.get_cache()
+    if metadata_cache is None:
+        return probe(file)
+
+    try:
+        fingerprint = cache.Fingerprint.of(file)
+    except OSError as e:
+        # moved or deleted since it was found
+        raise records.Unreadable(f"{file} can't be read: {e.strerror}") from None
+    if not cache.refresh:
+        with trace.span("cache lookup", file=file) as span:
+            info = metadata_cache.get(file, fingerprint)
+            span.set(hit=info is not None)
+        if info is not None:
+            return info
+
+    # files mkvmerge couldn't make sense of raise, so aren't remembered
+    info = probe(file)
+    with trace.span("cache store", file=file):
+        metadata_cache.put(file, fingerprint, info)
+    return info
+
+
+def scan(
+    folder: pathlib.Path,
+    recurse: bool,
+    glob: str,
+    seen: Set[Tuple[int, int]],
+    lock: threading.Lock,
+) -> Iterator[pathlib.Path]:
+    """
+    Walk a directory with os.scandir, yielding matching files not yet seen.
+    """
+    try:
+        stat = folder.stat()
+    except OSError:
+        return
+    stack = [(str(folder), stat.st_dev)]
+    with lock:
+        seen.add((stat.st_dev, stat.st_ino))
+
+    while stack:
+        directory, device = stack.pop()
+        try:
+            with trace.span("scandir", directory=directory), os.scandir(directory) as entries:
+                entries = list(entries)
+        except OSError as e:
+            log.debug(f"Skipping {directory}: {e}")
+            continue
+
+        for entry in entries:
+            try:
+                # d_type answers these for free, unless the entry is a symlink
+                is_link = entry.is_symlink()
+                if entry.is_file():
+                    if not fnmatch.fnmatchcase(entry.name, glob):
+                        continue
+                elif recurse and entry.is_dir():
+                    pass
+                else:
+                    continue
+
+                # entries in a directory share its device unless they are links
+                # (mount points only matter for directories, which are stat-ed)
+                if is_link or entry.is_dir():
+                    stat = entry.stat()
+                    key = (stat.st_dev, stat.st_ino)
+                else:
+                    key = (device, entry.inode())
+            except OSError:
+                continue
+
+            with lock:
+                if key in seen:
+                    continue
+                seen.add(key)
+
+            if entry.is_dir():
+                stack.append((entry.path, key[0]))
+            else:
+                yield pathlib.Path(entry.path)
+
+
+def parse_shard(string: str) -> Tuple[int, int]:
+    """
+    Parse a shard like "2/3" (the second of three).
+    """
+    index, _, count = string.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"Invalid shard {string!r}, expected I/N") from None
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {string!r}, I must be between 1 and N")
+    return index, count
+
+
+def in_shard(
+    file: pathlib.Path, shard: Optional[Tuple[int, int]], root: Optional[pathlib.Path] = None
+) -> bool:
+    """
+    Whether a file belongs to a shard. Files are assigned by a hash of their
+    path below the root they were found in, so every host agrees on the split
+    wherever the library is mounted.
+    """
+    if shard is None:
+        return True
+    index, count = shard
+    key = file.relative_to(root) if root is not None else pathlib.Path(file.name)
+    return zlib.crc32(key.as_posix().encode()) % count == index - 1
 
 
 def get_files(
-    paths: Iterable[pathlib.Path], recurse: bool = False, glob: str = "*.mkv"
-):
+    paths: Iterable[pathlib.Path],
+    recurse: bool = False,
+    glob: str = "*.mkv",
+    shard: Optional[Tuple[int, int]] = None,
+) -> Iterator[pathlib.Path]:
     """
-    Apply a glob to all specified paths, and collate + dedupe the results.
+    Apply a glob to all specified paths, and stream the deduped results.
+
+    Files are yielded as soon as they are found. Each directory root is walked
+    in its own thread, and files are deduped by device and inode, so hardlinks
+    and symlinks to the same file are only yielded once. With a shard given,
+    only the files in that shard are yielded.
     """
+    seen: Set[Tuple[int, int]] = set()
+    lock = threading.Lock()
     results = partition(paths, lambda path: path.is_dir())
     dirs, files = results[True], results[False]
 
+    for file in files:
+        try:
+            stat = file.stat()
+        except OSError:
+            continue
+        key = (stat.st_dev, stat.st_ino)
+        if file.is_file() and key not in seen:
+            seen.add(key)
+            if in_shard(file, shard):
+                yield file
+
+    if len(dirs) == 1:
+        for file in scan(dirs[0], recurse, glob, seen, lock):
+            if in_shard(file, shard, dirs[0]):
+                yield file
+        return
+
+    # walk several roots at once, funneling their results through a queue
+    roots = queue.SimpleQueue()
     for folder in dirs:
-        contents = folder.rglob(glob) if recurse else folder.glob(glob)
-        files = itertools.chain(files, contents)
+        roots.put(folder)
+    found = queue.Queue(maxsize=1024)
+    stop = threading.Event()
+    done = object()
+
+    def offer(item):
+        while not stop.is_set():
+            try:
+                found.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def walk():
+        try:
+            while not stop.is_set():
+                try:
+                    folder = roots.get_nowait()
+                except queue.Empty:
+                    break
+                for file in scan(folder, recurse, glob, seen, lock):
+                    if in_shard(file, shard, folder) and not offer(file):
+                        return
+        finally:
+            offer(done)
+
+    threads = [
+        threading.Thread(target=walk, name="submerge-walk", daemon=True)
+        for _ in range(min(len(dirs), MAX_WALKERS))
+    ]
+    for thread in threads:
+        thread.start()
 
-    # filter and dedupe
-    return list({file for file in files if file.is_file()})
+    try:
+        remaining = len(threads)
+        while remaining:
+            item = found.get()
+            if item is done:
+                remaining -= 1
+            else:
+                yield item
+    finally:
+        stop.set()
 
 
-def get_track_pattern(metadata):
-    pattern = []
-    for track in metadata["tracks"]:
-        try:
-            pattern.append((track["properties"]["number"], track["type"][0]))
-        except KeyError:
-            continue
-    return pattern
+def get_track_pattern(info: FileInfo):
+    return [(track.number, track.type[0]) for track in info.tracks]
 
 
 def language(string):
     try:
-        if len(string) == 2:
-            lang = pycountry.languages.get(alpha_2=string)
-        elif len(string) == 3:
-            lang = pycountry.languages.get(alpha_3=string)
-        else:
-            lang = pycountry.languages.lookup(string)
-        return lang
+        return languages.lookup(string)
     except LookupError:
         raise ValueError from None
 
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+Filesystem change notification.
+
+On Linux, inotify is used directly through ctypes. Elsewhere, directories are
+rescanned periodically and compared against the previous scan.
+
+Watchers report each changed file along with whether it has been closed since
+it was last written to (or was moved in whole). Polling can't tell, so it
+reports every change as closed, and relies on the file staying unchanged.
+"""
+
+# Imports {{{
+# builtins
+import ctypes
+import ctypes.util
+import logging
+import os
+import pathlib
+import select
+import struct
+import sys
+import time
+from typing import Dict, Iterable, List, Tuple
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+# inotify(7) constants {{{
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+# }}}
+
+EVENT = struct.Struct("iIII")
+MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF
+
+
+class InotifyWatcher:
+    """
+    Report files written to or moved into a set of directories.
+    """
+
+    def __init__(self, roots: Iterable[pathlib.Path], recurse: bool = False):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.add_watch_func = libc.inotify_add_watch
+        self.add_watch_func.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.recurse = recurse
+        self.watches: Dict[int, pathlib.Path] = {}
+        for root in roots:
+            self.add_watch(root)
+
+    def add_watch(self, directory: pathlib.Path) -> List[pathlib.Path]:
+        """
+        Watch a directory (and its subdirectories, if recursing), returning
+        any files already inside it.
+        """
+        wd = self.add_watch_func(self.fd, os.fsencode(directory), MASK)
+        if wd < 0:
+            log.warning(f"Could not watch {directory}: {os.strerror(ctypes.get_errno())}")
+            return []
+        self.watches[wd] = directory
+
+        existing = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recurse:
+                            existing.extend(self.add_watch(pathlib.Path(entry.path)))
+                    elif entry.is_file():
+                        existing.append(pathlib.Path(entry.path))
+        except OSError:
+            pass
+        return existing
+
+    def changes(self, timeout: float) -> Dict[pathlib.Path, bool]:
+        """
+        Wait up to `timeout` seconds, and return the files touched in that time,
+        and whether each was closed after its last write.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return {}
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return {}
+
+        changed: Dict[pathlib.Path, bool] = {}
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size : offset + EVENT.size + length]
+            offset += EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                log.warning("Too many filesystem events, some files may be missed.")
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or not name:
+                continue
+
+            path = self.watches[wd] / os.fsdecode(name.rstrip(b"\0"))
+            if mask & IN_ISDIR:
+                # a directory created or moved in may already contain files
+                if self.recurse and mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(dict.fromkeys(self.add_watch(path), True))
+            else:
+                # events come in order, so the last one says if it's still open
+                changed[path] = bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Report new or changed files by periodically rescanning directories.
+    """
+
+    def __init__(self, roots: Iterable[pathlib.Path], recurse: bool = False):
+        self.roots = list(roots)
+        self.recurse = recurse
+        self.snapshot = self.scan()
+
+    def scan(self) -> Dict[pathlib.Path, Tuple[int, int]]:
+        snapshot = {}
+        stack = list(self.roots)
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recurse:
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            snapshot[pathlib.Path(entry.path)] = (
+                                stat.st_size,
+                                stat.st_mtime_ns,
+                            )
+            except OSError:
+                continue
+        return snapshot
+
+    def changes(self, timeout: float) -> Dict[pathlib.Path, bool]:
+        time.sleep(timeout)
+        snapshot = self.scan()
+        changed = {
+            path: True
+            for path, state in snapshot.items()
+            if self.snapshot.get(path) != state
+        }
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def get_watcher(roots: Iterable[pathlib.Path], recurse: bool = False):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots, recurse)
+        except (OSError, AttributeError) as e:
+            log.warning(f"inotify unavailable ({e}), polling for changes instead.")
+    return PollingWatcher(roots, recurse)
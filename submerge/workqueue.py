@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+"""
+A work queue shared through an SQLite file.
+
+`submerge enqueue` stores a batch of files along with the module to run on
+them, and any number of `submerge worker` processes, on any machine that can
+reach the file, claim and process a few files at a time. Claimed files are
+leased to their worker, which keeps renewing the lease while it is alive; the
+files of a worker that dies are handed out again once its lease runs out.
+
+The queue uses a rollback journal rather than WAL, since WAL needs shared
+memory and doesn't work on network filesystems. Leases are timed by each
+host's clock, so the hosts' clocks should be kept in sync.
+"""
+
+# Imports {{{
+# builtins
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import socket
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+# }}}
+
+
+log = logging.getLogger(__name__)
+
+# seconds a worker may hold files without renewing its lease
+LEASE = 60.0
+# how many times a file is handed out before it is marked as failed
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY,
+    args TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    command INTEGER NOT NULL REFERENCES commands (id),
+    path TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    UNIQUE (command, path)
+);
+CREATE INDEX IF NOT EXISTS items_by_state ON items (state, lease_until);
+"""
+
+STATES = ["pending", "leased", "done", "failed"]
+
+
+class Item(NamedTuple):
+    id: int
+    args: List[str]
+    path: pathlib.Path
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    def __init__(self, path: pathlib.Path, timeout: float = 60):
+        self.path = path
+        self.lock = threading.Lock()
+        # autocommit, so transactions can be started explicitly with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(
+            str(path), timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=DELETE")
+            self.db.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Hold the write lock for a series of statements.
+        """
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def add(self, args: List[str], files: Iterable[pathlib.Path], chunk: int = 1000) -> int:
+        """
+        Queue files to be processed by a module (and its options), skipping any
+        already queued for it. Returns how many were added.
+        """
+        encoded = json.dumps(args)
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO commands (args) VALUES (?)", (encoded,))
+            (command,) = db.execute(
+                "SELECT id FROM commands WHERE args = ?", (encoded,)
+            ).fetchone()
+
+        added = 0
+        batch = []
+
+        def flush():
+            nonlocal added
+            with self.transaction() as db:
+                before = db.total_changes
+                db.executemany(
+                    "INSERT OR IGNORE INTO items (command, path) VALUES (?, ?)", batch
+                )
+                added += db.total_changes - before
+            batch.clear()
+
+        for file in files:
+            batch.append((command, str(file.absolute())))
+            if len(batch) >= chunk:
+                flush()
+        if batch:
+            flush()
+        return added
+
+    def claim(self, owner: str, limit: int, lease: float = LEASE) -> List[Item]:
+        """
+        Lease up to `limit` pending files (or files whose lease has run out).
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE items SET state = 'failed', owner = NULL,"
+                " error = 'Abandoned by its workers too many times'"
+                " WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS),
+            )
+            rows = db.execute(
+                "SELECT items.id, commands.args, items.path FROM items"
+                " JOIN commands ON commands.id = items.command"
+                " WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?)"
+                " ORDER BY items.id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            db.executemany(
+                "UPDATE items SET state = 'leased', owner = ?, lease_until = ?,"
+                " attempts = attempts + 1 WHERE id = ?",
+                [(owner, now + lease, id) for id, _, _ in rows],
+            )
+        return [Item(id, json.loads(args), pathlib.Path(path)) for id, args, path in rows]
+
+    def renew(self, owner: str, items: List[Item], lease: float = LEASE):
+        with self.transaction() as db:
+            db.executemany(
+                "UPDATE items SET lease_until = ? WHERE id = ? AND owner = ?"
+                " AND state = 'leased'",
+                [(time.time() + lease, item.id, owner) for item in items],
+            )
+
+    def finish(self, owner: str, items: List[Item], error: Optional[str] = None) -> int:
+        """
+        Mark files as done, or put them back in the queue if they failed (until
+        they have failed too many times). Files whose lease ran out and that
+        were claimed by another worker are left to it. Returns how many files
+        were recorded.
+        """
+        with self.transaction() as db:
+            before = db.total_changes
+            if error is None:
+                db.executemany(
+                    "UPDATE items SET state = 'done', owner = NULL, error = NULL"
+                    " WHERE id = ? AND owner = ? AND state = 'leased'",
+                    [(item.id, owner) for item in items],
+                )
+            else:
+                db.executemany(
+                    "UPDATE items SET owner = NULL, error = ?,"
+                    " state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END"
+                    " WHERE id = ? AND owner = ? AND state = 'leased'",
+                    [(error, MAX_ATTEMPTS, item.id, owner) for item in items],
+                )
+            return db.total_changes - before
+
+    def release(self, owner: str, items: List[Item]):
+        """
+        Give files back to the queue unprocessed, as if they were never claimed.
+        """
+        with self.transaction() as db:
+            db.executemany(
+                "UPDATE items SET state = 'pending', owner = NULL, attempts = attempts - 1"
+                " WHERE id = ? AND owner = ? AND state = 'leased'",
+                [(item.id, owner) for item in items],
+            )
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.db.execute("SELECT state, COUNT(*) FROM items GROUP BY state")
+            counts = dict(rows.fetchall())
+        return {state: counts.get(state, 0) for state in STATES}
+
+    def close(self):
+        self.db.close()
+
+
+class Heartbeat(threading.Thread):
+    """
+    Keep renewing the lease on some files until stopped.
+    """
+
+    def __init__(self, queue: WorkQueue, owner: str, items: List[Item], lease: float = LEASE):
+        super().__init__(name="submerge-heartbeat", daemon=True)
+        self.queue = queue
+        self.owner = owner
+        self.items = items
+        self.lease = lease
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.lease / 3):
+            try:
+                self.queue.renew(self.owner, self.items, self.lease)
+            except sqlite3.Error as e:
+                log.warning(f"Could not renew lease: {e}")
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+automerge must pair every video with its own subtitles, and with nothing
+rather than another episode's.
+"""
+
+# Imports {{{
+# builtins
+import pathlib
+
+# 3rd party
+import pytest
+
+# local modules
+from submerge.modules.automerge import Subtitle, SubtitleIndex, episode
+from submerge.utils import language
+
+# }}}
+
+
+ENGLISH = language("eng")
+
+SUBTITLES = [
+    "/tv/Show/Show.S01E01.en.srt",
+    "/tv/Show/Show.S01E01.fr.forced.srt",
+    "/tv/Show/show 1x02.srt",
+    "/tv/Show/Show.S01E04.srt",
+    "/subs/Other Show S01E05.srt",
+    "/subs/Show S01E05.srt",
+    "/subs/Unrelated S01E07.srt",
+    "/movies/Movie Name (2010).srt",
+    "/movies/Another Movie 1999.srt",
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return SubtitleIndex(Subtitle(pathlib.Path(path), ENGLISH) for path in SUBTITLES)
+
+
+def matched(index, video):
+    return sorted(str(subtitle.path) for subtitle in index.match(pathlib.Path(video)))
+
+
+@pytest.mark.parametrize(
+    "name, stem, code",
+    [
+        ("Show.S01E01.en.srt", "Show.S01E01", "eng"),
+        ("Show.S01E01.fre.forced.srt", "Show.S01E01", "fra"),
+        ("Show.S01E01.sdh.de.srt", "Show.S01E01", "deu"),
+        # only tags with an ISO 639-1 language count, not any three letters
+        ("Notes.the.srt", "Notes.the", "eng"),
+        ("Show.S01E01.srt", "Show.S01E01", "eng"),
+    ],
+)
+def test_subtitle_tags(name, stem, code):
+    subtitle = Subtitle(pathlib.Path(name), ENGLISH)
+    assert subtitle.stem == stem
+    assert subtitle.language.alpha_3 == code
+
+
+@pytest.mark.parametrize(
+    "stem, number",
+    [
+        ("Show.S01E02.1080p", (1, 2)),
+        ("show 1x02", (1, 2)),
+        ("Show - s2e113", (2, 113)),
+        ("Movie 1080p", None),
+    ],
+)
+def test_episode(stem, number):
+    assert episode(stem) == number
+
+
+def test_same_stem_in_every_language(index):
+    assert matched(index, "/tv/Show/Show.S01E01.mkv") == [
+        "/tv/Show/Show.S01E01.en.srt",
+        "/tv/Show/Show.S01E01.fr.forced.srt",
+    ]
+
+
+def test_stems_are_normalized(index):
+    assert matched(index, "/movies/Movie.Name.2010.mkv") == ["/movies/Movie Name (2010).srt"]
+
+
+def test_episode_in_the_same_directory(index):
+    assert matched(index, "/tv/Show/Show.S01E02.1080p.mkv") == ["/tv/Show/show 1x02.srt"]
+
+
+def test_episode_of_the_closest_show(index):
+    assert matched(index, "/tv/Show/Show.S01E05.mkv") == ["/subs/Show S01E05.srt"]
+
+
+def test_episode_of_another_show_elsewhere(index):
+    assert matched(index, "/tv/Third/Third.Show.S01E07.mkv") == []
+
+
+def test_never_another_episode(index):
+    assert matched(index, "/tv/Show/Show.S01E03.mkv") == []
+
+
+def test_similar_names(index):
+    assert matched(index, "/movies/Another.Movie.1999.BluRay.mkv") == [
+        "/movies/Another Movie 1999.srt"
+    ]
+
+
+def test_nothing_similar(index):
+    assert matched(index, "/movies/Something.Else.Entirely.mkv") == []
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""
+The native reader must describe files exactly as `mkvmerge -J` does.
+
+Fixtures are generated with benchmarks/fixtures.py, covering every preset
+layout, with and without CRC-32 elements, BCP 47 languages, padding, track
+names and Language elements. The comparison with mkvmerge is skipped when mkvtoolnix
+isn't installed.
+"""
+
+# Imports {{{
+# builtins
+import itertools
+import json
+import pathlib
+import shutil
+import subprocess
+import sys
+
+# 3rd party
+import pytest
+
+# local modules
+from submerge import ebml
+from submerge.records import FileInfo
+
+# }}}
+
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "benchmarks"))
+
+import fixtures  # noqa: E402
+
+
+TYPES = {"v": "video", "a": "audio", "s": "subtitles", "x": "subtitles", "p": "subtitles"}
+
+# (layout, padding, bcp47, crc, names)
+VARIANTS = list(
+    itertools.product(
+        [*fixtures.LAYOUTS, "v,a,s"],
+        [0, 2, 66],
+        [False, True],
+        [False, True],
+        [False, True],
+    )
+)
+
+
+def variant_id(variant) -> str:
+    layout, padding, bcp47, crc, names = variant
+    return (
+        f"{layout}-padding{padding}"
+        + ("-bcp47" if bcp47 else "")
+        + ("-crc" if crc else "")
+        + ("-names" if names else "")
+    )
+
+
+@pytest.fixture(params=VARIANTS, ids=variant_id)
+def fixture(request, tmp_path):
+    layout, padding, bcp47, crc, names = request.param
+    tracks = fixtures.parse_layout(layout)
+    if layout == "v,a,s":
+        # no Language elements at all, which means English
+        tracks = [(kind, None) for kind, _ in tracks]
+    file = tmp_path / "fixture.mkv"
+    file.write_bytes(
+        fixtures.mkv(tracks, title="fixture", padding=padding, bcp47=bcp47, crc=crc, names=names)
+    )
+    return file, tracks, names
+
+
+def test_read_matches_layout(fixture):
+    file, tracks, names = fixture
+    info = ebml.read(file)
+    assert [
+        (track.id, track.number, track.type, track.language, track.name) for track in info.tracks
+    ] == [
+        (index, index + 1, TYPES[kind], language or "eng", f"Track {index + 1}" if names else None)
+        for index, (kind, language) in enumerate(tracks)
+    ]
+
+
+def test_records_round_trip(fixture):
+    file, _, _ = fixture
+    info = ebml.read(file)
+    assert FileInfo.from_json(json.loads(json.dumps(info.to_json()))) == info
+    assert FileInfo.from_mkvmerge(ebml.probe(file)) == info
+
+
+@pytest.mark.skipif(shutil.which("mkvmerge") is None, reason="mkvmerge is not installed")
+def test_read_matches_mkvmerge(fixture):
+    file, _, _ = fixture
+    proc = subprocess.run(["mkvmerge", "-J", str(file)], capture_output=True, text=True)
+    assert proc.returncode <= 1, proc.stdout
+    assert ebml.read(file) == FileInfo.from_mkvmerge(json.loads(proc.stdout))
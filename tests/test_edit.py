@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+"""
+Native track edits must leave files just as mkvpropedit would.
+
+Fixtures covering what the native editor has to handle (CRC-32 elements,
+BCP 47 languages, missing Language elements, little or no padding) are edited
+in place. Edits must keep the file's size and every CRC-32, and edits that
+don't fit must leave the file untouched. Read back with `mkvmerge -J`, the
+tracks must match the expected numbers and languages, and the same edits made
+by mkvpropedit on a copy. Those comparisons are skipped when mkvtoolnix isn't
+installed.
+"""
+
+# Imports {{{
+# builtins
+import itertools
+import json
+import pathlib
+import shutil
+import subprocess
+import sys
+import zlib
+from typing import Dict, List, NamedTuple, Tuple
+
+# 3rd party
+import pytest
+
+# local modules
+from submerge import ebml
+
+# }}}
+
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "benchmarks"))
+
+import fixtures  # noqa: E402
+
+
+LAYOUT = [("v", None), ("a", "jpn"), ("a", "eng"), ("s", "und")]
+
+
+class Case(NamedTuple):
+    name: str
+    edits: Dict[str, Dict[str, str]]
+    # (number, language) of each track, in file order, after the edits
+    expected: List[Tuple[int, str]]
+
+
+CASES = [
+    Case(
+        "language",
+        {"track:@2": {"language": "fre"}},
+        [(1, "eng"), (2, "fre"), (3, "eng"), (4, "und")],
+    ),
+    Case(
+        "terminology-code",
+        {"track:@2": {"language": "deu"}},
+        [(1, "eng"), (2, "ger"), (3, "eng"), (4, "und")],
+    ),
+    Case(
+        "missing-language",
+        {"track:@1": {"language": "ger"}},
+        [(1, "ger"), (2, "jpn"), (3, "eng"), (4, "und")],
+    ),
+    Case(
+        "language-ietf",
+        {"track:@4": {"language-ietf": "pt-BR"}},
+        [(1, "eng"), (2, "jpn"), (3, "eng"), (4, "por")],
+    ),
+    Case(
+        "reorder",
+        {"track:@2": {"track-number": "3"}, "track:@3": {"track-number": "2"}},
+        [(1, "eng"), (3, "jpn"), (2, "eng"), (4, "und")],
+    ),
+    Case(
+        "wider-number",
+        {"track:@4": {"track-number": "300", "language": "spa"}},
+        [(1, "eng"), (2, "jpn"), (3, "eng"), (300, "spa")],
+    ),
+]
+
+# lengths of the Void after the Tracks element: none, the smallest possible,
+# one byte more, and the usual
+PADDINGS = [0, 2, 3, 66]
+
+# (case, padding, bcp47, crc)
+VARIANTS = list(itertools.product(CASES, PADDINGS, [False, True], [False, True]))
+
+
+def variant_id(variant) -> str:
+    case, padding, bcp47, crc = variant
+    return f"{case.name}-padding{padding}" + ("-bcp47" if bcp47 else "") + ("-crc" if crc else "")
+
+
+def identify(file: pathlib.Path) -> dict:
+    proc = subprocess.run(["mkvmerge", "-J", str(file)], capture_output=True, text=True)
+    assert proc.returncode <= 1, proc.stdout
+    return json.loads(proc.stdout)
+
+
+def tracks(metadata: dict) -> List[Tuple[int, str]]:
+    return [
+        (track["properties"]["number"], track["properties"].get("language", "eng"))
+        for track in metadata["tracks"]
+    ]
+
+
+def fields(metadata: dict) -> List[Tuple[int, str, str]]:
+    return [
+        (
+            track["properties"]["number"],
+            track["properties"].get("language", "eng"),
+            track["properties"].get("language_ietf"),
+        )
+        for track in metadata["tracks"]
+    ]
+
+
+def check_crcs(data: bytes):
+    """
+    Verify the CRC-32 of the Tracks element and of each of its entries.
+    """
+    _, _, found = ebml.locate(data)
+    _, offset, size = found[ebml.TRACKS]
+    masters = [(offset, size)] + [
+        (child_offset, child_size)
+        for element_id, child_offset, child_size in ebml.children(data, offset, offset + size)
+        if element_id == ebml.TRACK_ENTRY
+    ]
+    for start, length in masters:
+        element_id, pos, crc_offset, crc_size = next(ebml.spans(data, start, start + length))
+        if element_id != ebml.CRC32:
+            continue
+        expected = int.from_bytes(data[crc_offset : crc_offset + crc_size], "little")
+        assert zlib.crc32(data[crc_offset + crc_size : start + length]) == expected, pos
+
+
+@pytest.fixture(params=VARIANTS, ids=variant_id)
+def edited(request, tmp_path):
+    """
+    A fixture edited natively, along with its case and original contents, or
+    skip if the edits didn't fit.
+    """
+    case, padding, bcp47, crc = request.param
+    file = tmp_path / "native.mkv"
+    file.write_bytes(fixtures.mkv(LAYOUT, title="edit", padding=padding, bcp47=bcp47, crc=crc))
+    original = file.read_bytes()
+
+    try:
+        ebml.edit(file, case.edits)
+    except ebml.Unsupported:
+        assert file.read_bytes() == original, "the file was changed by an edit that didn't fit"
+        pytest.skip("the edits don't fit in place")
+    return file, case, original
+
+
+def test_edit_keeps_size_and_checksums(edited):
+    file, case, original = edited
+    data = file.read_bytes()
+    assert len(data) == len(original)
+    check_crcs(data)
+
+
+def test_edit_reads_back(edited):
+    file, case, _ = edited
+    metadata = ebml.probe(file)
+    assert tracks(metadata) == case.expected
+    for track in metadata["tracks"]:
+        ietf = track["properties"].get("language_ietf")
+        if ietf is not None:
+            assert ebml.bcp47_to_legacy(ietf) == track["properties"]["language"]
+
+
+@pytest.mark.skipif(shutil.which("mkvmerge") is None, reason="mkvmerge is not installed")
+def test_edit_matches_mkvmerge(edited):
+    file, case, _ = edited
+    metadata = identify(file)
+    assert tracks(metadata) == case.expected
+    assert fields(metadata) == fields(ebml.probe(file))
+
+
+@pytest.mark.skipif(
+    shutil.which("mkvmerge") is None or shutil.which("mkvpropedit") is None,
+    reason="mkvtoolnix is not installed",
+)
+def test_edit_matches_mkvpropedit(edited, tmp_path):
+    file, case, original = edited
+    reference = tmp_path / "mkvpropedit.mkv"
+    reference.write_bytes(original)
+    cmd = ["mkvpropedit", str(reference)]
+    for selector, properties in case.edits.items():
+        cmd.extend(["--edit", selector])
+        for name, value in properties.items():
+            cmd.extend(["--set", f"{name}={value}"])
+    subprocess.run(cmd, check=True, capture_output=True)
+    assert fields(identify(file)) == fields(identify(reference))
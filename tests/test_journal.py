@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+A journal must let --resume skip exactly the files finished by an earlier run
+that haven't changed since, and survive being cut short.
+"""
+
+# Imports {{{
+# builtins
+import json
+import os
+
+# 3rd party
+import pytest
+
+# local modules
+from submerge import journal as journal_module
+from submerge.cache import Fingerprint
+from submerge.journal import Entry, Journal
+
+# }}}
+
+
+JOB = json.dumps(["tag", {"language": ["0", "eng"]}])
+
+
+@pytest.fixture
+def files(tmp_path):
+    videos = []
+    for n in range(4):
+        video = tmp_path / f"{n}.mkv"
+        video.write_bytes(b"video %d" % n)
+        videos.append(video)
+    return videos
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "journal.ndjson"
+
+
+def finish(path, files, resume=False):
+    with Journal(path, JOB, resume=resume) as journal:
+        for file in journal.pending(files):
+            journal.record(file, Fingerprint.of(file))
+
+
+def test_resume_skips_finished_files(path, files):
+    finish(path, files[:2])
+
+    with Journal(path, JOB, resume=True) as journal:
+        assert list(journal.pending(files)) == files[2:]
+        assert journal.skipped == 2
+
+
+def test_without_resume_starts_over(path, files):
+    finish(path, files[:2])
+
+    with Journal(path, JOB) as journal:
+        assert list(journal.pending(files)) == files
+
+
+def test_changed_files_are_redone(path, files):
+    finish(path, files)
+    files[1].write_bytes(b"edited by someone else")
+    files[3].unlink()
+
+    with Journal(path, JOB, resume=True) as journal:
+        assert list(journal.pending(files)) == [files[1], files[3]]
+
+
+def test_resume_keeps_earlier_records(path, files):
+    finish(path, files[:1])
+    finish(path, files[:2], resume=True)
+
+    with Journal(path, JOB, resume=True) as journal:
+        assert list(journal.pending(files)) == files[2:]
+
+
+def test_unfinished_files_are_reported(path, files):
+    with Journal(path, JOB) as journal:
+        pending = list(journal.pending(files))
+        journal.record(pending[0], Fingerprint.of(pending[0]))
+    assert journal.unfinished == {str(file.absolute()) for file in files[1:]}
+
+
+def test_entry_of_an_output(files):
+    source, output = files[:2]
+    entry = Entry(str(source), Fingerprint.of(source), Fingerprint.of(output), str(output))
+    assert entry.is_current()
+
+    # the source changing means the output is out of date
+    source.write_bytes(b"a new release")
+    assert not entry.is_current()
+
+
+def test_entry_of_a_missing_file(files):
+    entry = Entry(str(files[0]), None, Fingerprint.of(files[0]))
+    files[0].unlink()
+    assert not entry.is_current()
+
+
+def test_cut_short_line_is_ignored(path, files):
+    finish(path, files[:2])
+    with open(path, "a", encoding="utf-8") as fp:
+        fp.write('{"file": "' + str(files[2].absolute()))
+
+    with Journal(path, JOB, resume=True) as journal:
+        assert list(journal.pending(files)) == files[2:]
+        journal.record(files[2], Fingerprint.of(files[2]))
+
+    with Journal(path, JOB, resume=True) as journal:
+        assert list(journal.pending(files)) == files[3:]
+
+
+def test_journal_of_another_command(path, files):
+    finish(path, files)
+    with pytest.raises(ValueError):
+        Journal(path, json.dumps(["tracks", {}]), resume=True)
+
+
+def test_readonly_records_nothing(path, files):
+    finish(path, files[:1])
+    before = path.read_bytes()
+
+    with Journal(path, JOB, resume=True, readonly=True) as journal:
+        for file in journal.pending(files):
+            journal.record(file, Fingerprint.of(file))
+    assert path.read_bytes() == before
+
+
+def test_records_are_synced_in_batches(path, files, monkeypatch):
+    synced = []
+    monkeypatch.setattr(journal_module, "SYNC_EVERY", 3)
+    monkeypatch.setattr(journal_module, "SYNC_INTERVAL", 3600.0)
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd))
+
+    journal = Journal(path, JOB)
+    # the header is synced straight away
+    assert len(synced) == 1
+    for file in files[:2]:
+        journal.record(file, Fingerprint.of(file))
+    assert len(synced) == 1
+    journal.record(files[2], Fingerprint.of(files[2]))
+    assert len(synced) == 2
+
+    journal.record(files[3], Fingerprint.of(files[3]))
+    journal.close()
+    assert len(synced) == 3
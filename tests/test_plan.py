@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""
+A plan must make every edit to a file in a single mkvpropedit call, and
+survive being saved and loaded.
+"""
+
+# Imports {{{
+# builtins
+import io
+import json
+import pathlib
+
+# 3rd party
+import pytest
+
+# local modules
+from submerge.cache import Fingerprint
+from submerge.plan import Edit, Plan
+
+# }}}
+
+
+FILE = pathlib.Path("/videos/a.mkv")
+OTHER = pathlib.Path("/videos/b.mkv")
+
+
+def test_edits_to_a_file_make_one_command():
+    plan = Plan()
+    plan.add(FILE, "track:@1", "track-number", 2)
+    plan.add(FILE, "track:@2", "track-number", 1)
+    plan.add(FILE, "track:@2", "language", "eng")
+
+    assert len(plan) == 1
+    assert plan.command(FILE) == [
+        "mkvpropedit",
+        str(FILE),
+        "--edit",
+        "track:@1",
+        "--set",
+        "track-number=2",
+        "--edit",
+        "track:@2",
+        "--set",
+        "track-number=1",
+        "--set",
+        "language=eng",
+    ]
+
+
+def test_later_edits_win():
+    plan = Plan()
+    plan.add(FILE, "track:@3", "language", "und")
+    plan.add(FILE, "track:@3", "language", "fre")
+
+    assert plan.selectors(FILE) == {"track:@3": {"language": "fre"}}
+    assert plan.command(FILE)[-1] == "language=fre"
+
+
+def test_one_command_per_file():
+    plan = Plan()
+    plan.add(FILE, "track:@1", "language", "eng")
+    plan.add(OTHER, "track:@1", "language", "jpn")
+    plan.add(FILE, "track:@2", "language", "eng")
+
+    commands = list(plan.commands())
+    assert [cmd[1] for cmd in commands] == [str(FILE), str(OTHER)]
+    assert commands[0].count("--edit") == 2
+
+
+def test_update_merges_plans():
+    tagged, reordered = Plan(), Plan()
+    tagged.add(FILE, "track:@3", "language", "eng")
+    reordered.add(FILE, "track:@2", "track-number", 3)
+    reordered.add(OTHER, "track:@2", "track-number", 3)
+    reordered.fingerprints[OTHER] = Fingerprint(1, 2, 3, 4)
+
+    tagged.update(reordered)
+    assert len(tagged) == 2
+    assert tagged.selectors(FILE) == {
+        "track:@3": {"language": "eng"},
+        "track:@2": {"track-number": "3"},
+    }
+    assert tagged.fingerprints == {OTHER: Fingerprint(1, 2, 3, 4)}
+
+
+def test_dump_and_load(tmp_path):
+    file = tmp_path / "a.mkv"
+    file.write_bytes(b"video")
+    plan = Plan()
+    plan.add(file, "track:@2", "language", "ger")
+    plan.add(file, "track:@2", "track-number", 3)
+
+    saved = io.StringIO()
+    plan.dump(saved)
+    saved.seek(0)
+    loaded = Plan.load(saved)
+
+    assert loaded.edits == {
+        file: [Edit("track:@2", "language", "ger"), Edit("track:@2", "track-number", "3")]
+    }
+    assert loaded.fingerprints == {file: Fingerprint.of(file)}
+    assert loaded.command(file) == plan.command(file)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        [],
+        {"version": 99, "files": []},
+        {"version": 1},
+        {"version": 1, "files": [{"file": "/videos/a.mkv"}]},
+        {"version": 1, "files": [{"file": "/videos/a.mkv", "edits": [{"selector": "track:@1"}]}]},
+        {
+            "version": 1,
+            "files": [
+                {
+                    "file": "/videos/a.mkv",
+                    "edits": [{"selector": "track:@1", "property": "language", "value": 1}],
+                }
+            ],
+        },
+    ],
+)
+def test_load_rejects_malformed_plans(data):
+    with pytest.raises(ValueError):
+        Plan.load(io.StringIO(json.dumps(data)))
+
+
+def test_changed_files_are_not_edited(tmp_path):
+    file = tmp_path / "a.mkv"
+    file.write_bytes(b"video")
+    plan = Plan()
+    plan.add(file, "track:@2", "language", "ger")
+    plan.fingerprints[file] = Fingerprint.of(file)
+    file.write_bytes(b"a different video")
+
+    [outcome] = plan.apply()
+    assert not outcome.edited
+    assert "changed" in outcome.error
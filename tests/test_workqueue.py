@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""
+Leases must keep two workers from recording the same file, even when one of
+them stalls past its lease and the file is handed to the other.
+"""
+
+# Imports {{{
+# builtins
+import pathlib
+import threading
+import time
+
+# 3rd party
+import pytest
+
+# local modules
+from submerge.workqueue import WorkQueue
+
+# }}}
+
+
+LEASE = 0.2
+
+
+@pytest.fixture
+def queue_file(tmp_path):
+    path = tmp_path / "queue.db"
+    queue = WorkQueue(path)
+    queue.add(["tag", "-l", "0", "eng"], [pathlib.Path(f"/videos/{n}.mkv") for n in range(4)])
+    queue.close()
+    return path
+
+
+def states(path):
+    queue = WorkQueue(path)
+    try:
+        rows = queue.db.execute("SELECT path, state, owner, attempts FROM items ORDER BY id")
+        return {pathlib.Path(path).name: tuple(row) for path, *row in rows}
+    finally:
+        queue.close()
+
+
+def test_stalled_worker_cannot_finish_reclaimed_files(queue_file):
+    stalled, other = WorkQueue(queue_file), WorkQueue(queue_file)
+    claimed = stalled.claim("stalled", 2, lease=LEASE)
+    time.sleep(LEASE * 1.5)
+
+    reclaimed = other.claim("other", 2, lease=60)
+    assert [item.id for item in reclaimed] == [item.id for item in claimed]
+
+    # the stalled worker wakes up: neither success nor failure is recorded
+    assert stalled.finish("stalled", claimed) == 0
+    assert stalled.finish("stalled", claimed, "mkvpropedit failed") == 0
+    assert states(queue_file)["0.mkv"] == ("leased", "other", 2)
+
+    assert other.finish("other", reclaimed) == 2
+    assert states(queue_file)["0.mkv"] == ("done", None, 2)
+
+
+def test_stalled_worker_cannot_renew_or_release_reclaimed_files(queue_file):
+    stalled, other = WorkQueue(queue_file), WorkQueue(queue_file)
+    claimed = stalled.claim("stalled", 1, lease=LEASE)
+    time.sleep(LEASE * 1.5)
+    other.claim("other", 1, lease=60)
+
+    stalled.renew("stalled", claimed, lease=60)
+    stalled.release("stalled", claimed)
+    assert states(queue_file)["0.mkv"] == ("leased", "other", 2)
+
+
+def test_two_workers_with_one_stalling(queue_file):
+    processed = []
+    lock = threading.Lock()
+
+    def work(owner, stall):
+        queue = WorkQueue(queue_file)
+        try:
+            while True:
+                items = queue.claim(owner, 1, lease=LEASE)
+                if not items:
+                    if not queue.counts()["leased"]:
+                        return
+                    time.sleep(LEASE / 4)
+                    continue
+                if stall:
+                    # stop renewing for longer than the lease, once
+                    time.sleep(LEASE * 3)
+                    stall = False
+                if queue.finish(owner, items):
+                    with lock:
+                        processed.extend((owner, item.path.name) for item in items)
+        finally:
+            queue.close()
+
+    workers = [
+        threading.Thread(target=work, args=("stalled", True)),
+        threading.Thread(target=work, args=("steady", False)),
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join(timeout=30)
+
+    # every file was recorded exactly once, and the stalled file by the other worker
+    assert sorted(name for _, name in processed) == [f"{n}.mkv" for n in range(4)]
+    assert ("stalled", "0.mkv") not in processed
+    assert all(state == "done" for state, _, _ in states(queue_file).values())